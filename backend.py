@@ -0,0 +1,178 @@
+# backend.py - NumPy alpha compositing for the tablecloth layers
+# Standard python library
+import sys
+from collections import OrderedDict
+from timeit import default_timer as timer
+# Image manipulation libraries
+from PIL import Image
+# NumPy is optional, without it everything is composited by Pillow
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+BACKENDS = ("pillow", "numpy")
+
+
+def available(name):
+    if name not in BACKENDS:
+        raise ValueError("Unknown render backend '%s', use one of: %s"
+                         % (name, ", ".join(BACKENDS)))
+    return name == "pillow" or numpy is not None
+
+
+class NumpyBackend:
+    # Does the same integer maths as Image.paste with a mask, so the result is
+    # the same byte by byte:
+    #   out = (dst * (255 - alpha) + src * alpha + 128) / 255
+    # with the division done as ((t >> 8) + t) >> 8. Every tile keeps
+    # src * alpha + 128 precomputed (premultiplied) next to 255 - alpha, so a
+    # blend is one multiply, one add and the division, all in place over the
+    # whole tile.
+
+    def __init__(self, max_tiles=32):
+        if numpy is None:
+            raise ImportError("The numpy render backend needs NumPy installed")
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._base = (None, None)
+        self._scratch = numpy.empty(0, dtype=numpy.uint16)
+        self._shifted = numpy.empty(0, dtype=numpy.uint16)
+
+    def _prepared(self, tile, mask):
+        # Keyed by the tile itself, the logo cache hands out the same objects.
+        # Only the part with some alpha is kept, the rest would leave the
+        # canvas as it was anyway.
+        key = id(tile)
+        if key in self._tiles and self._tiles[key][0] is tile:
+            self._tiles.move_to_end(key)
+            return self._tiles[key][1:]
+        bbox = mask.getbbox()
+        if bbox is None:
+            prepared = ((0, 0), None, None)
+        else:
+            alpha = numpy.asarray(mask.crop(bbox),
+                                  dtype=numpy.uint16)[:, :, None]
+            premultiplied = numpy.asarray(tile.crop(bbox),
+                                          dtype=numpy.uint16) * alpha + 128
+            prepared = (bbox[:2], premultiplied, 255 - alpha)
+        self._tiles[key] = (tile,) + prepared
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return prepared
+
+    def _buffers(self, shape):
+        size = shape[0] * shape[1] * shape[2]
+        if self._scratch.size < size:
+            self._scratch = numpy.empty(size, dtype=numpy.uint16)
+            self._shifted = numpy.empty(size, dtype=numpy.uint16)
+        return (self._scratch[:size].reshape(shape),
+                self._shifted[:size].reshape(shape))
+
+    def blend(self, canvas, tile, mask, position, box=None):
+        # canvas is an uint8 array, blended in place. With a box (left, top,
+        # right, bottom) only the part of the tile inside it is blended.
+        (offset_x, offset_y), premultiplied, inverse = self._prepared(tile,
+                                                                     mask)
+        if premultiplied is None:
+            return
+        left, top = position[0] + offset_x, position[1] + offset_y
+        height, width = premultiplied.shape[:2]
+        if box is None:
+            box = (0, 0, canvas.shape[1], canvas.shape[0])
+        clip_left, clip_top = max(left, box[0], 0), max(top, box[1], 0)
+        clip_right = min(left + width, box[2], canvas.shape[1])
+        clip_bottom = min(top + height, box[3], canvas.shape[0])
+        if clip_left >= clip_right or clip_top >= clip_bottom:
+            return
+        region = canvas[clip_top:clip_bottom, clip_left:clip_right]
+        if region.shape != premultiplied.shape:
+            # Partly outside of the canvas or the box
+            rows = slice(clip_top - top, clip_bottom - top)
+            columns = slice(clip_left - left, clip_right - left)
+            premultiplied = premultiplied[rows, columns]
+            inverse = inverse[rows, columns]
+        scratch, shifted = self._buffers(region.shape)
+        numpy.multiply(region, inverse, out=scratch)
+        numpy.add(scratch, premultiplied, out=scratch)
+        numpy.right_shift(scratch, 8, out=shifted)
+        numpy.add(scratch, shifted, out=scratch)
+        numpy.right_shift(scratch, 8, out=scratch)
+        region[...] = scratch
+
+    def compose(self, size, layers):
+        # Every layer is pasted over a transparent canvas with its own alpha
+        canvas = numpy.zeros((size[1], size[0], 4), dtype=numpy.uint8)
+        for layer in layers:
+            self.blend(canvas, layer, layer.getchannel("A"), (0, 0))
+            # Full layers are not worth keeping around
+            self._tiles.pop(id(layer), None)
+        return Image.fromarray(canvas, "RGBA")
+
+    def _base_array(self, base):
+        # The base layer is read only, its array is kept to copy from
+        if self._base[0] is not base:
+            self._base = (base, numpy.asarray(base, dtype=numpy.uint8))
+        return self._base[1]
+
+    def canvas(self, base):
+        # A writable array with the base layer in it
+        return self._base_array(base).copy()
+
+    def restore(self, canvas, base, box):
+        left, top, right, bottom = box
+        canvas[top:bottom, left:right] = \
+            self._base_array(base)[top:bottom, left:right]
+
+    @staticmethod
+    def image(canvas):
+        return Image.fromarray(canvas, "RGBA")
+
+    def render(self, base, tiles):
+        canvas = self.canvas(base)
+        for tile, mask, position in tiles:
+            self.blend(canvas, tile, mask, position)
+        return self.image(canvas)
+
+
+def make_backend(name):
+    if name == "pillow":
+        return None
+    if not available(name):
+        raise ImportError("The %s render backend is not available" % name)
+    return NumpyBackend()
+
+
+def benchmark(team_ids=(1, 1, 1, 1), technical_lines=True, repeat=10):
+    # Times full renders with both backends over the images in the programme
+    # folder and returns (backend, seconds per render) and the largest
+    # difference between their outputs
+    from render import TableclothRenderer
+
+    results = []
+    outputs = []
+    for name in BACKENDS:
+        if not available(name):
+            continue
+        renderer = TableclothRenderer(backend=name)
+        outputs.append(renderer.render(*team_ids,
+            technical_lines=technical_lines))
+        start = timer()
+        for i in range(repeat):
+            renderer.render(*team_ids, technical_lines=technical_lines)
+        results.append((name, (timer() - start) / repeat))
+    max_difference = 0
+    if len(outputs) == 2:
+        max_difference = int(numpy.abs(
+            numpy.asarray(outputs[0], dtype=numpy.int16)
+            - numpy.asarray(outputs[1], dtype=numpy.int16)).max())
+    return results, max_difference
+
+
+if __name__ == '__main__':
+    results, max_difference = benchmark()
+    for name, seconds in results:
+        print("%s: %.1f ms per render" % (name, seconds * 1000))
+    print("Largest difference between backends: %d" % max_difference)
+    sys.exit(0)
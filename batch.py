@@ -0,0 +1,16 @@
+# batch.py - Render every table of a schedule without opening the GUI. Kept
+# for the scripts that already call it, it's "cli.py schedule".
+# Standard python library
+import sys
+# Custom libraries
+from cli import main as cli_main
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    return cli_main(["schedule"] + list(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
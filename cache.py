@@ -0,0 +1,273 @@
+# cache.py - Render caches that are kept on disk between runs
+# Standard python library
+import os
+import glob
+import shutil
+import time
+import hashlib
+import threading
+from pathlib import Path
+# Image manipulation libraries
+from PIL import Image
+
+
+# Absolute path to the current folder as constant for easy access
+THISDIR = str(Path(__file__).resolve().parent)
+CACHE_DIR = os.path.join(THISDIR, "cache")
+LOGOS_DIR = os.path.join(THISDIR, "images", "logos")
+
+# Bump it whenever the way the base layer is composited changes, so the old
+# files are not used anymore
+BASE_LAYER_VERSION = 1
+# Base layers are read and written in strips of rows of about this size, so
+# there's never a second full copy of them in memory
+STRIP_BYTES = 1024 * 1024
+# Base layers of another mat are only removed once nobody wrote them for this
+# long, another process may be using them
+STALE_SECONDS = 60 * 60
+
+
+def unique_temp_path(path):
+    # Other processes and threads may be writing the same file
+    return "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return "%s:%d:%d" % (os.path.abspath(path), stat.st_mtime_ns,
+                         stat.st_size)
+
+
+# Content hashes by file fingerprint, so a file is only read again if it
+# changed
+_content_hashes = {}
+
+
+def content_hash(path):
+    fingerprint = file_fingerprint(path)
+    if fingerprint not in _content_hashes:
+        digest = hashlib.sha1()
+        with open(path, "rb") as fp_content:
+            for chunk in iter(lambda: fp_content.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _content_hashes[fingerprint] = digest.hexdigest()
+    return _content_hashes[fingerprint]
+
+
+class BaseLayerCache:
+    # The mat, border and technical lines already composited, one file for
+    # each variant. Any change of the source files or the image route gives
+    # a different key, so outdated layers are never read back.
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "base")):
+        self.cache_dir = cache_dir
+
+    def key(self, sources, extra=None):
+        digest = hashlib.sha1()
+        digest.update(b"v%d" % BASE_LAYER_VERSION)
+        for source in sources:
+            digest.update(file_fingerprint(source).encode("utf-8"))
+        digest.update(repr(extra).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, variant, key):
+        return os.path.join(self.cache_dir, "base-v%d-%s-%s.rgba"
+                            % (BASE_LAYER_VERSION, variant, key))
+
+    def load(self, variant, key, size):
+        image = Image.new("RGBA", size)
+        if not self.load_into(variant, key, image):
+            return None
+        return image
+
+    def load_into(self, variant, key, image):
+        # Reads the layer straight into an image of the same size, RGBA or
+        # RGB (the alpha is dropped). Returns False if there's none.
+        path = self._path(variant, key)
+        width, height = image.size
+        if not os.path.exists(path) \
+        or os.path.getsize(path) != width * height * 4:
+            return False
+        rawmode = "RGBA" if image.mode == "RGBA" else "RGBX"
+        rows = max(1, STRIP_BYTES // (width * 4))
+        with open(path, "rb") as fp_layer:
+            for top in range(0, height, rows):
+                strip_height = min(rows, height - top)
+                data = fp_layer.read(width * strip_height * 4)
+                if len(data) != width * strip_height * 4:
+                    return False
+                image.paste(Image.frombuffer(image.mode,
+                    (width, strip_height), data, "raw", rawmode, 0, 1),
+                    (0, top))
+        return True
+
+    def store(self, variant, key, image):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(variant, key)
+        temp_path = unique_temp_path(path)
+        width, height = image.size
+        rows = max(1, STRIP_BYTES // (width * 4))
+        with open(temp_path, "wb") as fp_layer:
+            for top in range(0, height, rows):
+                fp_layer.write(image.crop((0, top, width,
+                    min(height, top + rows))).tobytes())
+        os.replace(temp_path, path)
+        self.remove_stale(variant, path)
+
+    def remove_stale(self, variant, current):
+        # Layers of an older version go at once, the ones of other mats for
+        # this variant once they haven't been written in a while
+        current_prefix = "base-v%d-" % BASE_LAYER_VERSION
+        now = time.time()
+        for old_path in glob.glob(os.path.join(self.cache_dir,
+                                               "base-*-%s-*.rgba" % variant)):
+            if old_path == current:
+                continue
+            try:
+                if os.path.basename(old_path).startswith(current_prefix) \
+                and now - os.stat(old_path).st_mtime < STALE_SECONDS:
+                    continue
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.cache_dir, "base-*.rgba")):
+            os.remove(path)
+
+
+class RenderCache:
+    # Finished tablecloths stored by a hash of everything that goes in them,
+    # so the same table is never rendered twice. The least recently used files
+    # are removed once the folder is over max_bytes.
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "renders"),
+        max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(parts):
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, destination):
+        # Hard link the cached file into place, or copy it if that can't be
+        # done. Returns False if there's nothing cached.
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            try:
+                os.link(path, destination)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(path, destination)
+            # The modification time tells which ones were used last
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted in the meantime
+            return False
+        return True
+
+    def store(self, key, source):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = unique_temp_path(path)
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        files = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*", "*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def size_bytes(self):
+        return sum(os.path.getsize(path) for path in
+                   glob.glob(os.path.join(self.cache_dir, "*", "*")))
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class ThumbnailCache:
+    # Small copies of the logos for the seat labels, kept in a "thumbnails"
+    # folder next to them. A thumbnail older than its logo is made again, so
+    # a logo that's imported again never shows the old one.
+
+    FOLDER = "thumbnails"
+
+    def __init__(self, size=(100, 100)):
+        self.size = size
+
+    def path(self, logo):
+        folder, name = os.path.split(logo)
+        return os.path.join(folder, self.FOLDER, name)
+
+    def get(self, logo):
+        # Path of an up to date thumbnail of the logo, made if needed
+        path = self.path(logo)
+        logo_mtime = os.stat(logo).st_mtime_ns
+        try:
+            if os.stat(path).st_mtime_ns >= logo_mtime:
+                return path
+        except FileNotFoundError:
+            pass
+        with Image.open(logo) as image:
+            # Most of the size is dropped before the actual resize
+            factor = max(1, min(image.width // self.size[0],
+                                image.height // self.size[1]))
+            image = image.convert("RGBA")
+            if factor > 1:
+                image = image.reduce(factor)
+            thumbnail = image.resize(self.size, Image.BILINEAR)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Two threads may be making the same one
+        temp_path = unique_temp_path(path)
+        thumbnail.save(temp_path, "PNG")
+        os.replace(temp_path, path)
+        return path
+
+    def invalidate(self, logo=None):
+        # Remove the thumbnail of one logo, or every thumbnail in the folder
+        # of the logos if logo is a folder
+        if logo is not None and not os.path.isdir(logo):
+            paths = [self.path(logo)]
+        else:
+            folder = logo if logo is not None else LOGOS_DIR
+            paths = glob.glob(os.path.join(folder, self.FOLDER, "*.png"))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+BASE_CACHE = BaseLayerCache()
+RENDER_CACHE = RenderCache()
+THUMBNAILS = ThumbnailCache()
@@ -0,0 +1,378 @@
+# cli.py - Everything the render boxes and bots need, without Qt
+# Standard python library
+import os
+import sys
+import json
+import argparse
+from timeit import default_timer as timer
+# Image manipulation libraries
+from PIL import Image
+# Custom libraries
+from render import (LOGOS_DIR, SEATS, TableclothRenderer, load_schedule,
+    logo_path, prepared_current, render_table, write_prepared)
+from parallel import benchmark, peak_rss, render_parallel, render_serial
+from encoder import encoding_report, load_profiles
+from instrument import Tracer
+from backend import benchmark as backend_benchmark
+from search import benchmark as search_benchmark
+from cache import THUMBNAILS
+from persistence import CONFIG_FILE, JsonStore
+from roster import open_roster
+from teampack import (PackError, describe_diff, diff_pack, export_pack,
+    import_pack)
+from service import (DEFAULT_HOST, DEFAULT_PORT, QUEUE_SIZE, RenderService,
+    make_server)
+
+
+EXIT_OK = 0
+# Something failed: a table, a pack, a missing file...
+EXIT_FAILED = 1
+# Wrong arguments, argparse exits with it too
+EXIT_USAGE = 2
+
+
+class Output:
+    # Text for people, or one JSON object per line with --json
+
+    def __init__(self, as_json=False):
+        self.as_json = as_json
+
+    def result(self, record, text):
+        if self.as_json:
+            print(json.dumps(record), flush=True)
+        else:
+            print(text, flush=True)
+
+    def error(self, message, **record):
+        if self.as_json:
+            print(json.dumps(dict(record, error=message)), file=sys.stderr,
+                  flush=True)
+        else:
+            print("error: %s" % message, file=sys.stderr, flush=True)
+
+
+def describe(output, peak):
+    # The output and the peak memory of its render, when it's known
+    if peak is None:
+        return output
+    return "%s (peak memory %d MiB)" % (output, peak // (1024 * 1024))
+
+
+def load_config(path):
+    # Written straight away when a command changes it
+    return JsonStore.load(path, delay=0)
+
+
+def make_renderer(args, config):
+    return TableclothRenderer(mat=args.mat, logos_dir=args.logos_dir,
+        render_cache=False if args.no_cache else None,
+        backend=config.get("render_backend", "pillow"),
+        low_memory=args.low_memory or config.get("low_memory", False))
+
+
+def pick_profile(parser, args, config):
+    profiles = load_profiles(config)
+    if args.profile not in profiles:
+        parser.error("unknown profile '%s', use one of: %s"
+                     % (args.profile, ", ".join(profiles)))
+    return profiles[args.profile]
+
+
+def print_encoding_report(out, renderer, table, technical_lines, config):
+    tablecloth = renderer.render(*(table[seat] for seat in SEATS),
+        technical_lines=technical_lines)
+    for name, image_format, seconds, size in encoding_report(tablecloth,
+        load_profiles(config)):
+        out.result({"profile": name, "format": image_format,
+                    "seconds": seconds, "bytes": size},
+                   "%s (%s): %.1f ms, %d KiB" % (name, image_format,
+                   seconds * 1000, size // 1024))
+
+
+def print_worker_benchmark(out, tables, output_dir, renderer, technical_lines,
+    workers, profile):
+    for workers, seconds, speedup in benchmark(tables, output_dir, renderer,
+        technical_lines, workers, profile):
+        out.result({"workers": workers, "seconds": seconds,
+                    "speedup": speedup},
+                   "%d worker(s): %.2f seconds, %.2fx" % (workers, seconds,
+                   speedup))
+
+
+def command_render(parser, args, out, config_store):
+    renderer = make_renderer(args, config_store.data)
+    profile = pick_profile(parser, args, config_store.data)
+    team_ids = [args.east, args.south, args.west, args.north]
+    for team_id in team_ids:
+        if not os.path.exists(logo_path(team_id, renderer.logos_dir)):
+            out.error("team %d has no logo" % team_id, team=team_id)
+            return EXIT_FAILED
+    os.makedirs(args.output, exist_ok=True)
+    tracer = Tracer()
+    start = timer()
+    with tracer.active():
+        output = render_table(renderer, team_ids, args.output,
+            args.technical_lines, profile=profile)
+    peak = peak_rss(tracer)
+    out.result({"output": output, "teams": team_ids,
+                "seconds": timer() - start, "peak_memory": peak},
+               describe(output, peak))
+    return EXIT_OK
+
+
+def command_schedule(parser, args, out, config_store):
+    start = timer()
+    tables = load_schedule(args.schedule)
+    renderer = make_renderer(args, config_store.data)
+    profile = pick_profile(parser, args, config_store.data)
+    exit_code = EXIT_OK
+    if args.encoding_report:
+        print_encoding_report(out, renderer, tables[0], args.technical_lines,
+            config_store.data)
+    elif args.benchmark:
+        print_worker_benchmark(out, tables, args.output, renderer,
+            args.technical_lines, args.workers or None, profile)
+    else:
+        if args.workers is None:
+            results = render_serial(tables, args.output, renderer,
+                args.technical_lines, profile)
+        else:
+            results = render_parallel(tables, args.output, renderer,
+                args.technical_lines, args.workers or None, profile)
+        for result in results:
+            if result.error is None:
+                out.result({"table": result.name, "output": result.output,
+                            "peak_memory": result.peak_memory},
+                           describe(result.output, result.peak_memory))
+            else:
+                out.error("%s failed: %s" % (result.name, result.error),
+                    table=result.name)
+                exit_code = EXIT_FAILED
+    if not out.as_json:
+        print("This took %d seconds." % (timer() - start))
+    return exit_code
+
+
+def command_import(parser, args, out, config_store):
+    config_dir = os.path.dirname(os.path.abspath(args.config))
+    store = open_roster(config_store.data, config_dir, delay=0)
+    diff = diff_pack(args.pack, store.to_dict(), args.logos_dir)
+    record = {"pack": args.pack, "added": diff.added,
+              "removed": diff.removed, "members": diff.members,
+              "logos": diff.logos, "warnings": diff.warnings,
+              "applied": False}
+    lines = describe_diff(diff) or ["The teams are already up to date."]
+    if not args.dry_run:
+        result = import_pack(args.pack, args.logos_dir, args.workers,
+            only=diff.logos)
+        for logo in result.logos:
+            THUMBNAILS.invalidate(logo)
+            store.record_logo(logo)
+        store.replace(diff.roster)
+        store.flush()
+        config_store.data["total_teams"] = len(diff.roster["teams"])
+        config_store.changed()
+        record["applied"] = True
+    out.result(record, "\n".join(lines + diff.warnings))
+    return EXIT_OK
+
+
+def command_export(parser, args, out, config_store):
+    config_dir = os.path.dirname(os.path.abspath(args.config))
+    roster = open_roster(config_store.data, config_dir).to_dict()
+    result = export_pack(args.pack, roster, args.logos_dir, args.workers)
+    out.result({"output": result.path, "logos": result.logos,
+                "duplicates": result.duplicates},
+               "%s: %d logo(s), %d shared" % (result.path, result.logos,
+               result.duplicates))
+    return EXIT_OK
+
+
+def command_warm(parser, args, out, config_store):
+    # Fills the disk caches the first render of each kind would fill
+    renderer = make_renderer(args, config_store.data)
+    for technical_lines in (False, True):
+        renderer.cached_base(technical_lines)
+    logos = sorted(os.path.join(args.logos_dir, name)
+                   for name in os.listdir(args.logos_dir)
+                   if name.startswith("team") and name.endswith(".png"))
+    prepared = 0
+    for logo in logos:
+        THUMBNAILS.get(logo)
+        if not prepared_current(logo):
+            with Image.open(logo) as image:
+                image.load()
+                write_prepared(image, logo)
+            prepared += 1
+    out.result({"base_layers": 2, "thumbnails": len(logos),
+                "prepared": prepared},
+               "Base layers ready, %d thumbnail(s), %d logo(s) prepared"
+               % (len(logos), prepared))
+    return EXIT_OK
+
+
+def command_serve(parser, args, out, config_store):
+    service = RenderService(make_renderer(args, config_store.data),
+        args.workers, load_profiles(config_store.data), args.queue_size)
+    service.start()
+    server = make_server(service, args.host, args.port, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    out.result({"host": host, "port": port, "workers": args.workers},
+               "Serving tablecloths on http://%s:%d/render with %d worker(s)"
+               % (host, port, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return EXIT_OK
+
+
+def command_benchmark(parser, args, out, config_store):
+    if args.target == "search":
+        build, indexed, scan = search_benchmark(args.players, args.queries)
+        out.result({"build": build, "indexed": indexed, "scan": scan},
+                   "Index built in %.1f ms, %.3f ms per query, linear scan "
+                   "%.3f ms" % (build * 1000, indexed * 1000, scan * 1000))
+        return EXIT_OK
+    if args.target == "backend":
+        results, max_difference = backend_benchmark()
+        for name, seconds in results:
+            out.result({"backend": name, "seconds": seconds,
+                        "max_difference": max_difference},
+                       "%s: %.1f ms per render" % (name, seconds * 1000))
+        return EXIT_OK
+    if args.schedule is None:
+        parser.error("the %s benchmark needs --schedule" % args.target)
+    tables = load_schedule(args.schedule)
+    renderer = make_renderer(args, config_store.data)
+    if args.target == "encoding":
+        print_encoding_report(out, renderer, tables[0], args.technical_lines,
+            config_store.data)
+    else:
+        print_worker_benchmark(out, tables, args.output, renderer,
+            args.technical_lines, args.workers or None,
+            pick_profile(parser, args, config_store.data))
+    return EXIT_OK
+
+
+def make_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true",
+        help="Print one JSON object per result instead of text")
+    common.add_argument("--config", default=CONFIG_FILE,
+        help="config.json to use")
+    common.add_argument("--logos-dir", default=LOGOS_DIR,
+        help="Folder with the team logos")
+
+    rendering = argparse.ArgumentParser(add_help=False)
+    rendering.add_argument("--technical-lines", action="store_true",
+        help="Show the technical lines")
+    rendering.add_argument("--mat", default=None,
+        help="Background image to use instead of images/mat.png")
+    rendering.add_argument("--profile", default="final",
+        help="Output profile from config.json (final, fast, small, "
+             "lossless, webp...)")
+    rendering.add_argument("--no-cache", action="store_true",
+        help="Render every table even if it was rendered before")
+    rendering.add_argument("--low-memory", action="store_true",
+        help="Reuse one canvas per worker and stream the base layer from "
+             "the disk cache, slower but with a much lower peak memory")
+
+    parser = argparse.ArgumentParser(
+        description="Render tablecloths and manage team packs without the "
+                    "GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render = commands.add_parser("render", parents=[common, rendering],
+        help="Render one table")
+    for seat in SEATS:
+        render.add_argument(seat, type=int, help="Team ID of %s" % seat)
+    render.add_argument("output", help="Folder where the table is saved")
+    render.set_defaults(handler=command_render)
+
+    schedule = commands.add_parser("schedule", parents=[common, rendering],
+        help="Render every table of a schedule file")
+    schedule.add_argument("schedule",
+        help="JSON file with the east, south, west and north team IDs "
+             "of every table")
+    schedule.add_argument("output", help="Folder where the tables are saved")
+    schedule.add_argument("--workers", type=int, default=None,
+        help="Render in parallel with this many processes (0 for one per "
+             "core)")
+    schedule.add_argument("--encoding-report", action="store_true",
+        help="Encode the first table with every profile and print the time "
+             "and size of each one")
+    schedule.add_argument("--benchmark", action="store_true",
+        help="Time the schedule with 1 worker up to --workers (or one per "
+             "core) and print the speedup")
+    schedule.set_defaults(handler=command_schedule)
+
+    pack_import = commands.add_parser("import", parents=[common],
+        help="Import a team pack, only what changed")
+    pack_import.add_argument("pack", help="Zip made by the export")
+    pack_import.add_argument("--dry-run", action="store_true",
+        help="Only print what would change")
+    pack_import.add_argument("--workers", type=int, default=None,
+        help="Threads decoding the logos")
+    pack_import.set_defaults(handler=command_import)
+
+    pack_export = commands.add_parser("export", parents=[common],
+        help="Export the teams and logos to a pack")
+    pack_export.add_argument("pack", help="Zip to write")
+    pack_export.add_argument("--workers", type=int, default=None,
+        help="Threads hashing the logos")
+    pack_export.set_defaults(handler=command_export)
+
+    warm = commands.add_parser("warm", parents=[common, rendering],
+        help="Fill the base layer, thumbnail and rotated logo caches")
+    warm.set_defaults(handler=command_warm)
+
+    serve = commands.add_parser("serve", parents=[common, rendering],
+        help="Render tablecloths on request over HTTP for bots")
+    serve.add_argument("--host", default=DEFAULT_HOST,
+        help="Address to listen on, keep it local unless there's a proxy")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT,
+        help="Port to listen on, 0 picks a free one")
+    serve.add_argument("--workers", type=int, default=2,
+        help="Tablecloths rendered at the same time")
+    serve.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+        help="Renders waiting for a worker before new ones get a 503")
+    serve.add_argument("--verbose", action="store_true",
+        help="Log every request")
+    serve.set_defaults(handler=command_serve)
+
+    bench = commands.add_parser("benchmark", parents=[common, rendering],
+        help="Time the workers, encoding profiles, search or backends")
+    bench.add_argument("target",
+        choices=["workers", "encoding", "search", "backend"])
+    bench.add_argument("--schedule", default=None,
+        help="Schedule for the workers and encoding benchmarks")
+    bench.add_argument("--output", default="benchmark",
+        help="Folder for the tables of the workers benchmark")
+    bench.add_argument("--workers", type=int, default=None,
+        help="Most workers to try")
+    bench.add_argument("--players", type=int, default=10000,
+        help="Players in the made up roster of the search benchmark")
+    bench.add_argument("--queries", type=int, default=1000,
+        help="Searches timed in the search benchmark")
+    bench.set_defaults(handler=command_benchmark)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    out = Output(args.json)
+    try:
+        config_store = load_config(args.config)
+        return args.handler(parser, args, out, config_store)
+    except (OSError, ValueError, KeyError, PackError) as error:
+        out.error(str(error))
+        return EXIT_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# encoder.py - How the finished tablecloth is written to disk
+# Standard python library
+import io
+import os
+import json
+from pathlib import Path
+from timeit import default_timer as timer
+# Custom libraries
+from instrument import span
+
+
+# Absolute path to the current folder as constant for easy access
+THISDIR = str(Path(__file__).resolve().parent)
+CONFIG_FILE = os.path.join(THISDIR, "config", "config.json")
+
+OUTPUT_STEM = "Table_Dif"
+# Extension and the save options each format accepts
+FORMATS = {
+    "JPEG": (".jpg", ("quality", "subsampling", "progressive", "optimize")),
+    "PNG": (".png", ("compress_level", "optimize")),
+    "WEBP": (".webp", ("quality", "lossless", "method")),
+}
+# "final" is what Pillow did by default before profiles existed, "fast" is
+# for anything that has to be encoded quickly and is thrown away afterwards
+DEFAULT_PROFILES = {
+    "final": {"format": "JPEG", "quality": 75},
+    "fast": {"format": "JPEG", "quality": 60, "subsampling": 2,
+             "optimize": False},
+    "small": {"format": "JPEG", "quality": 85, "optimize": True,
+              "progressive": True},
+    "lossless": {"format": "PNG", "compress_level": 1},
+    "webp": {"format": "WEBP", "quality": 85, "method": 4},
+}
+
+
+def check_profile(profile):
+    if profile.get("format") not in FORMATS:
+        raise ValueError("Unknown output format '%s', use one of: %s"
+                         % (profile.get("format"), ", ".join(FORMATS)))
+    options = FORMATS[profile["format"]][1]
+    for option in profile:
+        if option != "format" and option not in options:
+            raise ValueError("%s doesn't take the '%s' option"
+                             % (profile["format"], option))
+    return profile
+
+
+def load_profiles(config=None):
+    # The ones in config.json's "output_profiles" replace the defaults with
+    # the same name
+    if config is None:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as fp_config:
+            config = json.loads(fp_config.read())
+    profiles = dict(DEFAULT_PROFILES)
+    profiles.update(config.get("output_profiles", {}))
+    for profile in profiles.values():
+        check_profile(profile)
+    return profiles
+
+
+def output_name(profile=None):
+    if profile is None:
+        profile = DEFAULT_PROFILES["final"]
+    return OUTPUT_STEM + FORMATS[profile["format"]][0]
+
+
+def encode(image, fp_output, profile=None, stream=False):
+    # fp_output can be a path or a file object. With stream on, a path is
+    # written while it's encoded instead of holding the whole file first.
+    if profile is None:
+        profile = DEFAULT_PROFILES["final"]
+    options = {option: value for option, value in profile.items()
+               if option != "format"}
+    if image.mode != "RGB":
+        with span("convert"):
+            image = image.convert("RGB")
+    if stream and isinstance(fp_output, (str, os.PathLike)):
+        with open(fp_output, "wb") as fp_file:
+            encode(image, fp_file, profile)
+        return
+    if not isinstance(fp_output, (str, os.PathLike)):
+        with span("encode", format=profile["format"]):
+            image.save(fp_output, profile["format"], **options)
+        return
+    # Encoded in memory first so the time on disk is measured on its own
+    buffer = io.BytesIO()
+    with span("encode", format=profile["format"]):
+        image.save(buffer, profile["format"], **options)
+    with span("write", bytes=buffer.tell()):
+        with open(fp_output, "wb") as fp_file:
+            fp_file.write(buffer.getbuffer())
+
+
+def encoding_report(image, profiles):
+    # Encodes the image in memory with every profile and returns
+    # (name, format, seconds, bytes) for each one
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    report = []
+    for name, profile in profiles.items():
+        buffer = io.BytesIO()
+        start = timer()
+        encode(image, buffer, profile)
+        report.append((name, profile["format"], timer() - start,
+                       buffer.tell()))
+    return report
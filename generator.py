@@ -1,13 +1,13 @@
 # Python libraries
 import os
 import sys
+import copy
 import json
-import tempfile
 import webbrowser
 import urllib.request
 from pathlib import Path
 
-from zipfile import ZipFile, is_zipfile
+from zipfile import is_zipfile
 # The __debug__ lines are ignored in the compilation
 if __debug__:
     from timeit import default_timer as timer
@@ -17,13 +17,24 @@ from PIL import Image
 from PySide6 import QtCore
 from PySide6.QtWidgets import (QWidget, QMainWindow, QApplication, QVBoxLayout,
     QHBoxLayout, QComboBox, QLabel, QPushButton, QMessageBox, QCheckBox,
-    QProgressBar, QSplashScreen, QCompleter, QLineEdit, QFileDialog,
-    QGridLayout, QMenu, QMenuBar, QListWidget)
-from PySide6.QtGui import QIcon, QPixmap, QScreen
+    QProgressBar, QSplashScreen, QLineEdit, QFileDialog,
+    QGridLayout, QMenu, QMenuBar, QListWidget, QProgressDialog)
+from PySide6.QtGui import QIcon, QPixmap, QPixmapCache, QScreen
 from PySide6.QtCore import QThread
 # Custom libraries
-from thread import GenerateImageThread
-from widgets import EditionWidget
+from thread import (GenerateImageThread, PackThread, RenderScheduler,
+    ThumbnailLoader)
+from render import (LOGO_CACHE, IncrementalCompositor, TableclothRenderer,
+    logo_path)
+from backend import available as backend_available
+from cache import THUMBNAILS
+from encoder import load_profiles
+from registry import TeamRegistry
+from teampack import (describe_diff, diff_changes, diff_pack, export_pack,
+    import_pack)
+from widgets import EditionWidget, PlayerCompleter, RosterModel, SaveTimer
+from persistence import CONFIG_FILE, JsonStore
+from roster import open_roster
 
 # Absolute path to the current folder as constant for easy access
 THISDIR = str(Path(__file__).resolve().parent)
@@ -52,24 +63,24 @@ class TableClothGenerator(QMainWindow):
 
     def MainUI(self):
 
-        # Obtain the configs
-        fp_config = open(THISDIR + "\\config\\config.json", "r",
-                            encoding="utf-8")
-        self.config = json.loads(fp_config.read())
-        fp_config.close()
+        # Obtain the configs, kept in memory and written shortly after the
+        # last change
+        self.config_store = JsonStore.load(CONFIG_FILE, timer=SaveTimer)
+        self.config = self.config_store.data
 
-        # Obtain and List the teams
-        fp_teams = open(THISDIR + "\\config\\teams.json", "r",
-                            encoding="utf-8")
-        conf_teams = json.loads(fp_teams.read())
-        fp_teams.close()
-        self.teams = conf_teams["teams"]
-        self.players = conf_teams["players"]
+        # Obtain and List the teams, from teams.json or the roster database
+        self.teams_store = open_roster(self.config, timer=SaveTimer)
+        self.registry = TeamRegistry.from_dict(self.teams_store.to_dict())
+        # The registry edits the same lists teams.json is written from
+        self.teams_store.follow(self.registry.to_dict())
+        # Whatever is still pending is written before closing
+        QApplication.instance().aboutToQuit.connect(self.SaveSettings)
 
         # Obtain all images needed to create the tablecloth
         self.background = Image.open(THISDIR + "\\images\\mat.png")
         self.table_border = Image.open(THISDIR + "\\images\\table_border.png")
         self.tech_lines = Image.open(THISDIR + "\\images\\technical_lines.png")
+        self._createRenderer(self.background)
 
         # Check if there's no configuration set up
         # and prompt to create/import one
@@ -82,12 +93,18 @@ class TableClothGenerator(QMainWindow):
                 self.CreateTeamsWindow()
 
         self.bg_image = self.config["image_route"]
-        self.players_combobox = QComboBox()
-        self.UpdatePlayersList()
-        self.players_combobox.setEditable(True)
-        self.players_combobox.completer()\
-                             .setCompletionMode(QCompleter.PopupCompletion)
-        self.players_combobox.setInsertPolicy(QComboBox.NoInsert)
+        # Shared by the four seats, edits only touch the rows that changed
+        self.roster_model = RosterModel(self.registry, self)
+        # Logo thumbnails are made and read in the background
+        self.seat_logos = {}
+        # Pack imports and exports running, kept until their thread ends
+        self.pack_jobs = []
+        # Previews, mat previews and final renders share one pool
+        self.render_scheduler = RenderScheduler(parent=self)
+        QApplication.instance().aboutToQuit.connect(self.render_scheduler.stop)
+        self.progress_bar = None
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        self.thumbnail_loader.loaded.connect(self.ThumbnailLoaded)
 
         # Set up the GUI
         self.statusBar().showMessage("Remember: Rig responsibly.")
@@ -96,16 +113,16 @@ class TableClothGenerator(QMainWindow):
         self.label_east.setText("<h1>East Seat</h1>")
         self.label_east.setAlignment(QtCore.Qt.AlignCenter)
         self.image_east = QLabel(self)
-        self.image_east.setPixmap(QPixmap("images/logos/team1.png")\
-                                  .scaled(100,100))
+        self.SetSeatLogo(self.image_east, 1)
         self.image_east.setAlignment(QtCore.Qt.AlignCenter)
         self.search_east = QLineEdit()
         self.search_east.setAlignment(QtCore.Qt.AlignCenter)
+        self._createPlayerCompleter(self.search_east)
         self.search_east.editingFinished.connect(
             lambda: self.searchPlayer(self.search_east.text(),
                                       self.cloth_east))
         self.cloth_east = QComboBox()
-        self.cloth_east.setModel(self.players_combobox.model())
+        self.cloth_east.setModel(self.roster_model)
         self.cloth_east.currentIndexChanged.connect(
             lambda: self.SwitchImage(self.cloth_east, self.image_east))
         # Right (SOUTH)
@@ -113,17 +130,17 @@ class TableClothGenerator(QMainWindow):
         self.label_south.setText("<h1>South Seat</h1>")
         self.label_south.setAlignment(QtCore.Qt.AlignCenter)
         self.image_south = QLabel(self)
-        self.image_south.setPixmap(QPixmap("images/logos/team1.png")\
-                                   .scaled(100,100))
+        self.SetSeatLogo(self.image_south, 1)
         self.image_south.setAlignment(QtCore.Qt.AlignCenter)
         self.image_south.show()
         self.search_south = QLineEdit()
         self.search_south.setAlignment(QtCore.Qt.AlignCenter)
+        self._createPlayerCompleter(self.search_south)
         self.search_south.editingFinished.connect(
             lambda: self.searchPlayer(self.search_south.text(),
                                       self.cloth_south))
         self.cloth_south = QComboBox()
-        self.cloth_south.setModel(self.players_combobox.model())
+        self.cloth_south.setModel(self.roster_model)
         self.cloth_south.currentIndexChanged.connect(
             lambda: self.SwitchImage(self.cloth_south, self.image_south))
         # Top (WEST)
@@ -131,17 +148,17 @@ class TableClothGenerator(QMainWindow):
         self.label_west.setText("<h1>West Seat</h1>")
         self.label_west.setAlignment(QtCore.Qt.AlignCenter)
         self.image_west = QLabel(self)
-        self.image_west.setPixmap(QPixmap("images/logos/team1.png")\
-                                  .scaled(100,100))
+        self.SetSeatLogo(self.image_west, 1)
         self.image_west.setAlignment(QtCore.Qt.AlignCenter)
         self.image_west.show()
         self.cloth_west = QComboBox()
         self.search_west = QLineEdit()
         self.search_west.setAlignment(QtCore.Qt.AlignCenter)
+        self._createPlayerCompleter(self.search_west)
         self.search_west.editingFinished.connect(
             lambda: self.searchPlayer(self.search_west.text(),
                                       self.cloth_west))
-        self.cloth_west.setModel(self.players_combobox.model())
+        self.cloth_west.setModel(self.roster_model)
         self.cloth_west.currentIndexChanged.connect(
             lambda: self.SwitchImage(self.cloth_west, self.image_west))
         # Left (NORTH)
@@ -149,17 +166,17 @@ class TableClothGenerator(QMainWindow):
         self.label_north.setText("<h1>North Seat</h1>")
         self.label_north.setAlignment(QtCore.Qt.AlignCenter)
         self.image_north = QLabel(self)
-        self.image_north.setPixmap(QPixmap("images/logos/team1.png")\
-                                   .scaled(100,100))
+        self.SetSeatLogo(self.image_north, 1)
         self.image_north.setAlignment(QtCore.Qt.AlignCenter)
         self.image_north.show()
         self.cloth_north = QComboBox()
         self.search_north = QLineEdit()
         self.search_north.setAlignment(QtCore.Qt.AlignCenter)
+        self._createPlayerCompleter(self.search_north)
         self.search_north.editingFinished.connect(
             lambda: self.searchPlayer(self.search_north.text(),
                                       self.cloth_north))
-        self.cloth_north.setModel(self.players_combobox.model())
+        self.cloth_north.setModel(self.roster_model)
         self.cloth_north.currentIndexChanged.connect(
             lambda: self.SwitchImage(self.cloth_north, self.image_north))
         # Technical lines
@@ -239,6 +256,9 @@ class TableClothGenerator(QMainWindow):
 
     def _createProgressBar(self):
 
+        # A render that was replaced leaves its bar behind
+        if self.progress_bar is not None:
+            self.statusBar().removeWidget(self.progress_bar)
         self.progress_bar = QProgressBar()
         self.progress_bar.minimum = 0
         self.progress_bar.maximum = 100
@@ -250,19 +270,67 @@ class TableClothGenerator(QMainWindow):
         self.statusBar().addPermanentWidget(self.progress_bar)
         self.ChangeAppStatus(False)
 
+    def _createRenderer(self, background):
+
+        # NumPy is optional, so fall back to Pillow if it's missing
+        backend = self.config.get("render_backend", "pillow")
+        if not backend_available(backend):
+            backend = "pillow"
+        self.renderer = TableclothRenderer(background, self.table_border,
+            self.tech_lines, image_route=self.config["image_route"],
+            backend=backend, low_memory=self.config.get("low_memory", False))
+        self.compositor = IncrementalCompositor(self.renderer)
+
     def SwitchImage(self, cloth, image):
         # It shows you the team logo. No way you can miss those, right?
-        team_id = self.SearchTeamID(cloth, True)
-        image.setPixmap(QPixmap(
-            "images/logos/team%d.png" % team_id).scaled(100,100))
+        if cloth.currentIndex() == -1:
+            return
+        self.SetSeatLogo(image, self.SearchTeamID(cloth, True))
+
+    def _thumbnailKey(self, logo):
+        # A logo saved again gets a new key, so it's never shown stale
+        return "thumbnail:%s:%d" % (logo, os.stat(logo).st_mtime_ns)
+
+    def SetSeatLogo(self, image, team_id):
+        logo = self.registry.logo(team_id)
+        self.seat_logos[image] = logo
+        try:
+            pixmap = QPixmapCache.find(self._thumbnailKey(logo))
+        except FileNotFoundError:
+            image.clear()
+            return
+        if pixmap is not None:
+            image.setPixmap(pixmap)
+        else:
+            self.thumbnail_loader.request(logo)
+
+    def ThumbnailLoaded(self, logo, thumbnail):
+        if thumbnail.isNull() or not os.path.exists(logo):
+            return
+        pixmap = QPixmap.fromImage(thumbnail)
+        QPixmapCache.insert(self._thumbnailKey(logo), pixmap)
+        # Only the seats that still show that logo
+        for image, seat_logo in self.seat_logos.items():
+            if seat_logo == logo:
+                image.setPixmap(pixmap)
+
+    def _createPlayerCompleter(self, search_input):
+        # The registry is replaced on import, so it's looked up every time
+        completer = PlayerCompleter(
+            lambda text: self.registry.search.search(text), search_input)
+        search_input.textEdited.connect(completer.update)
+        search_input.setCompleter(completer)
 
     def searchPlayer(self, text, combobox):
         # It even searches the player for you. What more could you want?
-        search_index = combobox.findText(text, QtCore.Qt.MatchContains)
-        if search_index == -1:
+        if not text.strip():
+            return
+        found = self.registry.search.search(text, limit=1)
+        row = self.roster_model.row_of(*found[0]) if found else -1
+        if row == -1:
             QMessageBox.warning(self, "Error", "No player found")
         else:
-            combobox.setCurrentIndex(search_index)
+            combobox.setCurrentIndex(row)
 
     def CreateTeamsWindow(self):
 
@@ -320,33 +388,22 @@ class TableClothGenerator(QMainWindow):
         self.teamcreation_wid.show()
 
     def addTeamFunction(self, name, members):
-        fp_teams = open(THISDIR + "\\config\\teams.json", "r",
-                            encoding="utf-8")
-        current_teams = json.loads(fp_teams.read())
-        fp_teams.close()
-        team = {}
-        current_teams["teams"].append(name)
-        current_teams["players"][name] = [str(self.members_list.item(i).text())\
-                                    for i in range(self.members_list.count())]
-        new_team = open(THISDIR + "\\config\\teams.json", "w+",
-                            encoding="utf-8")
-        add_config = open(THISDIR + "\\config\\config.json", "w+",
-                            encoding="utf-8")
-        self.teams = current_teams["teams"]
-        self.players = current_teams["players"]
+        try:
+            self.roster_model.add_team(name, [str(self.members_list.item(i)\
+                .text()) for i in range(self.members_list.count())])
+        except ValueError as error:
+            QMessageBox.warning(self, "Error", str(error))
+            return
+        self.teams_store.add_team(name, self.registry.players[name])
         self.config["total_teams"] += 1
+        self.config_store.changed()
         new_id = self.config["total_teams"] + 1
         self.num_id.setText(str(new_id))
-        add_config.write(json.dumps(self.config, indent=4))
-        new_team.write(json.dumps(current_teams, indent=4))
-        new_team.close()
 
         self.name_input.clear()
 
         self.members_list.clear()
 
-        self.UpdatePlayersList()
-
     def ImportTeamImage(self):
 
         image_dialog = QFileDialog(self)
@@ -360,8 +417,17 @@ class TableClothGenerator(QMainWindow):
                 # If not, default to assume it's the logo
                 if new_team_logo.size != (250, 250):
                     new_team_logo.resize((250, 250))
+            team_logo = logo_path(int(self.num_id.text()))
+            if os.path.exists(team_logo):
+                QPixmapCache.remove(self._thumbnailKey(team_logo))
             new_team_logo.save(THISDIR+"\\images\\logos\\team%s.png"\
                 % self.num_id.text())
+            LOGO_CACHE.invalidate(team_logo)
+            THUMBNAILS.invalidate(team_logo)
+            self.teams_store.record_logo(team_logo)
+            for image, seat_logo in self.seat_logos.items():
+                if seat_logo == team_logo:
+                    self.SetSeatLogo(image, int(self.num_id.text()))
 
             QMessageBox.information(self, "Team Image", "Team image added.")
 
@@ -373,51 +439,149 @@ class TableClothGenerator(QMainWindow):
 
         if file_dialog[0] != "":
             if is_zipfile(file_dialog[0]):
-                with ZipFile(file_dialog[0]) as zip_import:
-                    list_of_files = zip_import.namelist()
-                    for fimp in list_of_files:
-                        if fimp.startswith('logos'):
-                            zip_import.extract(fimp, path=THISDIR+'\\images\\')
-                    imported_teams = zip_import.read('teams.json')
-                    imported_teams = imported_teams.decode('utf-8')
+                self.ComparePack(file_dialog[0])
             else:
                 imported_teams = open(file_dialog[0], "r",
                                 encoding="utf-8").read()
-            json_teams = json.loads(imported_teams)
-            self.teams = json_teams["teams"]
-            self.players = json_teams["players"]
-
-            new_teams = open(THISDIR + "\\config\\teams.json", "w+",
-                            encoding="utf-8")
-            new_teams.write(json.dumps(json_teams, indent=4))
-            new_teams.close()
-
-            old_config = open(THISDIR + "\\config\\config.json", "r",
-                                encoding="utf-8").read()
-            old_config = json.loads(old_config)
-            old_config["total_teams"] = len(json_teams["teams"])
-            self.config = old_config
-            new_config = open(THISDIR + "\\config\\config.json", "w+",
-                                encoding="utf-8")
-            new_config.write(json.dumps(self.config, indent=4))
-            new_config.close()
-
-            self.UpdatePlayersList()
-
-            self.image_east.setPixmap(QPixmap("images/logos/team1.png")\
-                                       .scaled(100,100))
-            self.cloth_east.setModel(self.players_combobox.model())
-            self.image_south.setPixmap(QPixmap("images/logos/team1.png")\
-                                       .scaled(100,100))
-            self.cloth_south.setModel(self.players_combobox.model())
-            self.image_west.setPixmap(QPixmap("images/logos/team1.png")\
-                                       .scaled(100,100))
-            self.cloth_west.setModel(self.players_combobox.model())
-            self.image_north.setPixmap(QPixmap("images/logos/team1.png")\
-                                       .scaled(100,100))
-            self.cloth_north.setModel(self.players_combobox.model())
-            self.statusBar().showMessage("Teams imported successfully.")
-            self.teamcreation_wid.close()
+                self.ApplyImportedTeams(json.loads(imported_teams))
+
+    def ComparePack(self, pack):
+        # Only what's different from the current teams is imported
+        roster = copy.deepcopy(self.registry.to_dict())
+        self.StartPackThread(PackThread(lambda progress, cancel: diff_pack(
+            pack, roster, progress=progress, cancel=cancel)), "Import",
+            "Comparing teams...", self.PackCompared)
+
+    def PackCompared(self, diff):
+        self.ClosePackDialog()
+        if not diff_changes(diff):
+            QMessageBox.information(self, "Import",
+                "The teams are already up to date.")
+            return
+        answer = QMessageBox.question(self, "Import",
+            "\n".join(describe_diff(diff)) + "\n\nApply these changes?",
+            QMessageBox.Yes | QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return
+        # The logos are checked, rotated and written in the background
+        self.pack_diff = diff
+        self.StartPackThread(PackThread(lambda progress, cancel: import_pack(
+            diff.pack, progress=progress, cancel=cancel, only=diff.logos)),
+            "Import", "Importing teams...", self.PackImported)
+
+    def StartPackThread(self, worker, title, text, on_done):
+        # Imports and exports show their progress and can be cancelled
+        self.pack_title = title
+        self.pack_dialog = QProgressDialog(text, "Cancel", 0, 0, self)
+        self.pack_dialog.setWindowTitle(title)
+        self.pack_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.pack_dialog.setMinimumDuration(0)
+
+        # A second job can start before the first thread has ended
+        thread = QThread()
+        job = (thread, worker)
+        self.pack_jobs.append(job)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        self.pack_dialog.canceled.connect(worker.cancel)
+        worker.progress.connect(self.UpdatePackProgress)
+        worker.done.connect(on_done)
+        worker.failed.connect(self.PackFailed)
+        worker.cancelled.connect(self.PackCancelled)
+        worker.finished.connect(thread.quit)
+        worker.finished.connect(worker.deleteLater)
+        thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(lambda: self.pack_jobs.remove(job))
+        thread.start()
+
+    def UpdatePackProgress(self, done, total):
+        self.pack_dialog.setMaximum(total)
+        self.pack_dialog.setValue(done)
+
+    def ClosePackDialog(self):
+        self.pack_dialog.reset()
+        self.pack_dialog.deleteLater()
+
+    def PackImported(self, result):
+        self.ClosePackDialog()
+        # Only the logos that were written are dropped from the caches. The
+        # render cache and the pixmaps are keyed by the logo content or
+        # modification time, so they need nothing.
+        for logo in result.logos:
+            LOGO_CACHE.invalidate(logo)
+            THUMBNAILS.invalidate(logo)
+            self.teams_store.record_logo(logo)
+        self.ApplyPackDiff(self.pack_diff)
+        self.RefreshSeatLogos(self.pack_diff.logos)
+        if result.warnings:
+            QMessageBox.information(self, "Import",
+                "The teams were imported, but:\n" + "\n".join(
+                result.warnings[:10]) + ("\n..." if len(result.warnings) > 10
+                else ""))
+
+    def PackExported(self, result):
+        self.ClosePackDialog()
+        QMessageBox.information(self, "Export", "The export was successful")
+
+    def PackFailed(self, error):
+        self.ClosePackDialog()
+        QMessageBox.warning(self, "Error", "%s failed. %s"
+            % (self.pack_title, error))
+
+    def PackCancelled(self):
+        self.ClosePackDialog()
+        self.statusBar().showMessage("%s cancelled." % self.pack_title)
+
+    def ApplyPackDiff(self, diff):
+        # Edits the teams in place, unless the pack also moved them around or
+        # repeats a name, then it's all replaced
+        teams = diff.roster["teams"]
+        if len(set(teams)) != len(teams):
+            self.ApplyImportedTeams(diff.roster)
+            return
+        players = diff.roster["players"]
+        for team in diff.removed:
+            self.roster_model.remove_team(team)
+            self.teams_store.remove_team(team)
+        for team in diff.added:
+            self.roster_model.add_team(team, players.get(team, []))
+            self.teams_store.add_team(team, self.registry.players[team])
+        for team in diff.members:
+            self.roster_model.set_members(team, players.get(team, []))
+            self.teams_store.set_members(team, self.registry.players[team])
+        if self.registry.teams != teams:
+            self.ApplyImportedTeams(diff.roster)
+            return
+        self.config["total_teams"] = len(self.registry)
+        self.config_store.changed()
+        self.statusBar().showMessage("Teams imported successfully.")
+        self.teamcreation_wid.close()
+
+    def RefreshSeatLogos(self, team_ids):
+        # The seats showing a logo that changed
+        for team_id in team_ids:
+            logo = self.registry.logo(team_id)
+            for image, seat_logo in list(self.seat_logos.items()):
+                if seat_logo == logo:
+                    self.SetSeatLogo(image, team_id)
+
+    def ApplyImportedTeams(self, json_teams):
+        self.registry = TeamRegistry.from_dict(json_teams)
+        self.roster_model.set_registry(self.registry)
+
+        self.teams_store.replace(self.registry.to_dict())
+        self.config["total_teams"] = len(self.registry)
+        self.config_store.changed()
+
+        for cloth in (self.cloth_east, self.cloth_south, self.cloth_west,
+                      self.cloth_north):
+            cloth.setCurrentIndex(0)
+        self.SetSeatLogo(self.image_east, 1)
+        self.SetSeatLogo(self.image_south, 1)
+        self.SetSeatLogo(self.image_west, 1)
+        self.SetSeatLogo(self.image_north, 1)
+        self.statusBar().showMessage("Teams imported successfully.")
+        self.teamcreation_wid.close()
 
 
     def AddMember(self, member):
@@ -432,7 +596,7 @@ class TableClothGenerator(QMainWindow):
 
         self.teams_list = QComboBox(self)
         self.teams_list.addItem("--- Select a team ---")
-        for team in self.teams:
+        for team in self.registry.teams:
             self.teams_list.addItem(team)
         self.teams_list.currentIndexChanged.connect(self.UpdateTeamInfo)
 
@@ -494,7 +658,7 @@ class TableClothGenerator(QMainWindow):
             if self.config_team_members.count() > 0:
                 self.config_team_members.clear()
             self.config_team_members.addItems(
-                self.players[sender.currentText()])
+                self.registry.players[sender.currentText()])
 
     def AddNewMember(self):
 
@@ -514,28 +678,17 @@ class TableClothGenerator(QMainWindow):
 
     def DeleteTeam(self):
         team_id = int(self.config_team_id.text())
-        is_last_item = self.teams[self.teams.index(
-            self.config_team_name.text())] == (self.teams[len(self.teams)-1])
-        self.teams.pop(self.teams.index(self.config_team_name.text()))
-        self.players.pop(self.config_team_name.text())
-        new_teamlist = {}
-        new_teamlist["teams"] = self.teams
-        new_teamlist["players"] = self.players
-        current_teams = open(THISDIR + "\\config\\teams.json", "w+",
-                        encoding="utf-8")
-        current_teams.write(json.dumps(new_teamlist, indent=4))
-        current_teams.close()
+        is_last_item = self.roster_model.remove_team(
+            self.config_team_name.text()) == len(self.registry) + 1
+        self.teams_store.remove_team(self.config_team_name.text())
+        # The teams after it move up, that logo no longer is this team's
+        self.teams_store.forget_logo(logo_path(team_id))
 
         if is_last_item == True:
             self.teams_list.setCurrentIndex(1)
         else:
             self.teams_list.setCurrentIndex(team_id+1)
         self.teams_list.removeItem(team_id)
-        self.UpdatePlayersList()
-        self.cloth_east.setModel(self.players_combobox.model())
-        self.cloth_south.setModel(self.players_combobox.model())
-        self.cloth_west.setModel(self.players_combobox.model())
-        self.cloth_north.setModel(self.players_combobox.model())
 
     def ExportTeams(self):
 
@@ -548,42 +701,21 @@ class TableClothGenerator(QMainWindow):
             export_filename = exported_file[0]
             if export_filename.endswith(".zip") is False:
                 export_filename += ".zip"
-            files_to_export = []
-            files_to_export.append("config\\teams.json")
-
-            for root, directories, files in os.walk(THISDIR+"\\images\\logos"):
-                for filename in files:
-                    filepath = os.path.join(root, filename)
-                    files_to_export.append(filepath)
-
-            with ZipFile(export_filename, "w") as export_zip:
-                for exp_file in files_to_export:
-                    export_name = exp_file
-                    if exp_file.endswith(".json"):
-                        split_name = exp_file.split("\\")
-                        export_name = split_name[-1]
-                    if exp_file.endswith(".png"):
-                        split_name = exp_file.split("\\")
-                        export_name = "\\logos\\" + split_name[-1]
-                    export_zip.write(exp_file, arcname=export_name)
-                export_zip.close()
-
-            if os.path.exists(export_filename):
-                QMessageBox.information(self, "Export",
-                    "The export was successful")
+            # Hashed and written in the background
+            roster = copy.deepcopy(self.registry.to_dict())
+            self.StartPackThread(PackThread(lambda progress, cancel:
+                export_pack(export_filename, roster, progress=progress,
+                cancel=cancel)), "Export", "Exporting teams...",
+                self.PackExported)
 
     def SaveEdits(self):
 
         list_members = [str(self.config_team_members.item(i).text()) for i in \
                                         range(self.config_team_members.count())]
-        self.players[self.config_team_name.text()] = list_members
-        new_teamlist = {}
-        new_teamlist["teams"] = self.teams
-        new_teamlist["players"] = self.players
-        current_teams = open(THISDIR + "\\config\\teams.json", "w+",
-                        encoding="utf-8")
-        current_teams.write(json.dumps(new_teamlist, indent=4))
-        current_teams.close()
+        self.roster_model.set_members(self.config_team_name.text(),
+            list_members)
+        self.teams_store.set_members(self.config_team_name.text(),
+            list_members)
         self.teamedit_wid.close()
         self.statusBar().showMessage("Settings saved.")
 
@@ -602,7 +734,6 @@ class TableClothGenerator(QMainWindow):
         background = Image.open(self.background).resize((2048,2048))\
                                                 .convert("RGBA")
 
-        self.mat_thread = QThread()
         east_id = self.SearchTeamID(self.cloth_east, True)
         south_id = self.SearchTeamID(self.cloth_south, True)
         west_id = self.SearchTeamID(self.cloth_west, True)
@@ -618,14 +749,11 @@ class TableClothGenerator(QMainWindow):
             east_id, south_id, west_id, north_id,
             self.technical_lines.isChecked(), save_to_route,
             self.bg_image, True)
-        self.mat_worker.moveToThread(self.mat_thread)
-        self.mat_thread.started.connect(self.mat_worker.run)
         self.mat_worker.update_progress.connect(self.UpdateStatus)
-        self.mat_worker.finished.connect(self.mat_thread.quit)
-        self.mat_worker.finished.connect(self.mat_worker.deleteLater)
-        self.mat_thread.finished.connect(self.mat_thread.deleteLater)
-        self.mat_thread.finished.connect(self.MatPreviewWindow)
-        self.mat_thread.start()
+        self.mat_worker.preview_ready.connect(self.SetPreviewImage)
+        self.mat_worker.finished.connect(self.MatPreviewWindow)
+        # Picking another image drops the preview of the last one
+        self.render_scheduler.preview(self.mat_worker, "mat")
 
 
     def MatPreviewWindow(self):
@@ -642,8 +770,7 @@ class TableClothGenerator(QMainWindow):
         mat_preview_title = QLabel(self)
         mat_preview_title.setText("Selected image (1/4 scale)")
         mat_preview = QLabel(self)
-        mat_preview.setPixmap(QPixmap(tempfile.gettempdir()+"\\Table_Dif.jpg")\
-                                .scaled(512,512))
+        mat_preview.setPixmap(QPixmap.fromImage(self.preview_image))
         confirm = QPushButton(self)
         confirm.setText("Confirm")
         confirm.clicked.connect(
@@ -679,11 +806,10 @@ class TableClothGenerator(QMainWindow):
 
         self.background = new_bg
         self.config["image_route"] = self.bg_image
+        # The old base layers are no longer valid
+        self._createRenderer(self.bg_image)
 
-        new_file = open(THISDIR + "\\config\\config.json", "w+",
-                                        encoding="utf-8")
-        new_file.write(json.dumps(self.config, indent=4))
-        new_file.close()
+        self.config_store.changed()
 
         self.statusBar().showMessage('New background added.')
         self.statusBar().removeWidget(self.progress_bar)
@@ -693,7 +819,6 @@ class TableClothGenerator(QMainWindow):
 
     def GeneratePreview(self):
 
-        self.preview_thread = QThread()
         east_id = self.SearchTeamID(self.cloth_east, True)
         south_id = self.SearchTeamID(self.cloth_south, True)
         west_id = self.SearchTeamID(self.cloth_west, True)
@@ -705,46 +830,73 @@ class TableClothGenerator(QMainWindow):
             save_to_route = self.config["save_route"]
         self._createProgressBar()
 
+        self.preview_timings = {}
+        self.preview_label = None
         self.preview_worker = GenerateImageThread(self.background,
             self.table_border, east_id, south_id, west_id, north_id,
             self.technical_lines.isChecked(), save_to_route,
-            self.bg_image, True)
-        self.preview_worker.moveToThread(self.preview_thread)
-        self.preview_thread.started.connect(self.preview_worker.run)
+            self.bg_image, True, self.compositor, draft=True,
+            trace_file=self.config.get("trace_file"),
+            trace_format=self.config.get("trace_format", "jsonl"))
         self.preview_worker.update_progress.connect(self.UpdateStatus)
-        self.preview_worker.finished.connect(self.preview_thread.quit)
-        self.preview_worker.finished.connect(self.preview_worker.deleteLater)
-        self.preview_thread.finished.connect(self.preview_thread.deleteLater)
-        self.preview_thread.finished.connect(self.PreviewWindow)
-        self.preview_thread.start()
-
-    def PreviewWindow(self):
-
-        self.statusBar().showMessage('Tablecloth preview generated.')
+        self.preview_worker.preview_ready.connect(self.ShowPreview)
+        self.preview_worker.timing.connect(self.preview_timings.__setitem__)
+        self.preview_worker.finished.connect(self.PreviewFinished)
+        self.preview_worker.trace_failed.connect(self.TraceFailed)
+        # Only the latest preview is rendered to the end
+        self.render_scheduler.preview(self.preview_worker)
+
+    def SetPreviewImage(self, image):
+        # The worker sends the preview already scaled down
+        self.preview_image = image
+
+    def ShowPreview(self, image):
+        # The draft opens the window, the full render replaces it
+        self.SetPreviewImage(image)
+        if self.preview_label is None:
+            self.PreviewWindow()
+        else:
+            self.preview_label.setPixmap(QPixmap.fromImage(image))
+
+    def PreviewFinished(self):
+
+        message = 'Tablecloth preview generated.'
+        if "first_frame" in self.preview_timings:
+            message += ' First frame in %d ms' \
+                % (self.preview_timings["first_frame"] * 1000)
+            if "full_render" in self.preview_timings:
+                message += ', full render in %d ms' \
+                    % (self.preview_timings["full_render"] * 1000)
+            message += '.'
+        self.statusBar().showMessage(message)
         self.statusBar().removeWidget(self.progress_bar)
         # Now you can go back to rigging
         self.ChangeAppStatus(True)
+        if self.preview_label is not None:
+            self.preview_confirm.setEnabled(True)
+
+    def PreviewWindow(self):
 
         self.preview_wid = QWidget()
         self.preview_wid.resize(600, 600)
         self.preview_wid.setWindowTitle("Tablecloth preview")
 
-        tablecloth = QPixmap(tempfile.gettempdir()+"\\Table_Dif.jpg")
-
         tablecloth_preview_title = QLabel(self)
         tablecloth_preview_title.setText("Tablecloth preview (1/4 scale)")
-        tablecloth_preview = QLabel(self)
-        tablecloth_preview.setPixmap(tablecloth.scaled(512,512))
-        confirm = QPushButton(self)
-        confirm.setText("Confirm")
-        confirm.clicked.connect(self.GenerateImage)
-        confirm.clicked.connect(self.preview_wid.close)
+        self.preview_label = QLabel(self)
+        self.preview_label.setPixmap(QPixmap.fromImage(self.preview_image))
+        # Not until the full render is done
+        self.preview_confirm = QPushButton(self)
+        self.preview_confirm.setText("Confirm")
+        self.preview_confirm.setEnabled(False)
+        self.preview_confirm.clicked.connect(self.GenerateImage)
+        self.preview_confirm.clicked.connect(self.preview_wid.close)
 
         vbox = QVBoxLayout()
         vbox.setAlignment(QtCore.Qt.AlignCenter)
         vbox.addWidget(tablecloth_preview_title)
-        vbox.addWidget(tablecloth_preview)
-        vbox.addWidget(confirm)
+        vbox.addWidget(self.preview_label)
+        vbox.addWidget(self.preview_confirm)
         self.preview_wid.setLayout(vbox)
 
         self.preview_wid.setWindowModality(QtCore.Qt.ApplicationModal)
@@ -767,6 +919,12 @@ class TableClothGenerator(QMainWindow):
 
         mbox.exec()
 
+    def TraceFailed(self, error):
+        # The render itself went fine
+        QMessageBox.warning(self, "Tracing",
+            "Couldn't write the trace to %s. %s"
+            % (self.config.get("trace_file"), error))
+
     def UpdateStatus(self, status):
         self.progress_bar.setValue(status)
 
@@ -783,36 +941,26 @@ class TableClothGenerator(QMainWindow):
             QFileDialog.ShowDirsOnly | QFileDialog.DontResolveSymlinks)
 
         if self.config["save_route"] != save_to_route:
-            temp_file = open(THISDIR + "\\config\\config.json", "r",
-                                            encoding="utf-8")
-            fp_teams = json.loads(temp_file.read())
-            fp_teams["save_route"] = save_to_route
-            fp_teams["image_route"] = self.bg_image
-            new_file = open(THISDIR + "\\config\\config.json", "w+",
-                                            encoding="utf-8")
-            new_file.write(json.dumps(fp_teams, indent=4))
-            new_file.close()
+            self.config["save_route"] = save_to_route
+            self.config["image_route"] = self.bg_image
+            self.config_store.changed()
 
-        self.background = Image.open(THISDIR + "\\images\\mat.png")
-        self.table_border = Image.open(THISDIR + "\\images\\table_border.png")
-        self.tech_lines = Image.open(THISDIR + "\\images\\technical_lines.png")
-
-        self.thread = QThread()
         east_id = self.SearchTeamID(self.cloth_east, True)
         south_id = self.SearchTeamID(self.cloth_south, True)
         west_id = self.SearchTeamID(self.cloth_west, True)
         north_id = self.SearchTeamID(self.cloth_north, True)
         self.worker = GenerateImageThread(self.background, self.table_border,
             east_id, south_id, west_id, north_id,
-            self.technical_lines.isChecked(), save_to_route, self.bg_image)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
+            self.technical_lines.isChecked(), save_to_route, self.bg_image,
+            compositor=self.compositor,
+            profile=load_profiles(self.config)["final"],
+            trace_file=self.config.get("trace_file"),
+            trace_format=self.config.get("trace_format", "jsonl"))
         self.worker.update_progress.connect(self.UpdateStatus)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.finished.connect(self.GeneratedDialog)
-        self.thread.start()
+        self.worker.finished.connect(self.GeneratedDialog)
+        self.worker.trace_failed.connect(self.TraceFailed)
+        # Ahead of any preview, which is stale once the table is confirmed
+        self.render_scheduler.final(self.worker)
 
     def ChangeAppStatus(self, status):
         # True for enable, False for disable.
@@ -827,16 +975,11 @@ class TableClothGenerator(QMainWindow):
         self.generate.setEnabled(status)
 
     def SearchTeamID(self, cloth, plus_one=False):
-        team_id = self.teams.index(cloth.itemData(cloth.currentIndex()))
-        if plus_one:
-            team_id += 1
+        team_id = self.registry.team_id(cloth.itemData(cloth.currentIndex()))
+        if not plus_one:
+            team_id -= 1
         return team_id
 
-    def UpdatePlayersList(self):
-        for team, members in self.players.items():
-            for member in members:
-                self.players_combobox.addItem(member, team)
-
     def center(self):
         qr = self.frameGeometry()
         cp = QScreen().availableGeometry().center()
@@ -866,6 +1009,10 @@ class TableClothGenerator(QMainWindow):
 
         version_message.exec()
 
+    def SaveSettings(self):
+        self.config_store.flush()
+        self.teams_store.flush()
+
     def GetHelp(self):
         webbrowser.open("https://github.com/vg-mjg/tablecloth-generator/wiki")
 
@@ -0,0 +1,224 @@
+# instrument.py - Timing of every render stage, without Qt
+# Standard python library
+import os
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+# Peak memory where there's no /proc, it's not there on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+# Windows has neither, it asks the process memory counters
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class _MemoryCounters(ctypes.Structure):
+        # PROCESS_MEMORY_COUNTERS
+        _fields_ = [("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t)]
+
+
+# start is in seconds since the tracer was created
+Span = namedtuple("Span", ["name", "start", "duration", "thread", "args"])
+
+TRACE_FORMATS = ("jsonl", "trace")
+
+# The tracer of whatever render is running in this thread, if any
+_active_tracer = ContextVar("active_tracer", default=None)
+
+
+class Tracer:
+
+    def __init__(self, on_span=None):
+        self.on_span = on_span
+        self.spans = []
+        # Wall clock to place the spans in time when written out
+        self.created = time.time()
+        self._origin = perf_counter()
+
+    @contextmanager
+    def active(self):
+        # Every span() in this thread goes to this tracer until it's done
+        token = _active_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _active_tracer.reset(token)
+
+    def record(self, name, start, end, args):
+        finished = Span(name, start - self._origin, end - start,
+                        threading.get_ident(), args)
+        self.spans.append(finished)
+        if self.on_span is not None:
+            self.on_span(finished)
+
+    def totals(self):
+        # Seconds per stage name, adding up repeated stages
+        totals = {}
+        for finished in self.spans:
+            totals[finished.name] = totals.get(finished.name, 0)\
+                                    + finished.duration
+        return totals
+
+    def write(self, path, trace_format="jsonl"):
+        # Appends to path. "jsonl" is a JSON object per span, "trace" the
+        # Trace Event Format that chrome://tracing and Perfetto open, written
+        # as an unterminated array so it can keep growing.
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError("Unknown trace format '%s', use one of: %s"
+                             % (trace_format, ", ".join(TRACE_FORMATS)))
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", encoding="utf-8") as fp_trace:
+            if trace_format == "trace" and new_file:
+                fp_trace.write("[\n")
+            for finished in self.spans:
+                if trace_format == "jsonl":
+                    event = {"name": finished.name,
+                             "timestamp": self.created + finished.start,
+                             "duration": finished.duration,
+                             "thread": finished.thread,
+                             "args": finished.args}
+                    fp_trace.write(json.dumps(event) + "\n")
+                else:
+                    event = {"name": finished.name, "ph": "X",
+                             "ts": (self.created + finished.start) * 1e6,
+                             "dur": finished.duration * 1e6,
+                             "pid": os.getpid(), "tid": finished.thread,
+                             "args": finished.args}
+                    fp_trace.write(json.dumps(event) + ",\n")
+
+
+@contextmanager
+def span(name, **args):
+    # Times the block for the active tracer, does nothing if there's none.
+    # The block gets the args, to add what it only knows at the end.
+    tracer = _active_tracer.get()
+    if tracer is None:
+        yield args
+        return
+    start = perf_counter()
+    try:
+        yield args
+    finally:
+        tracer.record(name, start, perf_counter(), args)
+
+
+def reset_peak_memory():
+    # Only Linux lets a process reset its peak, elsewhere peak_memory() is
+    # the peak since the process started
+    try:
+        with open("/proc/self/clear_refs", "w") as fp_refs:
+            fp_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _windows_peak_memory():
+    # PeakWorkingSetSize is what VmHWM is on Linux
+    get_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_process.restype = wintypes.HANDLE
+    get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(_MemoryCounters),
+                         wintypes.DWORD]
+    get_info.restype = wintypes.BOOL
+    counters = _MemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_info(get_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_memory():
+    # Peak resident memory of the process in bytes, None if it's unknown
+    if sys.platform == "win32":
+        try:
+            return _windows_peak_memory()
+        except (OSError, AttributeError):
+            return None
+    try:
+        with open("/proc/self/status", "r") as fp_status:
+            for line in fp_status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS gives it in bytes, the rest in KiB
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def memory_span(name, **args):
+    # A span that also records in "peak_rss" the peak memory while it ran.
+    # The peak is per process, so renders running at the same time in other
+    # threads count too.
+    reset_peak_memory()
+    with span(name, **args) as args:
+        try:
+            yield args
+        finally:
+            args["peak_rss"] = peak_memory()
+
+
+class ProgressModel:
+    # Turns finished stages into a percentage, weighting every stage by how
+    # long it took on average in the last renders. Stages that don't happen
+    # (a cached logo isn't decoded) just make the bar end sooner.
+
+    # Seconds from the benchmark baseline, until there are real measurements
+    DEFAULT_WEIGHTS = {"decode": 0.01, "rotate": 0.01, "compose_base": 0.05,
+                       "compose": 0.03, "preview_scale": 0.01,
+                       "convert": 0.01, "encode": 0.02, "write": 0.005}
+    # Stages of a render done from scratch
+    FINAL_STAGES = ["decode", "rotate"] * 4 + ["compose_base", "compose",
+                    "convert", "encode", "write"]
+    PREVIEW_STAGES = ["decode", "rotate"] * 4 + ["compose_base", "compose",
+                      "preview_scale"]
+
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        self._lock = threading.Lock()
+
+    def start(self, stages):
+        # Returns the state of one render, to give to advance()
+        with self._lock:
+            remaining = {}
+            for stage in stages:
+                remaining[stage] = remaining.get(stage, 0) + 1
+            total = sum(self.weights.get(stage, 0) for stage in stages)
+            return {"remaining": remaining, "total": total, "done": 0.0}
+
+    def advance(self, state, finished):
+        with self._lock:
+            old = self.weights.get(finished.name)
+            if old is not None:
+                self.weights[finished.name] = old + self.smoothing\
+                                              * (finished.duration - old)
+            if state["remaining"].get(finished.name, 0) > 0:
+                state["remaining"][finished.name] -= 1
+                state["done"] += old or 0
+        if state["total"] <= 0:
+            return 0
+        return min(99, int(100 * state["done"] / state["total"]))
+
+
+PROGRESS = ProgressModel()
@@ -0,0 +1,183 @@
+# parallel.py - Render many tablecloths at once with a pool of processes
+# Standard python library
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from timeit import default_timer as timer
+# Image manipulation libraries
+from PIL import Image
+# Custom libraries
+from render import SEATS, TableclothRenderer, render_table
+from instrument import Tracer
+
+
+# peak_memory is the peak resident memory of the worker in bytes while it
+# rendered the table, None if it's not known
+RenderResult = namedtuple("RenderResult", ["name", "output", "error",
+                                           "peak_memory"])
+
+# Filled in every worker by _init_worker
+_worker_renderer = None
+_worker_memory = []
+
+
+class SharedLayer:
+    # An RGBA layer copied once into shared memory, so the workers can read it
+    # without decoding the PNG again or keeping a copy each
+
+    def __init__(self, image):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        data = image.tobytes()
+        self.size = image.size
+        self.memory = shared_memory.SharedMemory(create=True, size=len(data))
+        self.memory.buf[:len(data)] = data
+
+    def spec(self):
+        return self.memory.name, self.size
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach_layer(spec):
+    name, size = spec
+    memory = shared_memory.SharedMemory(name=name)
+    _worker_memory.append(memory)
+    return Image.frombuffer("RGBA", size, memory.buf, "raw", "RGBA", 0, 1)
+
+
+def _init_worker(layers, logos_dir, sources, image_route, base_cache,
+    render_cache, low_memory):
+    global _worker_renderer
+    if low_memory:
+        # Every worker streams the base layer from the disk cache instead
+        _worker_renderer = TableclothRenderer(sources["mat"],
+            sources["border"], sources["tech_lines"], logos_dir,
+            base_cache=base_cache, image_route=image_route,
+            render_cache=render_cache, low_memory=True)
+        return
+    mat, border, tech_lines = layers
+    _worker_renderer = TableclothRenderer(attach_layer(mat),
+        attach_layer(border),
+        attach_layer(tech_lines) if tech_lines is not None else None,
+        logos_dir, base_cache=base_cache, image_route=image_route,
+        render_cache=render_cache)
+    # The layers come from shared memory but the files they were read from
+    # still key the caches
+    _worker_renderer._sources.update(sources)
+
+
+def _render_one(renderer, table, output_dir, technical_lines, profile):
+    # Errors are sent back with the result so one bad table doesn't stop
+    # the rest of the batch
+    tracer = Tracer()
+    try:
+        table_dir = os.path.join(output_dir, table["name"])
+        os.makedirs(table_dir, exist_ok=True)
+        with tracer.active():
+            output = render_table(renderer,
+                [table[seat] for seat in SEATS], table_dir, technical_lines,
+                profile=profile)
+        return RenderResult(table["name"], output, None, peak_rss(tracer))
+    except Exception as error:
+        return RenderResult(table["name"], None,
+            "%s: %s" % (type(error).__name__, error), peak_rss(tracer))
+
+
+def _render_job(table, output_dir, technical_lines, profile):
+    return _render_one(_worker_renderer, table, output_dir, technical_lines,
+        profile)
+
+
+def render_serial(tables, output_dir, renderer=None, technical_lines=False,
+    profile=None):
+    # The same results as render_parallel, one table after another in this
+    # process
+    if renderer is None:
+        renderer = TableclothRenderer()
+    return [_render_one(renderer, table, output_dir, technical_lines,
+                        profile) for table in tables]
+
+
+def peak_rss(tracer):
+    # What the "render" span of render_table measured
+    for finished in tracer.spans:
+        if finished.name == "render":
+            return finished.args.get("peak_rss")
+    return None
+
+
+def render_parallel(tables, output_dir, renderer=None, technical_lines=False,
+    workers=None, profile=None):
+    # Results come back in the same order as the tables. A low memory
+    # renderer makes low memory workers, if its layers come from files.
+    if renderer is None:
+        renderer = TableclothRenderer()
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    low_memory = renderer.low_memory and all(renderer._sources.values())
+    layers = []
+    shared = None
+    if not low_memory:
+        layers = [SharedLayer(renderer.mat), SharedLayer(renderer.border)]
+        if technical_lines:
+            layers.append(SharedLayer(renderer.tech_lines))
+        shared = (layers[0].spec(), layers[1].spec(),
+                  layers[2].spec() if technical_lines else None)
+    initargs = (shared, renderer.logos_dir, renderer._sources,
+        renderer.image_route, renderer.base_cache, renderer.render_cache,
+        low_memory)
+
+    results = []
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+            initargs=initargs) as executor:
+            jobs = [executor.submit(_render_job, table, output_dir,
+                technical_lines, profile) for table in tables]
+            for table, job in zip(tables, jobs):
+                try:
+                    results.append(job.result())
+                except Exception as error:
+                    # The worker itself died
+                    results.append(RenderResult(table["name"], None,
+                        "%s: %s" % (type(error).__name__, error), None))
+    finally:
+        for layer in layers:
+            layer.release()
+    return results
+
+
+def benchmark(tables, output_dir, renderer=None, technical_lines=False,
+    max_workers=None, profile=None):
+    # Renders the same tables with 1, 2, 4... workers up to max_workers and
+    # returns (workers, seconds, speedup) for each run
+    if renderer is None:
+        renderer = TableclothRenderer()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    worker_counts = []
+    workers = 1
+    while workers < max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(max_workers)
+
+    # Every run has to render for real, not copy from the last one
+    render_cache, renderer.render_cache = renderer.render_cache, False
+    timings = []
+    try:
+        for workers in worker_counts:
+            start = timer()
+            render_parallel(tables, output_dir, renderer, technical_lines,
+                workers, profile)
+            elapsed = timer() - start
+            timings.append((workers, elapsed, timings[0][1] / elapsed
+                if timings else 1.0))
+    finally:
+        renderer.render_cache = render_cache
+    return timings
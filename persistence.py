@@ -0,0 +1,124 @@
+# persistence.py - config.json and teams.json kept in memory and written back
+# in batches, without Qt
+# Standard python library
+import os
+import json
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# Absolute path to the current folder as constant for easy access
+THISDIR = str(Path(__file__).resolve().parent)
+CONFIG_DIR = os.path.join(THISDIR, "config")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+TEAMS_FILE = os.path.join(CONFIG_DIR, "teams.json")
+
+# Seconds without changes before they're written
+SAVE_DELAY = 0.5
+# Rosters bigger than this are written without indentation
+COMPACT_OVER = 256 * 1024
+
+
+def write_json(path, data, compact_over=None):
+    # Written to a temporary file next to it and renamed over it, so a crash
+    # never leaves half a file. Indented like it always was, unless it's
+    # over compact_over bytes without the indentation.
+    text = json.dumps(data, separators=(",", ":"))
+    if compact_over is None or len(text) <= compact_over:
+        text = json.dumps(data, indent=4)
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                     suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp_temp:
+            fp_temp.write(text)
+            fp_temp.flush()
+            os.fsync(fp_temp.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class JsonStore:
+    # One JSON file kept in memory. Every change is marked with changed()
+    # and written delay seconds after the last one, so a run of edits is one
+    # write. Inside transaction() nothing is written until it ends. The
+    # timer is threading.Timer by default, the GUI gives one that runs in
+    # its own thread so the data isn't read while it's being changed.
+
+    def __init__(self, path, data, delay=SAVE_DELAY, compact_over=None,
+        timer=threading.Timer):
+        self.path = path
+        self.data = data
+        self.delay = delay
+        self.compact_over = compact_over
+        self.writes = 0
+        self._timer_factory = timer
+        self._timer = None
+        self._dirty = False
+        self._depth = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path, default=None, **options):
+        # default is used, and written at the first change, if there's no
+        # file yet
+        if os.path.exists(path) or default is None:
+            with open(path, "r", encoding="utf-8") as fp_store:
+                return cls(path, json.loads(fp_store.read()), **options)
+        return cls(path, default, **options)
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def changed(self):
+        with self._lock:
+            self._dirty = True
+            if self._depth == 0:
+                self._schedule()
+
+    def replace(self, data):
+        # The whole content, like after an import
+        with self._lock:
+            self.data = data
+            self.changed()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._depth += 1
+        try:
+            yield self.data
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0 and self._dirty:
+                    self._schedule()
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.delay <= 0:
+            self._timer = None
+            self.flush()
+            return
+        self._timer = self._timer_factory(self.delay, self.flush)
+        self._timer.start()
+
+    def flush(self):
+        # Writes the changes now, if there are any
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return False
+            write_json(self.path, self.data, self.compact_over)
+            self._dirty = False
+            self.writes += 1
+            return True
@@ -0,0 +1,115 @@
+# registry.py - Teams and players indexed for the lookups the GUI does
+# Standard python library
+import json
+# Custom libraries
+from render import LOGOS_DIR, logo_path
+from search import PlayerIndex
+
+
+class TeamRegistry:
+    # The teams.json roster: teams in ID order (the ID is the position plus
+    # one, it's what the logo is named after) and the members of each team.
+    # Every change updates the indexes for that team only, so lookups don't
+    # depend on how many players there are.
+
+    def __init__(self, teams=None, players=None, logos_dir=LOGOS_DIR):
+        self.teams = []
+        self.players = {}
+        self.logos_dir = logos_dir
+        self._ids = {}
+        # A player can be in more than one team with the same name
+        self._player_teams = {}
+        # What the seat search boxes query
+        self.search = PlayerIndex()
+        for team in teams or []:
+            self._append(team, (players or {}).get(team, []))
+
+    @classmethod
+    def from_dict(cls, roster, logos_dir=LOGOS_DIR):
+        return cls(roster["teams"], roster["players"], logos_dir)
+
+    @classmethod
+    def from_file(cls, teams_file, logos_dir=LOGOS_DIR):
+        with open(teams_file, "r", encoding="utf-8") as fp_teams:
+            return cls.from_dict(json.loads(fp_teams.read()), logos_dir)
+
+    def to_dict(self):
+        return {"teams": self.teams, "players": self.players}
+
+    def __len__(self):
+        return len(self.teams)
+
+    def __contains__(self, team):
+        return team in self._ids
+
+    def team_id(self, team):
+        # Raises KeyError for a team that doesn't exist
+        return self._ids[team]
+
+    def team_name(self, team_id):
+        if not 1 <= team_id <= len(self.teams):
+            raise KeyError(team_id)
+        return self.teams[team_id - 1]
+
+    def team_of(self, player):
+        # The first team the player is in, None if there's none
+        teams = self._player_teams.get(player)
+        return teams[0] if teams else None
+
+    def teams_of(self, player):
+        return list(self._player_teams.get(player, []))
+
+    def logo(self, team):
+        # By name or ID
+        if not isinstance(team, int):
+            team = self.team_id(team)
+        return logo_path(team, self.logos_dir)
+
+    def player_items(self):
+        # (player, team) in the order the combobox lists them
+        return [(member, team) for team in self.teams
+                for member in self.players[team]]
+
+    def _index_members(self, team):
+        for member in self.players[team]:
+            teams = self._player_teams.setdefault(member, [])
+            if team not in teams:
+                teams.append(team)
+            self.search.add(member, team)
+
+    def _unindex_members(self, team):
+        for member in self.players[team]:
+            teams = self._player_teams.get(member, [])
+            if team in teams:
+                teams.remove(team)
+            if not teams:
+                self._player_teams.pop(member, None)
+            self.search.remove(member, team)
+
+    def _append(self, team, members):
+        # An old teams.json may repeat a name, the first one keeps it
+        self.teams.append(team)
+        self.players[team] = list(members)
+        self._ids.setdefault(team, len(self.teams))
+        self._index_members(team)
+
+    def add_team(self, team, members=()):
+        if team in self._ids:
+            raise ValueError("There's already a team called '%s'" % team)
+        self._append(team, members)
+        return self._ids[team]
+
+    def set_members(self, team, members):
+        self._unindex_members(team)
+        self.players[team] = list(members)
+        self._index_members(team)
+
+    def remove_team(self, team):
+        # The teams after it move up one ID, like they always did
+        team_id = self._ids.pop(team)
+        self._unindex_members(team)
+        del self.players[team]
+        self.teams.pop(team_id - 1)
+        for position in range(team_id - 1, len(self.teams)):
+            self._ids[self.teams[position]] = position + 1
+        return team_id
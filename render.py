@@ -0,0 +1,584 @@
+# render.py - Qt-free compositing of the tablecloth layers
+# Standard python library
+import os
+import json
+import threading
+from pathlib import Path
+from collections import OrderedDict
+# Image manipulation libraries
+from PIL import Image
+# Custom libraries
+from cache import BASE_CACHE, RENDER_CACHE, content_hash
+from encoder import encode, output_name
+from instrument import memory_span, span
+from backend import make_backend
+
+
+# Absolute path to the current folder as constant for easy access
+THISDIR = str(Path(__file__).resolve().parent)
+IMAGES_DIR = os.path.join(THISDIR, "images")
+LOGOS_DIR = os.path.join(IMAGES_DIR, "logos")
+
+PREVIEW_SIZE = (512, 512)
+# Drafts are composited at 1/4 scale, which is already the preview size
+DRAFT_SCALE = 4
+FULL_QUARTER_SIZE = (1568, 786)
+LOGO_SIZE = (250, 250)
+# Folder next to the logos with them already rotated for every seat
+PREPARED_FOLDER = "prepared"
+# Logo cache of each renderer in low memory mode, enough for the small logos
+LOW_MEMORY_LOGO_BYTES = 16 * 1024 * 1024
+
+SEATS = ("east", "south", "west", "north")
+# Rotation, position if it's a full quarter, position if it's just the logo
+SEAT_LAYOUT = {
+    "east": (0, (240, 1020), (900, 1325)),
+    "south": (90, (1020, 235), (1420, 900)),
+    "west": (180, (235, 240), (890, 370)),
+    "north": (-90, (240, 240), (400, 910)),
+}
+
+
+def logo_path(team_id, logos_dir=LOGOS_DIR):
+    return os.path.join(logos_dir, "team%d.png" % team_id)
+
+
+def prepare_logo(image, seat):
+    # Rotate the logo to face its seat and leave it ready to be pasted
+    rotation, full_position, logo_position = SEAT_LAYOUT[seat]
+    if rotation == 0:
+        tile = image.convert("RGBA")
+    else:
+        tile = image.rotate(rotation, expand=True).convert("RGBA")
+    if image.size == FULL_QUARTER_SIZE:
+        return tile, tile.getchannel("A"), full_position
+    tile = tile.resize(LOGO_SIZE)
+    return tile, tile.getchannel("A"), logo_position
+
+
+def prepared_path(logo, seat):
+    folder, name = os.path.split(logo)
+    return os.path.join(folder, PREPARED_FOLDER,
+                        "%s.%s.png" % (os.path.splitext(name)[0], seat))
+
+
+def write_prepared(image, logo):
+    # Saves what prepare_logo gives for every seat next to the logo. They're
+    # written after the logo, so they're never older than it.
+    os.makedirs(os.path.join(os.path.dirname(logo), PREPARED_FOLDER),
+                exist_ok=True)
+    for seat in SEATS:
+        path = prepared_path(logo, seat)
+        temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        prepare_logo(image, seat)[0].save(temp_path, "PNG", compress_level=1)
+        os.replace(temp_path, path)
+
+
+def prepared_current(logo):
+    # Whether every seat has a prepared file at least as new as the logo
+    logo_mtime = os.stat(logo).st_mtime_ns
+    for seat in SEATS:
+        try:
+            if os.stat(prepared_path(logo, seat)).st_mtime_ns < logo_mtime:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def read_prepared(logo, seat):
+    # The prepare_logo entry from the prepared file, None if there's none or
+    # the logo changed after it was written
+    path = prepared_path(logo, seat)
+    try:
+        if os.stat(path).st_mtime_ns < os.stat(logo).st_mtime_ns:
+            return None
+        with Image.open(path) as image:
+            with span("decode", path=path, prepared=True):
+                tile = image.convert("RGBA")
+    except (OSError, ValueError):
+        return None
+    rotation, full_position, logo_position = SEAT_LAYOUT[seat]
+    position = logo_position if tile.size == LOGO_SIZE else full_position
+    return tile, tile.getchannel("A"), position
+
+
+class LogoCache:
+    # Logos already rotated, converted and resized for their seat, at full or
+    # draft scale. Entries are keyed by the file modification time too, so an
+    # overwritten logo is never served stale, and the least recently used ones
+    # go first once the cache is over max_bytes.
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_bytes(entry):
+        tile, mask, position = entry
+        return tile.width * tile.height * (len(tile.getbands()) + 1)
+
+    def get(self, path, seat, scale=1):
+        key = (path, seat, scale, os.stat(path).st_mtime_ns)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if scale == 1:
+            # Imported packs come with the logos already rotated
+            entry = read_prepared(path, seat)
+            if entry is None:
+                with Image.open(path) as image:
+                    with span("decode", path=path):
+                        image.load()
+                    with span("rotate", seat=seat):
+                        entry = prepare_logo(image, seat)
+        else:
+            # Scaled down from the full size one, which is probably cached
+            tile, mask, (left, top) = self.get(path, seat)
+            with span("scale_logo", seat=seat, scale=scale):
+                tile = tile.reduce(scale)
+                entry = (tile, tile.getchannel("A"),
+                         (round(left / scale), round(top / scale)))
+        entry_bytes = self._entry_bytes(entry)
+
+        with self._lock:
+            # Drop whatever was cached from an older version of the file
+            for old_key in [k for k in self._entries
+                            if k[:2] == key[:2] and k[3] != key[3]]:
+                self._remove(old_key)
+            if key not in self._entries and entry_bytes <= self.max_bytes:
+                self._entries[key] = entry
+                self.size_bytes += entry_bytes
+                while self.size_bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        self.size_bytes -= self._entry_bytes(self._entries.pop(key))
+
+    def invalidate(self, path=None):
+        # Forget one logo, or every logo if no path is given
+        with self._lock:
+            for key in list(self._entries):
+                if path is None or key[0] == path:
+                    self._remove(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by every renderer in the process, so the GUI renders reuse the logos
+LOGO_CACHE = LogoCache()
+
+
+class TableclothRenderer:
+
+    def __init__(self, mat=None, border=None, tech_lines=None,
+        logos_dir=LOGOS_DIR, logo_cache=None, base_cache=None,
+        image_route=None, backend="pillow", render_cache=None,
+        low_memory=False):
+        # Every layer can be given already decoded or as a path
+        if mat is None:
+            mat = os.path.join(IMAGES_DIR, "mat.png")
+        if border is None:
+            border = os.path.join(IMAGES_DIR, "table_border.png")
+        if tech_lines is None:
+            tech_lines = os.path.join(IMAGES_DIR, "technical_lines.png")
+        self._sources = {"mat": self._source(mat),
+                         "border": self._source(border),
+                         "tech_lines": self._source(tech_lines)}
+        self._layers = {"mat": mat, "border": border,
+                        "tech_lines": tech_lines}
+        # In low memory mode the layers are only decoded to composite a base
+        # layer that isn't cached on disk yet, and every render reuses one
+        # RGB canvas that the base is streamed into from the disk cache
+        self.low_memory = low_memory
+        if not low_memory:
+            self._layer("mat")
+            self._layer("border")
+        self.logos_dir = logos_dir
+        if logo_cache is None:
+            logo_cache = LogoCache(LOW_MEMORY_LOGO_BYTES) if low_memory \
+                                                         else LOGO_CACHE
+        self.logo_cache = logo_cache
+        self.base_cache = base_cache if base_cache is not None else BASE_CACHE
+        self.image_route = image_route
+        self.render_cache = render_cache if render_cache is not None \
+                                         else RENDER_CACHE
+        self._bases = {}
+        self._size = None
+        self._canvas = None
+        # None means Pillow does the compositing. Low memory mode pastes into
+        # its one canvas, the backend's arrays would be a second copy.
+        if low_memory:
+            backend = "pillow"
+        self.backend_name = backend
+        self.backend = make_backend(backend)
+
+    @staticmethod
+    def _source(image):
+        # The file a layer comes from, if there's one
+        if isinstance(image, (str, os.PathLike)):
+            return str(image)
+        return getattr(image, "filename", None) or None
+
+    @staticmethod
+    def _load(image):
+        if isinstance(image, (str, os.PathLike)):
+            image = Image.open(image)
+            image.load()
+        return image
+
+    def _layer(self, name):
+        if not isinstance(self._layers[name], Image.Image):
+            self._layers[name] = self._load(self._layers[name])
+        return self._layers[name]
+
+    @property
+    def mat(self):
+        return self._layer("mat")
+
+    @property
+    def border(self):
+        return self._layer("border")
+
+    @property
+    def tech_lines(self):
+        # Only decoded the first time someone asks for it
+        if self._layer("tech_lines").mode != "RGBA":
+            self._layers["tech_lines"] = self._layers["tech_lines"]\
+                                         .convert("RGBA")
+        return self._layers["tech_lines"]
+
+    @property
+    def size(self):
+        # Read from the header if the mat isn't decoded
+        if self._size is None:
+            if isinstance(self._layers["mat"], Image.Image):
+                self._size = self._layers["mat"].size
+            else:
+                with Image.open(self._layers["mat"]) as mat:
+                    self._size = mat.size
+        return self._size
+
+    def release_layers(self):
+        # Forget the decoded layers that can be read again from their file
+        for name, source in self._sources.items():
+            if source is not None and os.path.isfile(source):
+                self._layers[name] = source
+
+    def seat_tile(self, team_id, seat, scale=1):
+        return self.logo_cache.get(logo_path(team_id, self.logos_dir), seat,
+                                   scale)
+
+    def compose_base(self, technical_lines=False):
+        if self.backend is not None:
+            layers = [self.mat, self.border]
+            if technical_lines:
+                layers.append(self.tech_lines)
+            return self.backend.compose(self.size, layers)
+        canvas = Image.new("RGBA", self.size)
+        canvas.paste(self.mat, (0, 0), self.mat)
+        canvas.paste(self.border, (0, 0), self.border)
+        if technical_lines:
+            canvas.paste(self.tech_lines, (0, 0), self.tech_lines)
+        return canvas
+
+    def cached_base(self, technical_lines=False, scale=1):
+        # The composited base layer, shared and read only. It's kept in memory
+        # and, when every layer comes from a file, on disk too.
+        if (technical_lines, scale) in self._bases:
+            return self._bases[(technical_lines, scale)]
+        if scale != 1:
+            if self.low_memory:
+                # The full base is only streamed in to be reduced, only the
+                # draft one is kept
+                base = self.fill_base(Image.new("RGBA", self.size),
+                    technical_lines)
+            else:
+                base = self.cached_base(technical_lines)
+            with span("scale_base", scale=scale):
+                base = base.reduce(scale)
+            self._bases[(technical_lines, scale)] = base
+            return base
+
+        layers = ["mat", "border"] + (["tech_lines"] if technical_lines else [])
+        sources = [self._sources[layer] for layer in layers]
+        variant = "lines" if technical_lines else "plain"
+        base = None
+        if all(sources):
+            key = self.base_cache.key(sources, self.image_route)
+            with span("base_cache_read", variant=variant):
+                base = self.base_cache.load(variant, key, self.size)
+        if base is None:
+            with span("compose_base", variant=variant):
+                base = self.compose_base(technical_lines)
+            if all(sources):
+                try:
+                    with span("base_cache_write", variant=variant):
+                        self.base_cache.store(variant, key, base)
+                except OSError:
+                    # Not being able to persist it only costs time
+                    pass
+        self._bases[(technical_lines, scale)] = base
+        return base
+
+    def fill_base(self, canvas, technical_lines=False):
+        # Low memory mode: streams the base layer into the canvas from the
+        # disk cache, compositing and storing it there first if needed
+        layers = ["mat", "border"] + (["tech_lines"] if technical_lines else [])
+        sources = [self._sources[layer] for layer in layers]
+        variant = "lines" if technical_lines else "plain"
+        if all(sources):
+            key = self.base_cache.key(sources, self.image_route)
+            with span("base_cache_read", variant=variant):
+                if self.base_cache.load_into(variant, key, canvas):
+                    return canvas
+        if (technical_lines, 1) in self._bases:
+            base = self._bases[(technical_lines, 1)]
+        else:
+            with span("compose_base", variant=variant):
+                base = self.compose_base(technical_lines)
+        if all(sources):
+            try:
+                with span("base_cache_write", variant=variant):
+                    self.base_cache.store(variant, key, base)
+                self.release_layers()
+            except OSError:
+                # Kept in memory then, it can't be read back every time
+                self._bases[(technical_lines, 1)] = base
+        else:
+            self._bases[(technical_lines, 1)] = base
+        canvas.paste(base)
+        return canvas
+
+    def base_layer(self, technical_lines=False, scale=1):
+        return self.cached_base(technical_lines, scale).copy()
+
+    def paste_seat(self, canvas, seat, team_id, scale=1):
+        tile, mask, position = self.seat_tile(team_id, seat, scale)
+        canvas.paste(tile, position, mask)
+
+    def output_key(self, team_ids, technical_lines=False,
+        output_settings=None):
+        # What the finished file depends on: the layout, the content of every
+        # layer and logo, the teams in each seat and how it's encoded. None if
+        # some layer doesn't come from a file or the cache is off (False).
+        layers = ["mat", "border"] + (["tech_lines"] if technical_lines else [])
+        sources = [self._sources[layer] for layer in layers]
+        if not self.render_cache or not all(sources):
+            return None
+        parts = [repr(SEAT_LAYOUT), FULL_QUARTER_SIZE, LOGO_SIZE,
+                 technical_lines, repr(output_settings)]
+        parts += [content_hash(source) for source in sources]
+        for seat, team_id in zip(SEATS, team_ids):
+            parts += [seat, team_id,
+                      content_hash(logo_path(team_id, self.logos_dir))]
+        return self.render_cache.key(parts)
+
+    def render(self, east_id, south_id, west_id, north_id,
+        technical_lines=False, scale=1):
+        # With a scale above 1 it's a draft, logos are placed to the nearest
+        # pixel so it won't match a downscaled full render exactly
+        team_ids = (east_id, south_id, west_id, north_id)
+        if self.low_memory and scale == 1:
+            return self._render_in_place(team_ids, technical_lines)
+        base = self.cached_base(technical_lines, scale)
+        tiles = [self.seat_tile(team_id, seat, scale)
+                 for seat, team_id in zip(SEATS, team_ids)]
+        with span("compose", scale=scale):
+            if self.backend is not None:
+                return self.backend.render(base, tiles)
+            canvas = base.copy()
+            for tile, mask, position in tiles:
+                canvas.paste(tile, position, mask)
+        return canvas
+
+    def _render_in_place(self, team_ids, technical_lines):
+        # The canvas is RGB so it can be encoded as it is, pasting only
+        # blends each band on its own so it's the same as the RGBA one
+        # converted. It's reused by the next render, copy it to keep it.
+        if self._canvas is None:
+            self._canvas = Image.new("RGB", self.size)
+        self.fill_base(self._canvas, technical_lines)
+        for seat, team_id in zip(SEATS, team_ids):
+            tile, mask, position = self.seat_tile(team_id, seat)
+            with span("compose", seat=seat):
+                self._canvas.paste(tile, position, mask)
+        return self._canvas
+
+
+def tile_box(entry):
+    tile, mask, (left, top) = entry
+    return (left, top, left + tile.width, top + tile.height)
+
+
+def intersection(box, other):
+    left, top = max(box[0], other[0]), max(box[1], other[1])
+    right, bottom = min(box[2], other[2]), min(box[3], other[3])
+    if left >= right or top >= bottom:
+        return None
+    return (left, top, right, bottom)
+
+
+class IncrementalCompositor:
+    # Keeps the last tablecloth and what went in every seat, so changing one
+    # team only rebuilds the part of the canvas that team covers. Pasting is
+    # done pixel by pixel, so restoring an area from the base layer and
+    # pasting again, in seat order, every logo that touches it gives the same
+    # bytes as a full render.
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        # Its own backend, the arrays it blends with can't be shared between
+        # threads
+        self.backend = make_backend(renderer.backend_name)
+        self.canvas = None
+        self._array = None
+        self._base = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def render(self, east_id, south_id, west_id, north_id,
+        technical_lines=False):
+        # The canvas returned is reused by the next render, copy it if it
+        # has to be kept
+        team_ids = (east_id, south_id, west_id, north_id)
+        if self.renderer.low_memory:
+            # There's no base kept in memory to redraw from
+            return self.renderer.render(*team_ids,
+                technical_lines=technical_lines)
+        with self._lock:
+            base = self.renderer.cached_base(technical_lines)
+            entries = {seat: self.renderer.seat_tile(team_id, seat)
+                       for seat, team_id in zip(SEATS, team_ids)}
+            if self.canvas is None or base is not self._base:
+                with span("compose", incremental=False):
+                    if self.backend is not None:
+                        self._array = self.backend.canvas(base)
+                        for seat in SEATS:
+                            self.backend.blend(self._array, *entries[seat])
+                    else:
+                        self.canvas = base.copy()
+                        for seat in SEATS:
+                            tile, mask, position = entries[seat]
+                            self.canvas.paste(tile, position, mask)
+            else:
+                boxes = []
+                for seat in SEATS:
+                    if entries[seat] is self._entries[seat]:
+                        continue
+                    for box in (tile_box(self._entries[seat]),
+                                tile_box(entries[seat])):
+                        if box not in boxes:
+                            boxes.append(box)
+                with span("compose", incremental=True, areas=len(boxes)):
+                    for box in boxes:
+                        self._redraw(box, base, entries)
+            if self.backend is not None:
+                self.canvas = self.backend.image(self._array)
+            self._base = base
+            self._entries = entries
+            return self.canvas
+
+    def _redraw(self, box, base, entries):
+        if self.backend is not None:
+            self.backend.restore(self._array, base, box)
+            for seat in SEATS:
+                self.backend.blend(self._array, *entries[seat], box=box)
+            return
+        self.canvas.paste(base.crop(box), box[:2])
+        for seat in SEATS:
+            area = intersection(box, tile_box(entries[seat]))
+            if area is None:
+                continue
+            tile, mask, (left, top) = entries[seat]
+            crop = (area[0] - left, area[1] - top,
+                    area[2] - left, area[3] - top)
+            self.canvas.paste(tile.crop(crop), area[:2], mask.crop(crop))
+
+
+def preview_image(image, size=PREVIEW_SIZE):
+    # Downsampled in memory, what the JPEG would show but without encoding it
+    return image.resize(size, Image.BOX).convert("RGB")
+
+
+def save_tablecloth(image, save_to_route, profile=None, stream=False):
+    # The profile says the format and its options, "final" if there's none
+    output = os.path.join(save_to_route, output_name(profile))
+    if os.path.exists(output):
+        os.remove(output)
+    encode(image, output, profile, stream)
+    return output
+
+
+def render_table(renderer, team_ids, save_to_route, technical_lines=False,
+    compositor=None, profile=None):
+    # Renders and saves one tablecloth, unless the very same one is already
+    # in the render cache. The "render" span has the peak memory.
+    with memory_span("render", low_memory=renderer.low_memory):
+        output = os.path.join(save_to_route, output_name(profile))
+        key = renderer.output_key(team_ids, technical_lines, profile)
+        if key is not None:
+            with span("cache_fetch"):
+                if renderer.render_cache.fetch(key, output):
+                    return output
+        if compositor is not None:
+            tablecloth = compositor.render(*team_ids, technical_lines)
+        else:
+            tablecloth = renderer.render(*team_ids,
+                technical_lines=technical_lines)
+        save_tablecloth(tablecloth, save_to_route, profile,
+            stream=renderer.low_memory)
+        if key is not None:
+            try:
+                with span("cache_store"):
+                    renderer.render_cache.store(key, output)
+            except OSError:
+                # Not being able to cache it only costs time next time
+                pass
+        return output
+
+
+def load_schedule(schedule_file):
+    # A schedule is a JSON list of tables. Each table is either a list with
+    # the east, south, west and north team IDs or an object with those keys
+    # and an optional name.
+    with open(schedule_file, "r", encoding="utf-8") as fp_schedule:
+        schedule = json.loads(fp_schedule.read())
+    if isinstance(schedule, dict):
+        schedule = schedule["tables"]
+
+    tables = []
+    for number, table in enumerate(schedule, start=1):
+        if isinstance(table, dict):
+            seats = [int(table[seat]) for seat in SEATS]
+            name = str(table.get("name", "table%03d" % number))
+        else:
+            if len(table) != len(SEATS):
+                raise ValueError("Table %d must have %d teams, not %d"
+                    % (number, len(SEATS), len(table)))
+            seats = [int(team_id) for team_id in table]
+            name = "table%03d" % number
+        tables.append({"name": name, **dict(zip(SEATS, seats))})
+    return tables
+
+
+def render_schedule(tables, output_dir, renderer=None, technical_lines=False,
+    profile=None):
+    # Every table ends up in its own folder so the file keeps the name the
+    # game expects
+    if renderer is None:
+        renderer = TableclothRenderer()
+    outputs = []
+    for table in tables:
+        table_dir = os.path.join(output_dir, table["name"])
+        os.makedirs(table_dir, exist_ok=True)
+        outputs.append(render_table(renderer,
+            [table[seat] for seat in SEATS], table_dir, technical_lines,
+            profile=profile))
+    return outputs
@@ -0,0 +1,263 @@
+# roster.py - Where the teams and players are stored: teams.json or a SQLite
+# database for big rosters
+# Standard python library
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+# Custom libraries
+from PIL import Image
+from persistence import CONFIG_DIR, COMPACT_OVER, JsonStore, write_json
+
+
+ROSTER_BACKENDS = ("json", "sqlite")
+DEFAULT_DATABASE = "teams.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS teams (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS teams_position ON teams (position);
+CREATE INDEX IF NOT EXISTS teams_name ON teams (name);
+CREATE TABLE IF NOT EXISTS players (
+    team INTEGER NOT NULL REFERENCES teams (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (team, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE TABLE IF NOT EXISTS logos (
+    file TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+"""
+
+
+class JsonRoster(JsonStore):
+    # teams.json, written whole shortly after the last edit. The registry
+    # edits the lists this holds (see follow()), so the edits only have to
+    # say something changed.
+
+    def follow(self, roster):
+        self.data = roster
+
+    def to_dict(self):
+        return self.data
+
+    def dumps(self):
+        return json.dumps(self.data, indent=4)
+
+    def add_team(self, team, members=()):
+        self.changed()
+
+    def set_members(self, team, members):
+        self.changed()
+
+    def remove_team(self, team):
+        self.changed()
+
+    def record_logo(self, logo):
+        # teams.json has no place for the logo metadata
+        pass
+
+    def forget_logo(self, logo):
+        pass
+
+
+class RosterDatabase:
+    # The roster in SQLite: every edit only writes the rows of that team, and
+    # teams.json is only made again for an export. Teams keep the ID order
+    # of teams.json in their position, the first team is 1.
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self._depth = 0
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        # Nothing is committed until the outermost one ends, and all of it is
+        # rolled back if it fails
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self.connection.rollback()
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self.connection.commit()
+
+    def flush(self):
+        # Edits are committed as they're made, this is for the same calls
+        # JsonRoster gets
+        if self._depth == 0:
+            self.connection.commit()
+
+    def follow(self, roster):
+        pass
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM teams").fetchone()[0]
+
+    def teams(self):
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM teams ORDER BY position")]
+
+    def members(self, team):
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM players WHERE team = ? ORDER BY position",
+            (self._row(team)[0],))]
+
+    def teams_of(self, player):
+        return [name for name, in self.connection.execute(
+            "SELECT teams.name FROM players JOIN teams ON teams.id = "
+            "players.team WHERE players.name = ? ORDER BY teams.position",
+            (player,))]
+
+    def to_dict(self):
+        # Same as teams.json, a repeated team name keeps the last members
+        # like TeamRegistry does
+        teams = []
+        members = {}
+        for row_id, name in self.connection.execute(
+            "SELECT id, name FROM teams ORDER BY position"):
+            teams.append(name)
+            members[row_id] = (name, [])
+        for row_id, name in self.connection.execute(
+            "SELECT team, name FROM players ORDER BY team, position"):
+            members[row_id][1].append(name)
+        players = {}
+        for name, team_members in members.values():
+            players[name] = team_members
+        return {"teams": teams, "players": players}
+
+    def dumps(self):
+        return json.dumps(self.to_dict(), indent=4)
+
+    def export(self, teams_file):
+        write_json(teams_file, self.to_dict())
+
+    def _row(self, team):
+        # (id, position) of the first team with that name
+        row = self.connection.execute("SELECT id, position FROM teams WHERE "
+            "name = ? ORDER BY position LIMIT 1", (team,)).fetchone()
+        if row is None:
+            raise KeyError(team)
+        return row
+
+    def _insert_members(self, row_id, members):
+        self.connection.executemany(
+            "INSERT INTO players (team, position, name) VALUES (?, ?, ?)",
+            [(row_id, position, member)
+             for position, member in enumerate(members)])
+
+    def add_team(self, team, members=()):
+        with self.transaction():
+            if self.connection.execute("SELECT 1 FROM teams WHERE name = ?",
+                (team,)).fetchone() is not None:
+                raise ValueError("There's already a team called '%s'" % team)
+            cursor = self.connection.execute(
+                "INSERT INTO teams (position, name) VALUES (?, ?)",
+                (len(self) + 1, team))
+            self._insert_members(cursor.lastrowid, members)
+            return len(self)
+
+    def set_members(self, team, members):
+        with self.transaction():
+            row_id = self._row(team)[0]
+            self.connection.execute("DELETE FROM players WHERE team = ?",
+                (row_id,))
+            self._insert_members(row_id, members)
+
+    def remove_team(self, team):
+        # The teams after it move up one ID, like in teams.json
+        with self.transaction():
+            row_id, position = self._row(team)
+            self.connection.execute("DELETE FROM teams WHERE id = ?",
+                (row_id,))
+            self.connection.execute("UPDATE teams SET position = position - 1"
+                " WHERE position > ?", (position,))
+            return position
+
+    def replace(self, roster):
+        # Everything at once, like after an import
+        with self.transaction():
+            self.connection.execute("DELETE FROM players")
+            self.connection.execute("DELETE FROM teams")
+            players = roster.get("players", {})
+            for position, team in enumerate(roster["teams"], 1):
+                cursor = self.connection.execute(
+                    "INSERT INTO teams (position, name) VALUES (?, ?)",
+                    (position, team))
+                self._insert_members(cursor.lastrowid, players.get(team, []))
+
+    def record_logo(self, logo):
+        # Size, modification time and dimensions of a logo file, to tell
+        # later if it changed without opening it
+        stat = os.stat(logo)
+        with Image.open(logo) as image:
+            width, height = image.size
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO logos (file, size,"
+                " mtime_ns, width, height) VALUES (?, ?, ?, ?, ?)",
+                (os.path.basename(logo), stat.st_size, stat.st_mtime_ns,
+                 width, height))
+
+    def logo_info(self, logo):
+        # (size, mtime_ns, width, height) or None if it was never recorded
+        return self.connection.execute("SELECT size, mtime_ns, width, height "
+            "FROM logos WHERE file = ?", (os.path.basename(logo),)).fetchone()
+
+    def logo_changed(self, logo):
+        info = self.logo_info(logo)
+        if info is None or not os.path.exists(logo):
+            return True
+        stat = os.stat(logo)
+        return info[:2] != (stat.st_size, stat.st_mtime_ns)
+
+    def forget_logo(self, logo):
+        with self.transaction():
+            self.connection.execute("DELETE FROM logos WHERE file = ?",
+                (os.path.basename(logo),))
+
+
+def migrate(teams_file, database):
+    # A database with everything in teams.json
+    with open(teams_file, "r", encoding="utf-8") as fp_teams:
+        roster = json.loads(fp_teams.read())
+    store = RosterDatabase(database)
+    store.replace(roster)
+    return store
+
+
+def open_roster(config, config_dir=CONFIG_DIR, **options):
+    # The store config.json's "roster_backend" asks for. The first time the
+    # database is used it's made from teams.json. options go to JsonRoster.
+    backend = config.get("roster_backend", "json")
+    if backend not in ROSTER_BACKENDS:
+        raise ValueError("Unknown roster backend '%s', use one of: %s"
+                         % (backend, ", ".join(ROSTER_BACKENDS)))
+    teams_file = os.path.join(config_dir, config.get("teams_file",
+                                                     "teams.json"))
+    if backend == "json":
+        options.setdefault("compact_over", COMPACT_OVER)
+        return JsonRoster.load(teams_file, **options)
+    database = os.path.join(config_dir, config.get("roster_database",
+                                                   DEFAULT_DATABASE))
+    if not os.path.exists(database) and os.path.exists(teams_file):
+        return migrate(teams_file, database)
+    return RosterDatabase(database)
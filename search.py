@@ -0,0 +1,198 @@
+# search.py - Player search index for the seat search boxes, without Qt
+# Standard python library
+import heapq
+import random
+import string
+import unicodedata
+from difflib import SequenceMatcher
+from timeit import default_timer as timer
+
+
+# How good a match is, best first
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+# Fuzzy matches have to share at least this part of the query trigrams
+MIN_SIMILARITY = 0.3
+# Only this many of the candidates sharing most trigrams are ranked
+MAX_CANDIDATES = 200
+
+
+def normalize(text):
+    # Case and accent insensitive: "Ñoño" and "nono" are the same
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(character for character in decomposed
+                   if not unicodedata.combining(character)).casefold()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PlayerIndex:
+    # Every (player, team) indexed by the trigrams of its normalized name,
+    # padded with spaces so the start and end of the name count too. Queries
+    # of one or two letters can't make a trigram, so the first two letters of
+    # every word are indexed on their own for those, and the names are
+    # scanned for the ones that only have it in the middle.
+
+    def __init__(self, items=()):
+        self._entries = {}
+        self._ids = {}
+        self._grams = {}
+        self._short = {}
+        self._next_id = 0
+        for player, team in items:
+            self.add(player, team)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _keys(self, name):
+        grams = trigrams(" %s " % name)
+        short = set()
+        for word in name.split():
+            short.update((word[:1], word[:2]))
+        return grams, short
+
+    def add(self, player, team):
+        if (player, team) in self._ids:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        name = normalize(player)
+        self._entries[entry_id] = (player, team, name)
+        self._ids[(player, team)] = entry_id
+        grams, short = self._keys(name)
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(entry_id)
+        for prefix in short:
+            self._short.setdefault(prefix, set()).add(entry_id)
+
+    def remove(self, player, team):
+        entry_id = self._ids.pop((player, team), None)
+        if entry_id is None:
+            return
+        player, team, name = self._entries.pop(entry_id)
+        grams, short = self._keys(name)
+        for index, keys in ((self._grams, grams), (self._short, short)):
+            for key in keys:
+                index[key].discard(entry_id)
+                if not index[key]:
+                    del index[key]
+
+    def clear(self):
+        self.__init__()
+
+    @staticmethod
+    def _rank(query, name):
+        # Tier and score of a name that has the query in it, None if not
+        if name == query:
+            return EXACT, 1.0
+        if name.startswith(query):
+            return PREFIX, len(query) / len(name)
+        if (" " + name).find(" " + query) != -1:
+            return WORD_PREFIX, len(query) / len(name)
+        if query in name:
+            return SUBSTRING, len(query) / len(name)
+        return None
+
+    def search(self, text, limit=10):
+        # Returns up to limit (player, team), the best matches first
+        query = normalize(text).strip()
+        if not query:
+            return []
+        matches = []
+        if len(query) < 3:
+            candidates = self._short.get(query, ())
+            # Prefixes rank above the rest, the names are only scanned when
+            # there aren't enough of them
+            if len(candidates) < limit:
+                candidates = self._entries
+            for entry_id in candidates:
+                rank = self._rank(query, self._entries[entry_id][2])
+                if rank is not None:
+                    matches.append((rank[0], -rank[1],
+                                    self._entries[entry_id][2], entry_id))
+            return [self._entries[match[3]][:2]
+                    for match in heapq.nsmallest(limit, matches)]
+
+        query_grams = trigrams(query)
+        # The start and end of the query help the prefix matches rank higher
+        query_grams.update((" " + query[:2], query[-2:] + " "))
+        counts = {}
+        for gram in query_grams:
+            for entry_id in self._grams.get(gram, ()):
+                counts[entry_id] = counts.get(entry_id, 0) + 1
+        if not counts:
+            # Nothing shares a trigram, but a plain scan is what the search
+            # did before the index, so it never finds less
+            for entry_id, (player, team, name) in self._entries.items():
+                rank = self._rank(query, name)
+                if rank is not None:
+                    matches.append((rank[0], -rank[1], name, entry_id))
+            return [self._entries[match[3]][:2]
+                    for match in heapq.nsmallest(limit, matches)]
+        needed = MIN_SIMILARITY * len(query_grams)
+        fuzzy = []
+        for entry_id, shared in counts.items():
+            if shared < needed:
+                continue
+            name = self._entries[entry_id][2]
+            rank = self._rank(query, name)
+            if rank is None:
+                fuzzy.append((shared, entry_id))
+            else:
+                matches.append((rank[0], -rank[1], name, entry_id))
+        # Typos are only ranked if there aren't enough real matches
+        if len(matches) < limit:
+            for shared, entry_id in heapq.nlargest(MAX_CANDIDATES, fuzzy):
+                name = self._entries[entry_id][2]
+                score = SequenceMatcher(None, query, name).ratio() \
+                        * shared / len(query_grams)
+                matches.append((FUZZY, -score, name, entry_id))
+        return [self._entries[match[3]][:2]
+                for match in heapq.nsmallest(limit, matches)]
+
+
+def random_roster(players, seed=0):
+    # (player, team) with made up names, a team every 5 players
+    generator = random.Random(seed)
+    roster = []
+    for number in range(players):
+        name = "".join(generator.choice(string.ascii_lowercase)
+                       for i in range(generator.randint(4, 12)))
+        roster.append((name.capitalize(), "Team %d" % (number // 5 + 1)))
+    return roster
+
+
+def benchmark(players=10000, queries=1000):
+    # Index build time and average time per query, against the linear scan
+    # QComboBox.findText did, over a made up roster
+    roster = random_roster(players)
+    start = timer()
+    index = PlayerIndex(roster)
+    build = timer() - start
+
+    generator = random.Random(1)
+    texts = []
+    for i in range(queries):
+        name = generator.choice(roster)[0]
+        start_at = generator.randint(0, max(0, len(name) - 4))
+        texts.append(name[start_at:start_at + generator.randint(2, 6)])
+
+    start = timer()
+    for text in texts:
+        index.search(text)
+    indexed = (timer() - start) / queries
+    start = timer()
+    for text in texts:
+        text = text.casefold()
+        [player for player, team in roster if text in player.casefold()]
+    scan = (timer() - start) / queries
+    return build, indexed, scan
+
+
+if __name__ == '__main__':
+    build, indexed, scan = benchmark()
+    print("Index of 10000 players built in %.1f ms" % (build * 1000))
+    print("Indexed search: %.3f ms per query" % (indexed * 1000))
+    print("Linear scan: %.3f ms per query" % (scan * 1000))
@@ -0,0 +1,255 @@
+# service.py - Local HTTP render service for bots and the tournament site,
+# without Qt
+# Standard python library
+import io
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import parse_qs, urlparse
+# Custom libraries
+from render import SEATS, IncrementalCompositor, TableclothRenderer, logo_path
+from encoder import DEFAULT_PROFILES, encode
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Jobs waiting for a worker before new ones are turned away
+QUEUE_SIZE = 64
+# Encoded tablecloths kept to answer the same request again
+RESULT_BYTES = 64 * 1024 * 1024
+# Latencies the percentiles are taken from
+LATENCY_SAMPLES = 1000
+# Seconds a request waits for its tablecloth
+REQUEST_TIMEOUT = 120
+CHUNK_BYTES = 64 * 1024
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png",
+                 "WEBP": "image/webp"}
+
+Job = namedtuple("Job", "key team_ids technical_lines profile future queued")
+
+
+class QueueFull(Exception):
+    pass
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {"p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, len(ordered) * 95 // 100)],
+            "max": ordered[-1]}
+
+
+class RenderService:
+    # A queue of render jobs and a fixed number of worker threads, each with
+    # its own compositor over the same renderer, so the base layers and the
+    # logos stay in memory between requests. A request for a tablecloth that
+    # is already queued or being rendered waits for that one, and the last
+    # ones encoded are answered without rendering.
+
+    def __init__(self, renderer=None, workers=2, profiles=None,
+        queue_size=QUEUE_SIZE, result_bytes=RESULT_BYTES):
+        if renderer is None:
+            renderer = TableclothRenderer()
+        self.renderer = renderer
+        self.workers = workers
+        self.profiles = dict(profiles or DEFAULT_PROFILES)
+        self.result_bytes = result_bytes
+        self._queue = queue.Queue(queue_size)
+        self._pending = {}
+        self._results = OrderedDict()
+        self._results_size = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._counts = dict.fromkeys(("requests", "completed", "coalesced",
+            "cache_hits", "rejected", "errors"), 0)
+        self._latency = {name: deque(maxlen=LATENCY_SAMPLES)
+                         for name in ("wait", "render", "total")}
+
+    def start(self):
+        workers = self.workers
+        if self.renderer.low_memory:
+            # There's one canvas in the renderer, and keeping both base
+            # layers in memory is what low memory mode avoids
+            workers = 1
+        else:
+            # Both base layers are made before the first request
+            for technical_lines in (False, True):
+                self.renderer.cached_base(technical_lines)
+        for number in range(workers):
+            thread = threading.Thread(target=self._work,
+                args=(IncrementalCompositor(self.renderer),),
+                name="render-%d" % number, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _key(self, team_ids, technical_lines, profile):
+        # A logo saved again is a different tablecloth
+        mtimes = tuple(os.stat(logo_path(team_id, self.renderer.logos_dir))
+                       .st_mtime_ns for team_id in team_ids)
+        return (tuple(team_ids), technical_lines, repr(sorted(
+            profile.items())), mtimes)
+
+    def submit(self, team_ids, technical_lines=False, profile="final"):
+        # A Future with the encoded file. Raises KeyError for an unknown
+        # profile, FileNotFoundError for a team without a logo and QueueFull
+        # if there are too many jobs waiting.
+        profile = self.profiles[profile]
+        key = self._key(team_ids, technical_lines, profile)
+        with self._lock:
+            self._counts["requests"] += 1
+            if key in self._results:
+                self._results.move_to_end(key)
+                self._counts["cache_hits"] += 1
+                future = Future()
+                future.set_result(self._results[key])
+                return future
+            if key in self._pending:
+                self._counts["coalesced"] += 1
+                return self._pending[key].future
+            job = Job(key, tuple(team_ids), technical_lines, profile,
+                      Future(), perf_counter())
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                raise QueueFull("%d jobs are already waiting"
+                                % self._queue.maxsize)
+            self._pending[key] = job
+        return job.future
+
+    def _work(self, compositor):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            started = perf_counter()
+            try:
+                tablecloth = compositor.render(*job.team_ids,
+                    job.technical_lines)
+                buffer = io.BytesIO()
+                encode(tablecloth, buffer, job.profile)
+                data = buffer.getvalue()
+            except Exception as error:
+                with self._lock:
+                    self._pending.pop(job.key, None)
+                    self._counts["errors"] += 1
+                job.future.set_exception(error)
+                continue
+            finished = perf_counter()
+            with self._lock:
+                self._pending.pop(job.key, None)
+                self._counts["completed"] += 1
+                self._latency["wait"].append(started - job.queued)
+                self._latency["render"].append(finished - started)
+                self._latency["total"].append(finished - job.queued)
+                self._remember(job.key, data)
+            job.future.set_result(data)
+
+    def _remember(self, key, data):
+        if len(data) > self.result_bytes:
+            return
+        self._results[key] = data
+        self._results_size += len(data)
+        while self._results_size > self.result_bytes:
+            old_key, old_data = self._results.popitem(last=False)
+            self._results_size -= len(old_data)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._counts)
+            metrics.update({
+                "queue_depth": self._queue.qsize(),
+                "in_flight": len(self._pending),
+                "workers": len(self._threads),
+                "cached_results": len(self._results),
+                "latency": {name: percentiles(samples)
+                            for name, samples in self._latency.items()},
+            })
+        return metrics
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    # GET /render?east=1&south=2&west=3&north=4[&lines=1][&profile=final]
+    # GET /metrics
+    # GET /health
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # Sent in pieces, so big files start arriving at once
+        view = memoryview(body)
+        for start in range(0, len(body), CHUNK_BYTES):
+            self.wfile.write(view[start:start + CHUNK_BYTES])
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({"error": message}).encode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        service = self.server.service
+        if url.path == "/health":
+            self._send(200, b"ok", "text/plain")
+        elif url.path == "/metrics":
+            self._send(200, json.dumps(service.metrics()).encode("utf-8"))
+        elif url.path == "/render":
+            self._render(parse_qs(url.query))
+        else:
+            self._error(404, "Unknown path %s" % url.path)
+
+    def _render(self, query):
+        try:
+            team_ids = [int(query[seat][0]) for seat in SEATS]
+        except (KeyError, ValueError):
+            self._error(400, "east, south, west and north need a team ID")
+            return
+        technical_lines = query.get("lines", ["0"])[0] in ("1", "true")
+        profile = query.get("profile", ["final"])[0]
+        if profile not in self.server.service.profiles:
+            self._error(400, "Unknown profile '%s'" % profile)
+            return
+        try:
+            future = self.server.service.submit(team_ids, technical_lines,
+                profile)
+            data = future.result(timeout=self.server.timeout_seconds)
+        except FileNotFoundError as error:
+            self._error(404, "No logo: %s" % error.filename)
+        except QueueFull as error:
+            self._error(503, str(error))
+        except FutureTimeout:
+            self._error(504, "The render took too long")
+        except Exception as error:
+            self._error(500, str(error))
+        else:
+            image_format = self.server.service.profiles[profile]["format"]
+            self._send(200, data, CONTENT_TYPES[image_format])
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT,
+    timeout=REQUEST_TIMEOUT, verbose=False):
+    # port 0 picks a free one, it's in server.server_address
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.timeout_seconds = timeout
+    server.verbose = verbose
+    return server
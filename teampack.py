@@ -0,0 +1,362 @@
+# teampack.py - Importing the zip packs ExportTeams makes, without Qt
+# Standard python library
+import io
+import os
+import re
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED,
+    ThreadPoolExecutor, wait)
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
+# Image manipulation libraries
+from PIL import Image
+# Custom libraries
+from cache import content_hash
+from render import LOGOS_DIR, PREPARED_FOLDER, logo_path, write_prepared
+
+
+# Nothing bigger than this is read from a pack
+MAX_TEAMS_BYTES = 16 * 1024 * 1024
+MAX_LOGO_BYTES = 32 * 1024 * 1024
+# Twice a full quarter is already plenty for a logo
+MAX_LOGO_PIXELS = 4096 * 4096
+# logos/team12.png, exports made on Windows may have backslashes
+LOGO_ENTRY = re.compile(r"^[\\/]?logos[\\/]team([1-9][0-9]*)\.png$",
+                        re.IGNORECASE)
+
+# Written by export_pack: the content hash of every logo and the entry that
+# has it, which is shared by the teams with the same logo
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+PackImport = namedtuple("PackImport", "roster logos warnings")
+# Team names added, removed and with other players, and IDs of the logos
+# that are new or changed
+PackDiff = namedtuple("PackDiff",
+                      "pack roster added removed members logos warnings")
+PackExport = namedtuple("PackExport", "path logos duplicates")
+
+
+class PackError(ValueError):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def read_entry(archive, info, max_bytes):
+    # The sizes in the zip can lie, so the read itself is limited
+    if info.file_size > max_bytes:
+        raise PackError("%s is bigger than %d MiB"
+                        % (info.filename, max_bytes // (1024 * 1024)))
+    with archive.open(info) as fp_entry:
+        data = fp_entry.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise PackError("%s is bigger than %d MiB"
+                        % (info.filename, max_bytes // (1024 * 1024)))
+    return data
+
+
+def check_roster(roster):
+    if not isinstance(roster, dict) \
+        or not isinstance(roster.get("teams"), list) \
+        or not isinstance(roster.get("players"), dict):
+        raise PackError("teams.json needs a \"teams\" list and a "
+                        "\"players\" object")
+    for team in roster["teams"]:
+        if not isinstance(team, str):
+            raise PackError("Team names have to be text, not %r" % (team,))
+    for team, members in roster["players"].items():
+        if not isinstance(members, list) \
+            or not all(isinstance(member, str) for member in members):
+            raise PackError("The players of '%s' have to be a list of names"
+                            % team)
+    return roster
+
+
+def read_json(archive, name):
+    try:
+        return json.loads(read_entry(archive, archive.getinfo(name),
+                                     MAX_TEAMS_BYTES).decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise PackError("%s can't be read: %s" % (name, error))
+
+
+def read_manifest(archive, teams):
+    # The logo entry and hash of every team, from the manifest
+    manifest = read_json(archive, MANIFEST)
+    if not isinstance(manifest, dict) \
+        or manifest.get("version") != MANIFEST_VERSION \
+        or not isinstance(manifest.get("logos"), dict):
+        raise PackError("%s isn't a version %d manifest"
+                        % (MANIFEST, MANIFEST_VERSION))
+    logos = {}
+    hashes = {}
+    for team_id, logo in manifest["logos"].items():
+        try:
+            team_id = int(team_id)
+            info = archive.getinfo(logo["entry"])
+            hashes[team_id] = logo["sha1"]
+        except (KeyError, TypeError, ValueError):
+            raise PackError("%s has a wrong logo: %r" % (MANIFEST, logo))
+        if 1 <= team_id <= teams:
+            logos[team_id] = info
+    return logos, hashes
+
+
+def read_pack(archive):
+    # The roster of an open pack, its logo entries and their hashes (if
+    # there's a manifest) by team ID, and what's wrong with it that doesn't
+    # stop the import
+    try:
+        roster = read_json(archive, "teams.json")
+    except KeyError:
+        raise PackError("The pack has no teams.json")
+    check_roster(roster)
+
+    warnings = []
+    logos = {}
+    hashes = {}
+    if MANIFEST in archive.namelist():
+        logos, hashes = read_manifest(archive, len(roster["teams"]))
+    for info in archive.infolist():
+        if info.is_dir() or info.filename in ("teams.json", MANIFEST):
+            continue
+        match = LOGO_ENTRY.match(info.filename)
+        if match is None:
+            warnings.append("%s isn't a team logo, skipped" % info.filename)
+            continue
+        team_id = int(match.group(1))
+        if team_id > len(roster["teams"]):
+            warnings.append("%s has no team in teams.json, skipped"
+                            % info.filename)
+            continue
+        logos.setdefault(team_id, info)
+    for team_id, team in enumerate(roster["teams"], 1):
+        if team_id not in logos:
+            warnings.append("%s has no logo" % team)
+    return roster, logos, hashes, warnings
+
+
+def stage_logo(data, team_id, name, staging):
+    # Checks the logo decodes and writes it, rotated for every seat too
+    logo = logo_path(team_id, staging)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width * image.height > MAX_LOGO_PIXELS:
+                raise PackError("%s is %dx%d, too big for a logo"
+                                % (name, image.width, image.height))
+            image.load()
+            with open(logo, "wb") as fp_logo:
+                fp_logo.write(data)
+            write_prepared(image, logo)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        if isinstance(error, PackError):
+            raise
+        raise PackError("%s isn't a valid image: %s" % (name, error))
+    return logo
+
+
+def open_pack(pack):
+    try:
+        return ZipFile(pack)
+    except BadZipFile as error:
+        raise PackError("%s isn't a zip file: %s" % (pack, error))
+
+
+def diff_pack(pack, roster, logos_dir=LOGOS_DIR, progress=None, cancel=None):
+    # What importing the pack would change from roster and the logos there.
+    # Teams are compared by name and logos by content, the hashes come from
+    # the manifest or are worked out if the pack has none.
+    if cancel is None:
+        cancel = threading.Event()
+    with open_pack(pack) as archive:
+        new_roster, entries, hashes, warnings = read_pack(archive)
+        total = len(entries)
+        logos = []
+        for done, team_id in enumerate(sorted(entries), 1):
+            if cancel.is_set():
+                raise Cancelled()
+            if team_id not in hashes:
+                hashes[team_id] = hashlib.sha1(read_entry(archive,
+                    entries[team_id], MAX_LOGO_BYTES)).hexdigest()
+            logo = logo_path(team_id, logos_dir)
+            if not os.path.exists(logo) or \
+                content_hash(logo) != hashes[team_id]:
+                logos.append(team_id)
+            if progress is not None:
+                progress(done, total)
+
+    old_teams = set(roster["teams"])
+    new_teams = set(new_roster["teams"])
+    added = [team for team in new_roster["teams"] if team not in old_teams]
+    removed = [team for team in roster["teams"] if team not in new_teams]
+    members = [team for team in new_roster["teams"] if team in old_teams
+               and new_roster["players"].get(team, [])
+               != roster["players"].get(team, [])]
+    return PackDiff(pack, new_roster, added, removed, members, logos,
+                    warnings)
+
+
+def diff_changes(diff):
+    return bool(diff.added or diff.removed or diff.members or diff.logos)
+
+
+def describe_diff(diff, most=5):
+    # One line for every kind of change, naming up to most teams
+    def names(teams):
+        shown = ", ".join(teams[:most])
+        if len(teams) > most:
+            shown += " and %d more" % (len(teams) - most)
+        return shown
+
+    lines = []
+    if diff.added:
+        lines.append("%d team(s) added: %s" % (len(diff.added),
+                                               names(diff.added)))
+    if diff.removed:
+        lines.append("%d team(s) removed: %s" % (len(diff.removed),
+                                                 names(diff.removed)))
+    if diff.members:
+        lines.append("%d team(s) with other players: %s"
+                     % (len(diff.members), names(diff.members)))
+    if diff.logos:
+        lines.append("%d logo(s) new or changed" % len(diff.logos))
+    return lines
+
+
+def import_pack(pack, logos_dir=LOGOS_DIR, workers=None, progress=None,
+    cancel=None, only=None):
+    # Reads the pack once, decoding and rotating the logos in worker threads
+    # while the next ones are read. Everything is written to a folder next to
+    # the logos and only moved over them once all of it worked, so a bad or
+    # cancelled pack leaves them as they were. progress(done, total) is
+    # called as logos finish, cancel is a threading.Event. With only, just
+    # the logos of those team IDs are imported (see diff_pack).
+    if cancel is None:
+        cancel = threading.Event()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(logos_dir, exist_ok=True)
+    archive = open_pack(pack)
+    staging = tempfile.mkdtemp(prefix=".import-", dir=logos_dir)
+    try:
+        with archive:
+            roster, entries, hashes, warnings = read_pack(archive)
+            if only is not None:
+                entries = {team_id: info for team_id, info in entries.items()
+                           if team_id in only}
+            total = len(entries)
+            done = 0
+            if progress is not None:
+                progress(done, total)
+            # Only a few logos are held in memory at once
+            in_flight = 2 * workers
+            pending = set()
+
+            def collect(return_when):
+                nonlocal done, pending
+                finished, pending = wait(pending, return_when=return_when)
+                for future in finished:
+                    future.result()
+                    done += 1
+                    if progress is not None:
+                        progress(done, total)
+
+            with ThreadPoolExecutor(workers) as executor:
+                try:
+                    for team_id in sorted(entries):
+                        if cancel.is_set():
+                            raise Cancelled()
+                        name = entries[team_id].filename
+                        data = read_entry(archive, entries[team_id],
+                                          MAX_LOGO_BYTES)
+                        if team_id in hashes and \
+                            hashlib.sha1(data).hexdigest() != hashes[team_id]:
+                            raise PackError("%s doesn't match %s"
+                                            % (name, MANIFEST))
+                        pending.add(executor.submit(stage_logo, data,
+                            team_id, name, staging))
+                        if len(pending) >= in_flight:
+                            collect(FIRST_COMPLETED)
+                    collect(ALL_COMPLETED)
+                except BaseException:
+                    for future in pending:
+                        future.cancel()
+                    raise
+        if cancel.is_set():
+            raise Cancelled()
+
+        logos = []
+        for team_id in sorted(entries):
+            staged = logo_path(team_id, staging)
+            logo = logo_path(team_id, logos_dir)
+            os.replace(staged, logo)
+            logos.append(logo)
+        prepared_dir = os.path.join(logos_dir, PREPARED_FOLDER)
+        os.makedirs(prepared_dir, exist_ok=True)
+        staged_dir = os.path.join(staging, PREPARED_FOLDER)
+        if os.path.isdir(staged_dir):
+            for name in os.listdir(staged_dir):
+                os.replace(os.path.join(staged_dir, name),
+                           os.path.join(prepared_dir, name))
+        return PackImport(roster, logos, warnings)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def export_pack(pack, roster, logos_dir=LOGOS_DIR, workers=None,
+    progress=None, cancel=None):
+    # Writes the roster and the logo of every team. The logos are hashed in
+    # worker threads while the zip is written, and a logo used by more than
+    # one team is only stored once, the manifest says which entry each team
+    # uses. PNGs are already compressed, so they're stored as they are. The
+    # zip is written next to pack and only renamed to it once it's complete.
+    if cancel is None:
+        cancel = threading.Event()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    logos = [(team_id, logo_path(team_id, logos_dir))
+             for team_id in range(1, len(roster["teams"]) + 1)
+             if os.path.exists(logo_path(team_id, logos_dir))]
+    total = len(logos)
+    if progress is not None:
+        progress(0, total)
+    folder = os.path.dirname(os.path.abspath(pack))
+    fd, temp_path = tempfile.mkstemp(prefix=".export-", suffix=".zip",
+                                     dir=folder)
+    os.close(fd)
+    try:
+        entries = {}
+        manifest = {}
+        with ThreadPoolExecutor(workers) as executor, \
+             ZipFile(temp_path, "w") as archive:
+            archive.writestr("teams.json", json.dumps(roster, indent=4),
+                             compress_type=ZIP_DEFLATED)
+            hashes = executor.map(content_hash, [logo for team_id, logo
+                                                 in logos])
+            for done, ((team_id, logo), digest) in enumerate(zip(logos,
+                hashes), 1):
+                if cancel.is_set():
+                    raise Cancelled()
+                if digest not in entries:
+                    entries[digest] = "logos/team%d.png" % team_id
+                    archive.write(logo, entries[digest],
+                                  compress_type=ZIP_STORED)
+                manifest[str(team_id)] = {"sha1": digest,
+                                          "entry": entries[digest]}
+                if progress is not None:
+                    progress(done, total)
+            archive.writestr(MANIFEST, json.dumps({
+                "version": MANIFEST_VERSION, "logos": manifest}, indent=4),
+                compress_type=ZIP_DEFLATED)
+        os.replace(temp_path, pack)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return PackExport(pack, total, total - len(entries))
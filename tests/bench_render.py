@@ -0,0 +1,106 @@
+# bench_render.py - Times every stage of a render from synthetic layers and
+# fails when one of them is slower than the stored baseline allows. It's not
+# collected with the rest of the tests, run it on its own:
+#
+#   python -m pytest tests/bench_render.py
+#
+# BENCH_UPDATE=1 stores the results as the new baseline, BENCH_TOLERANCE
+# (1.0 by default, so twice as slow) sets how much slower a stage may get,
+# plus BENCH_SLACK milliseconds (1 by default) so the stages that take almost
+# nothing don't fail on noise, and BENCH_RESULTS where the results are
+# written.
+# Standard Python libraries
+import io
+import os
+import json
+import platform
+from timeit import default_timer as timer
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from render import SEATS, TableclothRenderer, logo_path, prepare_logo
+from encoder import DEFAULT_PROFILES, encode
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(TESTS_DIR, "benchmark_baseline.json")
+RESULTS_FILE = os.environ.get("BENCH_RESULTS",
+    os.path.join(TESTS_DIR, "benchmark_results.json"))
+TOLERANCE = float(os.environ.get("BENCH_TOLERANCE", "1.0"))
+SLACK = float(os.environ.get("BENCH_SLACK", "1")) / 1000
+REPEAT = 5
+
+# In the synthetic layers team 2 is a full quarter and team 1 a small logo
+LOGOS = {"full": 2, "small": 1}
+
+results = {}
+
+
+def measure(function, repeat=REPEAT):
+    # The best of a few runs, the others are mostly noise from the machine
+    best = None
+    for i in range(repeat):
+        start = timer()
+        function()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, "r", encoding="utf-8") as fp_baseline:
+        return json.loads(fp_baseline.read())["stages"]
+
+@pytest.fixture(scope="module", autouse=True)
+def write_results():
+    yield
+    report = {"machine": platform.machine(), "python":
+              platform.python_version(), "stages": results}
+    with open(RESULTS_FILE, "w", encoding="utf-8") as fp_results:
+        fp_results.write(json.dumps(report, indent=4, sort_keys=True))
+    if os.environ.get("BENCH_UPDATE") == "1":
+        with open(BASELINE_FILE, "w", encoding="utf-8") as fp_baseline:
+            fp_baseline.write(json.dumps(report, indent=4, sort_keys=True))
+
+@pytest.mark.parametrize("technical_lines", [False, True],
+    ids=["plain", "lines"])
+@pytest.mark.parametrize("logo", list(LOGOS))
+def test_render_stages(layers, logo, technical_lines):
+
+    mat, border, tech_lines, logos_dir = layers
+    renderer = TableclothRenderer(mat, border, tech_lines, logos_dir,
+        render_cache=False)
+    path = logo_path(LOGOS[logo], logos_dir)
+    prefix = "%s/%s/" % (logo, "lines" if technical_lines else "plain")
+    stages = {}
+
+    for seat in SEATS:
+        def load_and_rotate():
+            with Image.open(path) as image:
+                prepare_logo(image, seat)
+        stages["load_rotate_%s" % seat] = measure(load_and_rotate)
+    stages["base_compose"] = measure(
+        lambda: renderer.compose_base(technical_lines))
+    canvas = renderer.compose_base(technical_lines)
+    for seat in SEATS:
+        tile, mask, position = renderer.seat_tile(LOGOS[logo], seat)
+        stages["paste_%s" % seat] = measure(
+            lambda: canvas.paste(tile, position, mask))
+    stages["rgb_convert"] = measure(lambda: canvas.convert("RGB"))
+    rgb = canvas.convert("RGB")
+    stages["encode_jpeg"] = measure(
+        lambda: encode(rgb, io.BytesIO(), DEFAULT_PROFILES["final"]))
+
+    baseline = load_baseline()
+    regressions = []
+    for stage, seconds in stages.items():
+        results[prefix + stage] = seconds
+        allowed = baseline.get(prefix + stage)
+        if allowed is not None \
+        and seconds > allowed * (1 + TOLERANCE) + SLACK:
+            regressions.append("%s%s: %.2f ms, baseline %.2f ms"
+                % (prefix, stage, seconds * 1000, allowed * 1000))
+
+    assert not regressions, "Slower than the baseline:\n" \
+        + "\n".join(regressions)
@@ -0,0 +1,63 @@
+# conftest.py - Synthetic layers and logos shared by the render tests
+# Standard Python libraries
+import sys
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from cache import BaseLayerCache, RenderCache, ThumbnailCache
+from render import FULL_QUARTER_SIZE, TableclothRenderer, logo_path
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    # Renderers without caches of their own use the shared ones, which would
+    # write into the programme's cache folder and replace its base layers
+    caches = {"BASE_CACHE": BaseLayerCache(str(tmp_path / "shared" / "base")),
+              "RENDER_CACHE": RenderCache(str(tmp_path / "shared" / "renders")),
+              "THUMBNAILS": ThumbnailCache()}
+    for module in ("cache", "render", "cli", "thread", "generator"):
+        if module not in sys.modules:
+            continue
+        for name, cache in caches.items():
+            if hasattr(sys.modules[module], name):
+                monkeypatch.setattr(sys.modules[module], name, cache)
+    return caches
+
+
+@pytest.fixture
+def layers(tmp_path):
+    logos_dir = tmp_path / "logos"
+    logos_dir.mkdir()
+    # A small logo, a full quarter and two more small logos
+    Image.new("RGBA", (300, 200), (255, 0, 0, 200))\
+         .save(logo_path(1, str(logos_dir)))
+    Image.new("RGBA", FULL_QUARTER_SIZE, (0, 255, 0, 128))\
+         .save(logo_path(2, str(logos_dir)))
+    Image.new("RGB", (250, 250), (0, 0, 255))\
+         .save(logo_path(3, str(logos_dir)))
+    Image.new("RGBA", (100, 400), (9, 9, 9, 255))\
+         .save(logo_path(4, str(logos_dir)))
+
+    mat = Image.new("RGBA", (2048, 2048), (40, 120, 40, 255))
+    border = Image.new("RGBA", (2048, 2048), (0, 0, 0, 0))
+    border.paste((200, 200, 200, 255), (0, 0, 2048, 40))
+    tech_lines = Image.new("RGBA", (2048, 2048), (0, 0, 0, 0))
+    tech_lines.paste((255, 255, 255, 255), (1020, 0, 1028, 2048))
+
+    return mat, border, tech_lines, str(logos_dir)
+
+@pytest.fixture
+def renderer(layers):
+    mat, border, tech_lines, logos_dir = layers
+
+    return TableclothRenderer(mat, border, tech_lines, logos_dir)
+
+@pytest.fixture
+def layer_files(layers, tmp_path):
+    paths = []
+    for name, image in zip(["mat", "border", "tech_lines"], layers[:3]):
+        paths.append(str(tmp_path / ("%s.png" % name)))
+        image.save(paths[-1])
+
+    return paths
@@ -0,0 +1,81 @@
+# test_backend.py - This tests that the NumPy compositing gives the same
+# tablecloth as Pillow.
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from render import IncrementalCompositor, TableclothRenderer
+from backend import available, make_backend
+
+numpy = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def numpy_renderer(layers):
+    mat, border, tech_lines, logos_dir = layers
+
+    return TableclothRenderer(mat, border, tech_lines, logos_dir,
+        backend="numpy")
+
+@pytest.mark.parametrize("technical_lines", [False, True])
+def test_numpy_matches_pillow(renderer, numpy_renderer, technical_lines):
+
+    for team_ids in [(1, 2, 3, 4), (2, 2, 2, 2), (4, 3, 2, 1)]:
+        expected = renderer.render(*team_ids, technical_lines=technical_lines)
+        rendered = numpy_renderer.render(*team_ids,
+            technical_lines=technical_lines)
+
+        assert rendered.tobytes() == expected.tobytes()
+
+def test_numpy_compositor_matches_pillow(renderer, numpy_renderer):
+    # Full renders and the areas redrawn when only some seats change
+    pillow = IncrementalCompositor(renderer)
+    compositor = IncrementalCompositor(numpy_renderer)
+    assert compositor.backend is not None
+
+    for team_ids, technical_lines in [((1, 2, 3, 4), False),
+        ((1, 2, 3, 2), False), ((4, 2, 1, 2), False), ((4, 2, 1, 2), True),
+        ((3, 3, 3, 3), True), ((1, 2, 3, 4), True)]:
+        expected = pillow.render(*team_ids, technical_lines)
+        rendered = compositor.render(*team_ids, technical_lines)
+
+        assert rendered.tobytes() == expected.tobytes()
+
+def test_numpy_draft_matches_pillow(renderer, numpy_renderer):
+
+    expected = renderer.render(1, 2, 3, 4, scale=4)
+
+    assert numpy_renderer.render(1, 2, 3, 4, scale=4).tobytes() \
+        == expected.tobytes()
+
+def test_numpy_blend_matches_paste():
+
+    # Every source and destination value, with the alpha changing on both
+    # axes, against Image.paste
+    values = numpy.arange(256, dtype=numpy.uint8)
+    source = numpy.zeros((256, 256, 4), dtype=numpy.uint8)
+    source[:, :, :] = values[:, None, None]
+    canvas = numpy.zeros((256, 256, 4), dtype=numpy.uint8)
+    canvas[:, :, :] = values[None, :, None]
+    tile = Image.fromarray(source, "RGBA")
+    mask = Image.fromarray(((values[:, None].astype(numpy.uint16) * 7
+        + values[None, :]) % 256).astype(numpy.uint8), "L")
+    expected = Image.fromarray(canvas.copy(), "RGBA")
+    expected.paste(tile, (0, 0), mask)
+    make_backend("numpy").blend(canvas, tile, mask, (0, 0))
+
+    assert canvas.tobytes() == expected.tobytes()
+
+def test_unknown_backend():
+
+    with pytest.raises(ValueError):
+        available("opengl")
+
+def test_low_memory_uses_pillow(layers):
+    # Its single canvas would be copied into the backend's arrays
+    renderer = TableclothRenderer(*layers, backend="numpy", low_memory=True)
+
+    assert renderer.backend is None
+    assert IncrementalCompositor(renderer).backend is None
+    rendered = renderer.render(1, 2, 3, 4)
+    assert rendered.mode == "RGB" and rendered is renderer._canvas
@@ -0,0 +1,70 @@
+# test_cache.py - This tests the logo thumbnails kept next to the logos.
+# Standard Python libraries
+import os
+import threading
+# Testing libraries
+from PIL import Image
+# Programme libraries
+from cache import BaseLayerCache, ThumbnailCache
+from render import logo_path
+
+
+def test_thumbnail_is_made_once(layers):
+
+    thumbnails = ThumbnailCache()
+    logo = logo_path(2, layers[3])
+    path = thumbnails.get(logo)
+    mtime = os.stat(path).st_mtime_ns
+
+    assert path == os.path.join(layers[3], "thumbnails", "team2.png")
+    assert Image.open(path).size == (100, 100)
+    assert thumbnails.get(logo) == path
+    assert os.stat(path).st_mtime_ns == mtime
+
+def test_thumbnail_of_a_new_logo(layers):
+
+    thumbnails = ThumbnailCache()
+    logo = logo_path(1, layers[3])
+    path = thumbnails.get(logo)
+    Image.new("RGBA", (250, 250), (1, 2, 3, 255)).save(logo)
+    stat = os.stat(path)
+    os.utime(logo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert Image.open(thumbnails.get(logo)).getpixel((50, 50)) \
+        == (1, 2, 3, 255)
+
+def test_invalidate(layers):
+
+    thumbnails = ThumbnailCache()
+    paths = [thumbnails.get(logo_path(team_id, layers[3]))
+             for team_id in (1, 2)]
+    thumbnails.invalidate(logo_path(1, layers[3]))
+
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1])
+    thumbnails.invalidate(layers[3])
+    assert not os.path.exists(paths[1])
+
+def test_base_layer_written_by_several_threads(tmp_path):
+
+    base_cache = BaseLayerCache(str(tmp_path / "base"))
+    image = Image.new("RGBA", (512, 512), (1, 2, 3, 4))
+    barrier = threading.Barrier(4)
+    errors = []
+    def store():
+        barrier.wait()
+        try:
+            base_cache.store("plain", "key", image)
+        except OSError as error:
+            errors.append(error)
+    threads = [threading.Thread(target=store) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(base_cache.cache_dir) == [
+        os.path.basename(base_cache._path("plain", "key"))]
+    assert base_cache.load("plain", "key", image.size).tobytes() \
+        == image.tobytes()
@@ -0,0 +1,151 @@
+# test_cli.py - This tests the command line, which has to work without Qt.
+# Standard Python libraries
+import os
+import sys
+import json
+import subprocess
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+import cli
+from render import logo_path
+from roster import RosterDatabase
+
+
+ROSTER = {"teams": ["Alpha", "Beta", "Gamma", "Delta"],
+          "players": {"Alpha": ["Ann"], "Beta": ["Bob"], "Gamma": ["Cid"],
+                      "Delta": ["Dee"]}}
+
+
+@pytest.fixture
+def setup(layers, layer_files, tmp_path):
+    config_dir = tmp_path / "config"
+    config_dir.mkdir()
+    (config_dir / "config.json").write_text(json.dumps({
+        "teams_file": "teams.json", "total_teams": 4}))
+    (config_dir / "teams.json").write_text(json.dumps(ROSTER))
+    return ["--config", str(config_dir / "config.json"),
+            "--logos-dir", layers[3]]
+
+def run(capsys, *argv):
+    exit_code = cli.main(list(argv))
+    captured = capsys.readouterr()
+    return exit_code, [json.loads(line)
+                       for line in captured.out.splitlines()], captured.err
+
+def test_render_prints_json(setup, layer_files, tmp_path, capsys):
+
+    exit_code, records, err = run(capsys, "render", "1", "2", "3", "4",
+        str(tmp_path / "out"), "--mat", layer_files[0], "--no-cache",
+        "--json", *setup)
+
+    assert exit_code == cli.EXIT_OK
+    assert records[0]["teams"] == [1, 2, 3, 4]
+    assert Image.open(records[0]["output"]).size == (2048, 2048)
+
+def test_missing_logo_fails(setup, tmp_path, capsys):
+
+    exit_code, records, err = run(capsys, "render", "1", "2", "3", "9",
+        str(tmp_path / "out"), "--json", *setup)
+
+    assert exit_code == cli.EXIT_FAILED
+    assert json.loads(err)["team"] == 9
+
+@pytest.mark.parametrize("workers", [[], ["--workers", "1"]])
+def test_schedule_reports_every_table(setup, layer_files, tmp_path, capsys,
+    workers):
+    # One table without a logo doesn't stop the others, with or without
+    # worker processes
+    schedule = tmp_path / "schedule.json"
+    schedule.write_text(json.dumps([[1, 2, 3, 4], [1, 2, 3, 9],
+                                    [4, 3, 2, 1]]))
+
+    exit_code, records, err = run(capsys, "schedule", str(schedule),
+        str(tmp_path / "out"), "--mat", layer_files[0], "--no-cache",
+        "--json", *workers, *setup)
+
+    assert exit_code == cli.EXIT_FAILED
+    assert [record["table"] for record in records] == ["table001",
+                                                       "table003"]
+    assert all(os.path.exists(record["output"]) for record in records)
+    error = json.loads(err)
+    assert error["table"] == "table002" and "team9" in error["error"]
+
+def test_bad_arguments_are_usage_errors(setup, capsys):
+
+    with pytest.raises(SystemExit) as error:
+        cli.main(["render", "1", "2"])
+    assert error.value.code == cli.EXIT_USAGE
+
+def test_export_and_import(setup, layers, tmp_path, capsys):
+
+    pack = str(tmp_path / "pack.zip")
+    exit_code, records, err = run(capsys, "export", pack, "--json", *setup)
+    assert exit_code == cli.EXIT_OK
+    assert records[0]["logos"] == 4
+
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "config.json").write_text(json.dumps({"total_teams": 0}))
+    (other / "teams.json").write_text(json.dumps({"teams": [],
+                                                  "players": {}}))
+    target = ["--config", str(other / "config.json"),
+              "--logos-dir", str(tmp_path / "imported")]
+    exit_code, records, err = run(capsys, "import", pack, "--dry-run",
+        "--json", *target)
+    assert records[0]["added"] == ROSTER["teams"]
+    assert not records[0]["applied"]
+    assert not os.path.exists(str(tmp_path / "imported" / "team1.png"))
+
+    exit_code, records, err = run(capsys, "import", pack, "--json", *target)
+    assert records[0]["applied"]
+    assert json.loads((other / "teams.json").read_text()) == ROSTER
+    assert json.loads((other / "config.json").read_text())["total_teams"] \
+           == 4
+    assert os.path.exists(logo_path(4, str(tmp_path / "imported")))
+
+def test_import_records_logos(setup, tmp_path, capsys):
+
+    pack = str(tmp_path / "pack.zip")
+    run(capsys, "export", pack, "--json", *setup)
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "config.json").write_text(json.dumps({"total_teams": 0,
+        "roster_backend": "sqlite", "roster_database": "teams.db"}))
+    (other / "teams.json").write_text(json.dumps({"teams": [],
+                                                  "players": {}}))
+    logos_dir = str(tmp_path / "imported")
+
+    exit_code, records, err = run(capsys, "import", pack, "--json",
+        "--config", str(other / "config.json"), "--logos-dir", logos_dir)
+
+    assert exit_code == cli.EXIT_OK
+    database = RosterDatabase(str(other / "teams.db"))
+    try:
+        for team_id in range(1, 5):
+            logo = logo_path(team_id, logos_dir)
+            assert database.logo_info(logo) is not None
+            assert not database.logo_changed(logo)
+    finally:
+        database.close()
+
+def test_warm(setup, layer_files, capsys):
+
+    exit_code, records, err = run(capsys, "warm", "--mat", layer_files[0],
+        "--json", *setup)
+
+    assert records[0] == {"base_layers": 2, "thumbnails": 4, "prepared": 4}
+    exit_code, records, err = run(capsys, "warm", "--mat", layer_files[0],
+        "--json", *setup)
+    assert records[0]["prepared"] == 0
+
+def test_qt_is_never_imported():
+
+    code = ("import sys, cli; cli.make_parser(); "
+            "sys.exit('PySide6' in sys.modules)")
+    env = dict(os.environ)
+    env.pop("DISPLAY", None)
+    env.pop("QT_QPA_PLATFORM", None)
+    assert subprocess.run([sys.executable, "-c", code], env=env,
+        cwd=os.path.dirname(os.path.abspath(cli.__file__))).returncode == 0
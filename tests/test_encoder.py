@@ -0,0 +1,59 @@
+# test_encoder.py - This tests the output profiles used to save the
+# tablecloth.
+# Standard Python libraries
+import io
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from encoder import (DEFAULT_PROFILES, check_profile, encode,
+    encoding_report, load_profiles, output_name)
+from render import save_tablecloth
+
+
+@pytest.fixture
+def image():
+
+    return Image.new("RGBA", (64, 64), (10, 20, 30, 255))
+
+def test_default_final_is_pillow_default(image):
+
+    with_profile, without = io.BytesIO(), io.BytesIO()
+    encode(image, with_profile, DEFAULT_PROFILES["final"])
+    image.convert("RGB").save(without, "JPEG")
+
+    assert with_profile.getvalue() == without.getvalue()
+    assert output_name() == "Table_Dif.jpg"
+
+def test_config_profiles_replace_defaults():
+
+    profiles = load_profiles({"output_profiles": {
+        "final": {"format": "PNG", "compress_level": 9}}})
+
+    assert profiles["final"]["format"] == "PNG"
+    assert profiles["fast"] == DEFAULT_PROFILES["fast"]
+    assert output_name(profiles["final"]) == "Table_Dif.png"
+
+@pytest.mark.parametrize("profile", [{"format": "BMP"},
+    {"format": "PNG", "quality": 90}])
+def test_wrong_profiles(profile):
+
+    with pytest.raises(ValueError):
+        check_profile(profile)
+
+def test_every_default_profile_encodes(image):
+
+    report = encoding_report(image, DEFAULT_PROFILES)
+
+    assert [name for name, image_format, seconds, size in report] \
+        == list(DEFAULT_PROFILES)
+    for name, image_format, seconds, size in report:
+        assert size > 0
+        assert seconds >= 0
+
+def test_save_with_profile(image, tmp_path):
+
+    output = save_tablecloth(image, str(tmp_path), DEFAULT_PROFILES["webp"])
+
+    assert output.endswith("Table_Dif.webp")
+    assert Image.open(output).format == "WEBP"
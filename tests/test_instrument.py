@@ -0,0 +1,73 @@
+# test_instrument.py - This tests the spans recorded around every render stage
+# and the progress calculated from them.
+# Standard Python libraries
+import json
+# Programme libraries
+from instrument import ProgressModel, Span, Tracer, peak_memory, span
+from render import render_table
+
+
+def test_span_without_tracer():
+
+    with span("compose"):
+        pass
+
+def test_render_stages_are_traced(renderer, tmp_path):
+
+    renderer.render_cache = False
+    tracer = Tracer()
+    with tracer.active():
+        render_table(renderer, (1, 2, 3, 4), str(tmp_path))
+
+    names = [finished.name for finished in tracer.spans]
+    assert names.count("decode") == 4
+    assert names.count("rotate") == 4
+    for name in ("compose_base", "compose", "convert", "encode", "write"):
+        assert name in names
+    assert names.index("encode") < names.index("write")
+    assert all(finished.duration >= 0 for finished in tracer.spans)
+
+def test_cached_logos_are_not_decoded_again(renderer, tmp_path):
+
+    renderer.render_cache = False
+    render_table(renderer, (1, 2, 3, 4), str(tmp_path))
+    tracer = Tracer()
+    with tracer.active():
+        render_table(renderer, (1, 2, 3, 4), str(tmp_path))
+
+    assert "decode" not in tracer.totals()
+
+def test_write_formats(tmp_path):
+
+    tracer = Tracer()
+    with tracer.active():
+        with span("encode", format="JPEG"):
+            pass
+    tracer.write(str(tmp_path / "trace.jsonl"))
+    tracer.write(str(tmp_path / "trace.json"), "trace")
+    tracer.write(str(tmp_path / "trace.json"), "trace")
+
+    with open(str(tmp_path / "trace.jsonl"), "r", encoding="utf-8") as fp:
+        event = json.loads(fp.readline())
+    assert event["name"] == "encode"
+    assert event["args"] == {"format": "JPEG"}
+    with open(str(tmp_path / "trace.json"), "r", encoding="utf-8") as fp:
+        # Unterminated on purpose, the viewers accept it like that
+        events = json.loads(fp.read().rstrip(",\n") + "]")
+    assert [event["ph"] for event in events] == ["X", "X"]
+
+def test_progress_follows_the_stages():
+
+    model = ProgressModel(smoothing=0.5)
+    state = model.start(["decode", "compose", "encode"])
+    values = [model.advance(state, Span(name, 0, 0.02, 0, {}))
+              for name in ("decode", "compose", "encode")]
+
+    assert values == sorted(values)
+    assert values[-1] == 99
+    assert model.weights["decode"] == 0.015
+
+def test_peak_memory_is_known():
+    # /proc on Linux, the process memory counters on Windows
+
+    assert peak_memory() > 0
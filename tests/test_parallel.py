@@ -0,0 +1,55 @@
+# test_parallel.py - This tests that the process pool renders the same
+# tablecloths as the serial path, in order and without stopping on errors.
+# Testing libraries
+from PIL import Image, ImageChops
+# Programme libraries
+from render import TableclothRenderer, render_schedule
+from cache import BaseLayerCache
+from parallel import render_parallel
+
+
+TABLES = [{"name": "table001", "east": 1, "south": 2, "west": 3, "north": 4},
+          {"name": "table002", "east": 4, "south": 3, "west": 2, "north": 1},
+          {"name": "table003", "east": 2, "south": 2, "west": 2, "north": 2}]
+
+def test_parallel_matches_serial(renderer, tmp_path):
+
+    serial = render_schedule(TABLES, str(tmp_path / "serial"), renderer,
+        technical_lines=True)
+    results = render_parallel(TABLES, str(tmp_path / "parallel"), renderer,
+        technical_lines=True, workers=2)
+
+    assert [result.name for result in results] == \
+        [table["name"] for table in TABLES]
+    for expected, result in zip(serial, results):
+        assert result.error is None
+        assert ImageChops.difference(Image.open(expected),
+            Image.open(result.output)).getbbox() is None
+
+def test_parallel_errors_do_not_stop_the_batch(renderer, tmp_path):
+
+    tables = TABLES[:1] \
+        + [{"name": "missing", "east": 99, "south": 1, "west": 1, "north": 1}]\
+        + TABLES[1:]
+    results = render_parallel(tables, str(tmp_path), renderer, workers=2)
+
+    assert [result.error is None for result in results] == \
+        [True, False, True, True]
+    assert results[1].output is None
+    assert "FileNotFoundError" in results[1].error
+
+def test_low_memory_workers(layers, layer_files, renderer, tmp_path):
+
+    serial = render_schedule(TABLES, str(tmp_path / "serial"), renderer)
+    low_memory = TableclothRenderer(*layer_files, layers[3],
+        base_cache=BaseLayerCache(str(tmp_path / "cache")),
+        render_cache=False, low_memory=True)
+    results = render_parallel(TABLES, str(tmp_path / "parallel"), low_memory,
+        workers=2)
+
+    for expected, result in zip(serial, results):
+        assert result.error is None
+        assert result.peak_memory is None or result.peak_memory > 0
+        with open(expected, "rb") as fp_serial, \
+             open(result.output, "rb") as fp_parallel:
+            assert fp_serial.read() == fp_parallel.read()
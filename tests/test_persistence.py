@@ -0,0 +1,95 @@
+# test_persistence.py - This tests that the config and teams are written in
+# batches and never half written.
+# Standard Python libraries
+import os
+import json
+# Testing libraries
+import pytest
+# Programme libraries
+from persistence import JsonStore, write_json
+
+
+class ManualTimer:
+    # Fires only when the test says so
+    started = []
+
+    def __init__(self, interval, function):
+        self.function = function
+        self.cancelled = False
+
+    def start(self):
+        ManualTimer.started.append(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        if not self.cancelled:
+            self.function()
+
+
+@pytest.fixture
+def store(tmp_path):
+    ManualTimer.started = []
+    path = tmp_path / "teams.json"
+    return JsonStore.load(str(path), {"teams": [], "players": {}},
+                          timer=ManualTimer)
+
+
+def test_changes_are_debounced(store):
+
+    for number in range(50):
+        store.data["teams"].append("Team %d" % number)
+        store.changed()
+
+    assert not os.path.exists(store.path)
+    assert sum(not timer.cancelled for timer in ManualTimer.started) == 1
+    for timer in ManualTimer.started:
+        timer.fire()
+    assert store.writes == 1
+    with open(store.path, encoding="utf-8") as fp_store:
+        assert len(json.load(fp_store)["teams"]) == 50
+
+def test_transaction_is_one_write(store):
+
+    with store.transaction() as data:
+        data["teams"].append("A")
+        store.changed()
+        with store.transaction():
+            data["teams"].append("B")
+            store.changed()
+        assert ManualTimer.started == []
+    assert len(ManualTimer.started) == 1
+    ManualTimer.started[0].fire()
+    assert store.writes == 1
+    assert not store.dirty
+    assert store.flush() is False
+
+def test_flush_writes_now(store):
+
+    store.replace({"teams": ["A"], "players": {"A": ["Ann"]}})
+    assert store.flush() is True
+    assert ManualTimer.started[0].cancelled
+    assert JsonStore.load(store.path).data["players"] == {"A": ["Ann"]}
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+
+    path = str(tmp_path / "config.json")
+    write_json(path, {"total_teams": 1})
+    with pytest.raises(TypeError):
+        write_json(path, {"total_teams": object()})
+
+    assert os.listdir(str(tmp_path)) == ["config.json"]
+    with open(path, encoding="utf-8") as fp_config:
+        assert json.load(fp_config) == {"total_teams": 1}
+
+def test_compact_only_when_big(tmp_path):
+
+    path = str(tmp_path / "teams.json")
+    write_json(path, {"teams": ["A"]}, compact_over=100)
+    assert "\n" in open(path, encoding="utf-8").read()
+    roster = {"teams": ["Team %d" % number for number in range(50)]}
+    write_json(path, roster, compact_over=100)
+    text = open(path, encoding="utf-8").read()
+    assert "\n" not in text
+    assert json.loads(text) == roster
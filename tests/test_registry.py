@@ -0,0 +1,73 @@
+# test_registry.py - This tests the team and player indexes kept in sync with
+# the roster as teams are added, edited and deleted.
+# Standard Python libraries
+import os
+import json
+# Testing libraries
+import pytest
+# Programme libraries
+from registry import TeamRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+
+    return TeamRegistry(["Red", "Green", "Blue"],
+        {"Red": ["Ann", "Bob"], "Green": ["Cid"], "Blue": ["Dee", "Ann"]},
+        str(tmp_path))
+
+def test_lookups(registry, tmp_path):
+
+    assert registry.team_id("Green") == 2
+    assert registry.team_name(3) == "Blue"
+    assert registry.team_of("Cid") == "Green"
+    assert registry.teams_of("Ann") == ["Red", "Blue"]
+    assert registry.team_of("Nobody") is None
+    assert registry.logo("Blue") == os.path.join(str(tmp_path), "team3.png")
+    assert registry.logo(1) == os.path.join(str(tmp_path), "team1.png")
+    with pytest.raises(KeyError):
+        registry.team_id("Purple")
+
+def test_add_team(registry):
+
+    assert registry.add_team("Gold", ["Eve"]) == 4
+    assert registry.team_of("Eve") == "Gold"
+    assert registry.player_items()[-1] == ("Eve", "Gold")
+    with pytest.raises(ValueError):
+        registry.add_team("Red")
+
+def test_set_members(registry):
+
+    registry.set_members("Red", ["Bob", "Fay"])
+
+    assert registry.teams_of("Ann") == ["Blue"]
+    assert registry.team_of("Fay") == "Red"
+    assert registry.players["Red"] == ["Bob", "Fay"]
+
+def test_remove_team_moves_the_next_ones_up(registry):
+
+    assert registry.remove_team("Red") == 1
+
+    assert registry.teams == ["Green", "Blue"]
+    assert registry.team_id("Blue") == 2
+    assert registry.team_of("Bob") is None
+    assert registry.team_of("Ann") == "Blue"
+    assert "Red" not in registry
+
+def test_round_trip(registry, tmp_path):
+
+    teams_file = tmp_path / "teams.json"
+    teams_file.write_text(json.dumps(registry.to_dict()))
+    loaded = TeamRegistry.from_file(str(teams_file))
+
+    assert loaded.to_dict() == registry.to_dict()
+    assert loaded.player_items() == registry.player_items()
+
+def test_search_follows_the_roster(registry):
+
+    assert registry.search.search("ann") == [("Ann", "Red"), ("Ann", "Blue")]
+    registry.set_members("Red", ["Bob"])
+    registry.add_team("Gold", ["Annabel"])
+    registry.remove_team("Blue")
+
+    assert registry.search.search("ann") == [("Annabel", "Gold")]
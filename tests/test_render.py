@@ -0,0 +1,363 @@
+# test_render.py - This tests the Qt-free compositor and the schedule
+# rendering without opening the GUI.
+# Standard Python libraries
+import os
+import json
+import threading
+# Testing libraries
+import pytest
+from PIL import Image, ImageChops
+# Programme libraries
+from render import (DRAFT_SCALE, FULL_QUARTER_SIZE, SEATS,
+    IncrementalCompositor, LogoCache, TableclothRenderer, load_schedule,
+    render_schedule, render_table, logo_path)
+from cache import STALE_SECONDS, BaseLayerCache, RenderCache
+from instrument import Tracer
+
+
+def reference_render(layers, team_ids, technical_lines):
+    # The compositing as GenerateImageThread.run used to do it
+    mat, border, tech_lines, logos_dir = layers
+    final = Image.new("RGBA", mat.size)
+    final.paste(mat, (0, 0), mat)
+    final.paste(border, (0, 0), border)
+    if technical_lines:
+        final.paste(tech_lines, (0, 0), tech_lines)
+    placements = [(0, (240, 1020), (900, 1325)), (90, (1020, 235), (1420, 900)),
+        (180, (235, 240), (890, 370)), (-90, (240, 240), (400, 910))]
+    for team_id, (rotation, full, small) in zip(team_ids, placements):
+        image = Image.open(logo_path(team_id, logos_dir))
+        team = image.rotate(rotation, expand=True).convert("RGBA")
+        if image.size == FULL_QUARTER_SIZE:
+            final.paste(team, full, team)
+        else:
+            final.paste(team.resize((250, 250)), small, team.resize((250, 250)))
+    return final
+
+@pytest.mark.parametrize("technical_lines", [False, True])
+def test_render_matches_reference(layers, renderer, technical_lines):
+
+    team_ids = (1, 2, 3, 4)
+    rendered = renderer.render(*team_ids, technical_lines=technical_lines)
+    expected = reference_render(layers, team_ids, technical_lines)
+
+    assert ImageChops.difference(rendered, expected).getbbox() is None
+
+def test_logos_are_reused(renderer):
+
+    renderer.render(1, 2, 3, 4)
+    tile = renderer.seat_tile(2, "south")
+    renderer.render(4, 2, 1, 3)
+
+    assert renderer.seat_tile(2, "south") is tile
+
+def test_logo_cache_reloads_overwritten_logo(layers):
+
+    logos_dir = layers[3]
+    cache = LogoCache()
+    tile, mask, position = cache.get(logo_path(1, logos_dir), "east")
+    Image.new("RGBA", FULL_QUARTER_SIZE).save(logo_path(1, logos_dir))
+    stat = os.stat(logo_path(1, logos_dir))
+    os.utime(logo_path(1, logos_dir),
+        ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    new_tile, new_mask, new_position = cache.get(logo_path(1, logos_dir),
+                                                 "east")
+
+    assert tile.size == (250, 250)
+    assert new_tile.size == FULL_QUARTER_SIZE
+    assert new_position != position
+    assert len(cache) == 1
+
+def test_logo_cache_evicts_least_recently_used(layers):
+
+    logos_dir = layers[3]
+    # Room for two 250x250 tiles with their masks, not three
+    cache = LogoCache(max_bytes=250 * 250 * 5 * 2)
+    cache.get(logo_path(1, logos_dir), "east")
+    cache.get(logo_path(3, logos_dir), "east")
+    cache.get(logo_path(1, logos_dir), "east")
+    cache.get(logo_path(4, logos_dir), "east")
+
+    assert len(cache) == 2
+    assert cache.size_bytes <= cache.max_bytes
+    # Team 3 was the least recently used one
+    assert all(key[0] != logo_path(3, logos_dir) for key in cache._entries)
+
+def test_logo_cache_invalidate(layers):
+
+    logos_dir = layers[3]
+    cache = LogoCache()
+    for seat in SEATS:
+        cache.get(logo_path(1, logos_dir), seat)
+    cache.get(logo_path(3, logos_dir), "east")
+    cache.invalidate(logo_path(1, logos_dir))
+
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.size_bytes == 0
+
+def test_base_layer_is_a_copy(renderer):
+
+    base = renderer.base_layer()
+    base.paste((0, 0, 0, 255), (0, 0, 10, 10))
+
+    assert renderer.base_layer().getpixel((0, 0)) != (0, 0, 0, 255)
+
+def test_base_layer_cache_persists(layers, layer_files, tmp_path):
+
+    base_cache = BaseLayerCache(str(tmp_path / "cache"))
+    first = TableclothRenderer(*layer_files, layers[3],
+        base_cache=base_cache).base_layer(True)
+    files = os.listdir(base_cache.cache_dir)
+    # A new renderer reads it back instead of compositing again
+    renderer = TableclothRenderer(*layer_files, layers[3],
+        base_cache=base_cache)
+    renderer.compose_base = None
+    second = renderer.base_layer(True)
+
+    assert len(files) == 1
+    assert ImageChops.difference(first, second).getbbox() is None
+
+def test_base_layer_cache_invalidation(layers, layer_files, tmp_path):
+
+    base_cache = BaseLayerCache(str(tmp_path / "cache"))
+    sources = layer_files[:2]
+    key = base_cache.key(sources, "mat.png")
+
+    assert base_cache.key(sources, "other.png") != key
+    stat = os.stat(sources[0])
+    os.utime(sources[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert base_cache.key(sources, "mat.png") != key
+
+    base_cache.store("plain", key, layers[0])
+    old_path = base_cache._path("plain", key)
+    base_cache.store("plain", base_cache.key(sources, "mat.png"), layers[0])
+    # Another process may have just written it
+    assert os.path.exists(old_path)
+    # The outdated variant is removed once nobody has written it in a while
+    stale = os.stat(old_path).st_mtime_ns - (STALE_SECONDS + 1) * 10**9
+    os.utime(old_path, ns=(stale, stale))
+    base_cache.store("plain", base_cache.key(sources, "mat.png"), layers[0])
+    assert os.listdir(base_cache.cache_dir) == [
+        os.path.basename(base_cache._path("plain",
+                                          base_cache.key(sources, "mat.png")))]
+
+def test_incremental_matches_full_render(renderer):
+
+    compositor = IncrementalCompositor(renderer)
+    # Team 2 is a full quarter, so its tiles overlap the other seats
+    assignments = [(1, 2, 3, 4), (2, 2, 3, 4), (2, 1, 3, 4), (2, 1, 2, 2),
+                   (3, 1, 2, 2), (1, 2, 3, 4)]
+    for team_ids in assignments:
+        rendered = compositor.render(*team_ids)
+        expected = renderer.render(*team_ids)
+
+        assert rendered.tobytes() == expected.tobytes()
+
+def test_incremental_only_redraws_changed_seat(renderer, monkeypatch):
+
+    compositor = IncrementalCompositor(renderer)
+    compositor.render(1, 3, 4, 1)
+    redrawn = []
+    monkeypatch.setattr(compositor, "_redraw",
+        lambda box, base, entries: redrawn.append(box))
+    compositor.render(1, 3, 4, 1)
+    assert redrawn == []
+    compositor.render(1, 3, 1, 1)
+    # Small logos keep their place, so it's just the west one
+    assert redrawn == [(890, 370, 1140, 620)]
+
+def test_incremental_technical_lines_switch(renderer):
+
+    compositor = IncrementalCompositor(renderer)
+    compositor.render(1, 2, 3, 4)
+    rendered = compositor.render(1, 2, 3, 4, technical_lines=True)
+
+    assert rendered.tobytes() == renderer.render(1, 2, 3, 4, True).tobytes()
+
+def test_draft_render(renderer):
+
+    draft = renderer.render(1, 2, 3, 4, technical_lines=True, scale=4)
+    full = renderer.render(1, 2, 3, 4, technical_lines=True)
+    difference = ImageChops.difference(draft, full.reduce(4)).convert("L")
+
+    assert draft.size == (512, 512)
+    # Only the edges of the logos can land a pixel apart
+    assert sum(difference.histogram()[33:]) < 0.02 * 512 * 512
+
+@pytest.fixture
+def cached_renderer(layers, layer_files, tmp_path):
+
+    return TableclothRenderer(*layer_files, layers[3],
+        base_cache=BaseLayerCache(str(tmp_path / "base")),
+        render_cache=RenderCache(str(tmp_path / "renders")))
+
+def test_render_cache_hit(cached_renderer, tmp_path, monkeypatch):
+
+    first_dir, second_dir = tmp_path / "first", tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+    first = render_table(cached_renderer, (1, 2, 3, 4), str(first_dir), True)
+    monkeypatch.setattr(cached_renderer, "render", None)
+    second = render_table(cached_renderer, (1, 2, 3, 4), str(second_dir), True)
+
+    with open(first, "rb") as fp_first, open(second, "rb") as fp_second:
+        assert fp_first.read() == fp_second.read()
+
+def test_render_cache_key(cached_renderer, layers):
+
+    key = cached_renderer.output_key((1, 2, 3, 4))
+
+    assert cached_renderer.output_key((1, 2, 3, 4)) == key
+    assert cached_renderer.output_key((2, 1, 3, 4)) != key
+    assert cached_renderer.output_key((1, 2, 3, 4), True) != key
+    assert cached_renderer.output_key((1, 2, 3, 4), False,
+                                      {"quality": 90}) != key
+    # A logo with new content is a new tablecloth
+    Image.new("RGBA", (250, 250), (1, 2, 3, 4))\
+         .save(logo_path(3, layers[3]))
+    assert cached_renderer.output_key((1, 2, 3, 4)) != key
+
+def test_render_cache_off(renderer, cached_renderer):
+
+    cached_renderer.render_cache = False
+
+    assert cached_renderer.output_key((1, 2, 3, 4)) is None
+    # In memory layers can't be hashed by file
+    assert renderer.output_key((1, 2, 3, 4)) is None
+
+def test_render_cache_eviction(tmp_path):
+
+    render_cache = RenderCache(str(tmp_path / "renders"), max_bytes=250)
+    for number in range(4):
+        source = tmp_path / ("%d.jpg" % number)
+        source.write_bytes(b"x" * 100)
+        render_cache.store(render_cache.key([number]), str(source))
+        os.utime(render_cache._path(render_cache.key([number])),
+                 ns=(number * 10**9, number * 10**9))
+    render_cache.evict()
+
+    assert render_cache.size_bytes() <= 250
+    assert render_cache.fetch(render_cache.key([3]), str(tmp_path / "out"))
+    assert not render_cache.fetch(render_cache.key([0]),
+                                  str(tmp_path / "out"))
+
+def test_load_schedule(tmp_path):
+
+    schedule_file = tmp_path / "schedule.json"
+    schedule_file.write_text(json.dumps([[1, 2, 3, 4],
+        {"name": "final", "east": 4, "south": 3, "west": 2, "north": 1}]))
+    tables = load_schedule(str(schedule_file))
+
+    assert tables[0] == {"name": "table001", "east": 1, "south": 2,
+                         "west": 3, "north": 4}
+    assert tables[1]["name"] == "final"
+    assert [tables[1][seat] for seat in SEATS] == [4, 3, 2, 1]
+
+def test_load_schedule_wrong_size(tmp_path):
+
+    schedule_file = tmp_path / "schedule.json"
+    schedule_file.write_text(json.dumps([[1, 2, 3]]))
+
+    with pytest.raises(ValueError):
+        load_schedule(str(schedule_file))
+
+def test_render_schedule(renderer, tmp_path):
+
+    tables = [{"name": "table001", "east": 1, "south": 2, "west": 3,
+               "north": 4},
+              {"name": "table002", "east": 4, "south": 3, "west": 2,
+               "north": 1}]
+    outputs = render_schedule(tables, str(tmp_path / "out"), renderer)
+
+    assert len(outputs) == 2
+    for output in outputs:
+        assert os.path.exists(output)
+        assert Image.open(output).size == (2048, 2048)
+
+@pytest.mark.parametrize("technical_lines", [False, True])
+def test_low_memory_matches_reference(layers, layer_files, tmp_path,
+    technical_lines):
+
+    renderer = TableclothRenderer(*layer_files, layers[3],
+        base_cache=BaseLayerCache(str(tmp_path / "cache")), low_memory=True)
+    # Composited and stored the first time, streamed from disk afterwards
+    for team_ids in [(1, 2, 3, 4), (1, 2, 3, 4), (4, 3, 2, 1)]:
+        rendered = renderer.render(*team_ids, technical_lines=technical_lines)
+        expected = reference_render(layers, team_ids, technical_lines)
+
+        assert rendered.mode == "RGB"
+        assert rendered.tobytes() == expected.convert("RGB").tobytes()
+    assert not isinstance(renderer._layers["mat"], Image.Image)
+
+def test_low_memory_draft_keeps_only_the_small_base(layers, layer_files,
+    tmp_path):
+
+    renderer = TableclothRenderer(*layer_files, layers[3],
+        base_cache=BaseLayerCache(str(tmp_path / "cache")), low_memory=True)
+    normal = TableclothRenderer(*layer_files, layers[3],
+        base_cache=BaseLayerCache(str(tmp_path / "cache")))
+    for technical_lines in (False, True):
+        draft = renderer.render(1, 2, 3, 4, technical_lines=technical_lines,
+            scale=DRAFT_SCALE)
+
+        assert draft.tobytes() == normal.render(1, 2, 3, 4,
+            technical_lines=technical_lines, scale=DRAFT_SCALE).tobytes()
+    assert sorted(renderer._bases) == [(False, DRAFT_SCALE),
+                                       (True, DRAFT_SCALE)]
+
+def test_low_memory_without_files(layers):
+
+    renderer = TableclothRenderer(*layers, low_memory=True)
+    rendered = renderer.render(1, 2, 3, 4)
+    compositor = IncrementalCompositor(renderer)
+
+    assert rendered.tobytes() == reference_render(layers, (1, 2, 3, 4),
+        False).convert("RGB").tobytes()
+    assert compositor.render(1, 2, 3, 4) is rendered
+
+def test_low_memory_saves_the_same_file(layers, layer_files, tmp_path):
+
+    outputs = []
+    for low_memory in (False, True):
+        renderer = TableclothRenderer(*layer_files, layers[3],
+            base_cache=BaseLayerCache(str(tmp_path / "cache")),
+            render_cache=False, low_memory=low_memory)
+        output_dir = tmp_path / ("low" if low_memory else "normal")
+        output_dir.mkdir()
+        tracer = Tracer()
+        with tracer.active():
+            outputs.append(render_table(renderer, (1, 2, 3, 4),
+                str(output_dir)))
+        render_span = [finished for finished in tracer.spans
+                       if finished.name == "render"][0]
+        assert render_span.args["low_memory"] is low_memory
+        assert "peak_rss" in render_span.args
+
+    with open(outputs[0], "rb") as normal, open(outputs[1], "rb") as low:
+        assert normal.read() == low.read()
+
+def test_render_cache_written_by_several_threads(tmp_path):
+
+    render_cache = RenderCache(str(tmp_path / "renders"))
+    source = tmp_path / "table.jpg"
+    source.write_bytes(b"x" * 4 * 1024 * 1024)
+    key = render_cache.key([1, 2, 3, 4])
+    barrier = threading.Barrier(4)
+    errors = []
+    def store():
+        barrier.wait()
+        try:
+            render_cache.store(key, str(source))
+        except OSError as error:
+            errors.append(error)
+    threads = [threading.Thread(target=store) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert render_cache.fetch(key, str(tmp_path / "out.jpg"))
+    assert (tmp_path / "out.jpg").read_bytes() == source.read_bytes()
@@ -0,0 +1,90 @@
+# test_roster.py - This tests the SQLite roster against teams.json.
+# Standard Python libraries
+import os
+import json
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from registry import TeamRegistry
+from roster import JsonRoster, RosterDatabase, migrate, open_roster
+
+
+ROSTER = {
+    "teams": ["Alpha", "Beta", "Gamma"],
+    "players": {"Alpha": ["Ann", "Bob"], "Beta": ["Cid"],
+                "Gamma": ["Ann", "Dee"]},
+}
+
+
+@pytest.fixture
+def database(tmp_path):
+    teams_file = tmp_path / "teams.json"
+    teams_file.write_text(json.dumps(ROSTER))
+    store = migrate(str(teams_file), str(tmp_path / "teams.db"))
+    yield store
+    store.close()
+
+
+def test_migration_exports_the_same_json(database, tmp_path):
+
+    assert database.to_dict() == ROSTER
+    exported = tmp_path / "exported.json"
+    database.export(str(exported))
+    assert json.loads(exported.read_text()) == ROSTER
+    assert json.loads(database.dumps()) == ROSTER
+
+def test_edits_follow_the_registry(database):
+
+    registry = TeamRegistry.from_dict(ROSTER)
+    for store_or_registry in (registry, database):
+        store_or_registry.add_team("Delta", ["Eve"])
+        store_or_registry.set_members("Alpha", ["Bob", "Fay"])
+        assert store_or_registry.remove_team("Beta") == 2
+
+    assert database.to_dict() == registry.to_dict()
+    assert database.teams() == ["Alpha", "Gamma", "Delta"]
+    assert database.members("Delta") == ["Eve"]
+    assert database.teams_of("Ann") == ["Gamma"]
+    with pytest.raises(ValueError):
+        database.add_team("Gamma")
+    with pytest.raises(KeyError):
+        database.set_members("Beta", [])
+
+def test_failed_transaction_is_rolled_back(database):
+
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.set_members("Alpha", [])
+            database.remove_team("Beta")
+            raise RuntimeError
+
+    assert database.to_dict() == ROSTER
+
+def test_logo_metadata(database, tmp_path):
+
+    logo = str(tmp_path / "team1.png")
+    Image.new("RGBA", (250, 250)).save(logo)
+    assert database.logo_changed(logo)
+    database.record_logo(logo)
+
+    assert database.logo_info(logo)[2:] == (250, 250)
+    assert not database.logo_changed(logo)
+    stat = os.stat(logo)
+    os.utime(logo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert database.logo_changed(logo)
+    database.forget_logo(logo)
+    assert database.logo_info(logo) is None
+
+def test_open_roster(tmp_path):
+
+    (tmp_path / "teams.json").write_text(json.dumps(ROSTER))
+
+    assert isinstance(open_roster({}, str(tmp_path)), JsonRoster)
+    store = open_roster({"roster_backend": "sqlite"}, str(tmp_path))
+    assert isinstance(store, RosterDatabase)
+    assert store.to_dict() == ROSTER
+    store.close()
+    assert os.path.exists(str(tmp_path / "teams.db"))
+    with pytest.raises(ValueError):
+        open_roster({"roster_backend": "xml"}, str(tmp_path))
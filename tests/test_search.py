@@ -0,0 +1,62 @@
+# test_search.py - This tests the ranking of the player search index and that
+# it keeps up with players being added and removed.
+# Testing libraries
+import pytest
+# Programme libraries
+from search import PlayerIndex, normalize, random_roster
+
+
+@pytest.fixture
+def index():
+
+    return PlayerIndex([("José Núñez", "A"), ("Jon", "B"), ("John Smith", "C"),
+        ("Ann", "D"), ("Joanne", "E"), ("Bo", "F")])
+
+def test_normalize():
+
+    assert normalize("ÑOÑO Müller") == "nono muller"
+
+@pytest.mark.parametrize("text, first", [("jose", "José Núñez"),
+    ("NUÑEZ", "José Núñez"), ("ann", "Ann"), ("smi", "John Smith"),
+    ("jonh", "Jon"), ("smth", "John Smith"), ("b", "Bo")])
+def test_best_match(index, text, first):
+
+    assert index.search(text)[0][0] == first
+
+def test_ranking(index):
+
+    # Exact, then the ones starting with it, then the ones that contain it
+    assert [player for player, team in index.search("ann")] \
+        == ["Ann", "Joanne"]
+    assert [player for player, team in index.search("jo")] \
+        == ["Jon", "Joanne", "John Smith", "José Núñez"]
+    assert index.search("zzz") == []
+    assert index.search("  ") == []
+
+def test_short_infix_queries():
+    # The search before the index found any part of the name
+    index = PlayerIndex([("Bob", "B"), ("Hal", "H"), ("Alba", "A")])
+
+    assert index.search("ob") == [("Bob", "B")]
+    assert index.search("al") == [("Alba", "A"), ("Hal", "H")]
+    assert index.search("l") == [("Hal", "H"), ("Alba", "A")]
+    assert index.search("x") == []
+
+def test_add_and_remove(index):
+
+    index.add("Annika", "G")
+    assert ("Annika", "G") in index.search("anni")
+    index.remove("Annika", "G")
+    index.remove("Annika", "G")
+
+    assert ("Annika", "G") not in index.search("anni")
+    assert len(index) == 6
+
+def test_large_roster():
+
+    roster = random_roster(10000)
+    index = PlayerIndex(roster)
+    player, team = roster[1234]
+
+    assert index.search(player, limit=1)[0][0] == player
+    assert len(index.search(player[1:4], limit=10)) <= 10
@@ -0,0 +1,121 @@
+# test_service.py - This tests the render service, on localhost only.
+# Standard Python libraries
+import io
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from render import TableclothRenderer
+from service import QueueFull, RenderService, make_server
+
+
+@pytest.fixture
+def server(renderer):
+    service = RenderService(renderer, workers=2)
+    service.start()
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://%s:%d" % server.server_address[:2]
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+def get(url):
+    try:
+        with urlopen(url, timeout=60) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as error:
+        return error.code, error.headers, error.read()
+
+def test_render_over_http(server, renderer):
+
+    status, headers, body = get(server + "/render?east=1&south=2&west=3"
+                                "&north=4&lines=1&profile=lossless")
+
+    assert status == 200
+    assert headers["Content-Type"] == "image/png"
+    image = Image.open(io.BytesIO(body))
+    assert image.size == (2048, 2048)
+    expected = renderer.render(1, 2, 3, 4, technical_lines=True)
+    assert image.convert("RGB").tobytes() == expected.convert("RGB").tobytes()
+
+def test_bad_requests(server):
+
+    assert get(server + "/render?east=1&south=2")[0] == 400
+    assert get(server + "/render?east=1&south=2&west=3&north=4"
+               "&profile=nope")[0] == 400
+    status, headers, body = get(server + "/render?east=1&south=2&west=3"
+                                "&north=9")
+    assert status == 404
+    assert "team9" in json.loads(body)["error"]
+    assert get(server + "/health")[2] == b"ok"
+
+def test_metrics(server):
+
+    get(server + "/render?east=1&south=2&west=3&north=4")
+    get(server + "/render?east=1&south=2&west=3&north=4")
+
+    metrics = json.loads(get(server + "/metrics")[2])
+    assert metrics["requests"] == 2
+    assert metrics["completed"] == 1
+    assert metrics["cache_hits"] == 1
+    assert metrics["queue_depth"] == 0
+    assert metrics["latency"]["render"]["p50"] > 0
+
+def test_duplicates_are_coalesced(renderer):
+    # Nothing runs until start(), so both requests are waiting
+    service = RenderService(renderer, workers=1, queue_size=1)
+    first = service.submit((1, 2, 3, 4))
+    second = service.submit((1, 2, 3, 4))
+    assert first is second
+    with pytest.raises(QueueFull):
+        service.submit((4, 3, 2, 1))
+    assert service.metrics()["coalesced"] == 1
+    assert service.metrics()["rejected"] == 1
+
+    service.start()
+    try:
+        assert Image.open(io.BytesIO(first.result(60))).size == (2048, 2048)
+    finally:
+        service.close()
+    assert service.metrics()["in_flight"] == 0
+
+def test_low_memory_uses_one_worker(layers):
+    # Low memory renders reuse the renderer's only canvas
+    renderer = TableclothRenderer(*layers, low_memory=True)
+    service = RenderService(renderer, workers=4)
+    service.start()
+    tables = [(1, 2, 3, 4), (4, 3, 2, 1), (2, 1, 4, 3)]
+    try:
+        assert service.metrics()["workers"] == 1
+        futures = [service.submit(team_ids, profile="lossless")
+                   for team_ids in tables]
+        results = [future.result(60) for future in futures]
+    finally:
+        service.close()
+
+    reference = TableclothRenderer(*layers)
+    for team_ids, data in zip(tables, results):
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        expected = reference.render(*team_ids).convert("RGB")
+        assert image.tobytes() == expected.tobytes()
+
+def test_slow_render_times_out(renderer):
+    # Never started, so nothing is rendered
+    service = RenderService(renderer)
+    server = make_server(service, port=0, timeout=0.1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, headers, body = get("http://%s:%d/render?east=1&south=2"
+            "&west=3&north=4" % server.server_address[:2])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert status == 504
@@ -0,0 +1,203 @@
+# test_teampack.py - This tests importing the team packs ExportTeams makes.
+# Standard Python libraries
+import os
+import json
+import threading
+from zipfile import ZIP_STORED, ZipFile
+# Testing libraries
+import pytest
+from PIL import Image
+# Programme libraries
+from render import (SEATS, LogoCache, TableclothRenderer, logo_path,
+    prepare_logo, prepared_path)
+from teampack import (MANIFEST, Cancelled, PackError, describe_diff,
+    diff_changes, diff_pack, export_pack, import_pack)
+
+
+ROSTER = {"teams": ["Alpha", "Beta", "Gamma", "Delta"],
+          "players": {"Alpha": ["Ann"], "Beta": ["Bob"], "Gamma": ["Cid"],
+                      "Delta": ["Dee"]}}
+
+
+def make_pack(path, logos_dir, roster=ROSTER, extra=()):
+    with ZipFile(path, "w") as pack:
+        pack.writestr("teams.json", json.dumps(roster))
+        for team_id in range(1, 5):
+            pack.write(logo_path(team_id, logos_dir),
+                       arcname="logos/team%d.png" % team_id)
+        for name, data in extra:
+            pack.writestr(name, data)
+    return str(path)
+
+def test_pack_is_imported_prepared(layers, tmp_path):
+
+    pack = make_pack(tmp_path / "pack.zip", layers[3],
+        extra=[("logos/team9.png", b""), ("readme.txt", b"hi")])
+    target = str(tmp_path / "imported")
+    progress = []
+    result = import_pack(pack, target, workers=2,
+        progress=lambda done, total: progress.append((done, total)))
+
+    assert result.roster == ROSTER
+    assert len(result.logos) == 4
+    assert len(result.warnings) == 2
+    assert progress[0] == (0, 4) and progress[-1] == (4, 4)
+    assert [name for name in os.listdir(target)
+            if name.startswith(".import-")] == []
+    for team_id in range(1, 5):
+        logo = logo_path(team_id, target)
+        with open(logo, "rb") as fp_logo, \
+             open(logo_path(team_id, layers[3]), "rb") as fp_original:
+            assert fp_logo.read() == fp_original.read()
+        with Image.open(logo) as image:
+            expected = prepare_logo(image, "south")
+        entry = LogoCache().get(logo, "south")
+        assert os.path.exists(prepared_path(logo, "south"))
+        assert entry[0].tobytes() == expected[0].tobytes()
+        assert entry[2] == expected[2]
+
+def test_prepared_logos_render_the_same(layers, tmp_path):
+
+    mat, border, tech_lines, logos_dir = layers
+    target = str(tmp_path / "imported")
+    import_pack(make_pack(tmp_path / "pack.zip", logos_dir), target)
+    prepared = TableclothRenderer(mat, border, tech_lines, target,
+        logo_cache=LogoCache()).render(1, 2, 3, 4, True)
+    original = TableclothRenderer(mat, border, tech_lines, logos_dir,
+        logo_cache=LogoCache()).render(1, 2, 3, 4, True)
+
+    assert prepared.tobytes() == original.tobytes()
+
+def test_stale_prepared_logo_is_ignored(layers, tmp_path):
+
+    target = str(tmp_path / "imported")
+    import_pack(make_pack(tmp_path / "pack.zip", layers[3]), target)
+    logo = logo_path(1, target)
+    Image.new("RGBA", (250, 250), (1, 2, 3, 255)).save(logo)
+    stat = os.stat(prepared_path(logo, "east"))
+    os.utime(logo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert LogoCache().get(logo, "east")[0].getpixel((0, 0)) == (1, 2, 3, 255)
+
+@pytest.mark.parametrize("roster, extra", [
+    (None, []),
+    ({"teams": "Alpha"}, []),
+    (ROSTER, [("logos/team1.png", b"not a png")]),
+])
+def test_bad_pack_changes_nothing(layers, tmp_path, roster, extra):
+
+    pack = str(tmp_path / "pack.zip")
+    with ZipFile(pack, "w") as archive:
+        if roster is not None:
+            archive.writestr("teams.json", json.dumps(roster))
+        for name, data in extra:
+            archive.writestr(name, data)
+    target = str(tmp_path / "imported")
+
+    with pytest.raises(PackError):
+        import_pack(pack, target)
+    assert os.listdir(target) == []
+
+def test_cancel_changes_nothing(layers, tmp_path):
+
+    pack = make_pack(tmp_path / "pack.zip", layers[3])
+    target = str(tmp_path / "imported")
+    cancel = threading.Event()
+
+    def progress(done, total):
+        if done == 1:
+            cancel.set()
+
+    with pytest.raises(Cancelled):
+        import_pack(pack, target, workers=1, progress=progress,
+            cancel=cancel)
+    assert os.listdir(target) == []
+
+def test_every_seat_is_prepared(layers, tmp_path):
+
+    target = str(tmp_path / "imported")
+    import_pack(make_pack(tmp_path / "pack.zip", layers[3]), target)
+
+    assert len(os.listdir(os.path.join(target, "prepared"))) == 4 * len(SEATS)
+
+def test_export_dedupes_and_stores(layers, tmp_path):
+
+    logos_dir = layers[3]
+    # The fifth team has the same logo as the first
+    with open(logo_path(1, logos_dir), "rb") as fp_logo:
+        data = fp_logo.read()
+    with open(logo_path(5, logos_dir), "wb") as fp_logo:
+        fp_logo.write(data)
+    roster = {"teams": ROSTER["teams"] + ["Echo"],
+              "players": dict(ROSTER["players"], Echo=["Eve"])}
+    pack = str(tmp_path / "pack.zip")
+    result = export_pack(pack, roster, logos_dir, workers=2)
+
+    assert (result.logos, result.duplicates) == (5, 1)
+    with ZipFile(pack) as archive:
+        assert sorted(archive.namelist()) == ["logos/team%d.png" % team_id
+            for team_id in range(1, 5)] + [MANIFEST, "teams.json"]
+        assert archive.getinfo("logos/team2.png").compress_type == ZIP_STORED
+        manifest = json.loads(archive.read(MANIFEST))
+    assert manifest["logos"]["5"]["entry"] == "logos/team1.png"
+
+    target = str(tmp_path / "imported")
+    imported = import_pack(pack, target)
+    assert imported.roster == roster
+    assert imported.warnings == []
+    with open(logo_path(5, target), "rb") as fp_logo:
+        assert fp_logo.read() == data
+
+def test_manifest_hash_is_checked(layers, tmp_path):
+
+    pack = str(tmp_path / "pack.zip")
+    export_pack(pack, ROSTER, layers[3])
+    tampered = str(tmp_path / "tampered.zip")
+    with ZipFile(pack) as archive, ZipFile(tampered, "w") as copy:
+        for info in archive.infolist():
+            data = archive.read(info)
+            if info.filename == "logos/team3.png":
+                data = data[:-1] + b"\0"
+            copy.writestr(info, data)
+
+    with pytest.raises(PackError):
+        import_pack(tampered, str(tmp_path / "imported"))
+
+def test_cancelled_export_writes_nothing(layers, tmp_path):
+
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(Cancelled):
+        export_pack(str(tmp_path / "pack.zip"), ROSTER, layers[3],
+            cancel=cancel)
+    assert os.listdir(str(tmp_path)) == ["logos"]
+
+def test_diff_finds_only_what_changed(layers, tmp_path):
+
+    target = str(tmp_path / "imported")
+    import_pack(make_pack(tmp_path / "pack.zip", layers[3]), target)
+    assert not diff_changes(diff_pack(str(tmp_path / "pack.zip"), ROSTER,
+                                      target))
+
+    Image.new("RGBA", (250, 250), (7, 7, 7, 255)).save(
+        logo_path(3, layers[3]))
+    roster = {"teams": ["Alpha", "Beta", "Gamma", "Echo"],
+              "players": {"Alpha": ["Ann"], "Beta": ["Bob", "Bea"],
+                          "Gamma": ["Cid"], "Echo": ["Eve"]}}
+    pack = str(tmp_path / "new.zip")
+    export_pack(pack, roster, layers[3])
+    diff = diff_pack(pack, ROSTER, target)
+
+    assert (diff.added, diff.removed, diff.members) == (["Echo"], ["Delta"],
+                                                         ["Beta"])
+    assert diff.logos == [3]
+    assert describe_diff(diff) == [
+        "1 team(s) added: Echo", "1 team(s) removed: Delta",
+        "1 team(s) with other players: Beta", "1 logo(s) new or changed"]
+
+    before = os.stat(logo_path(1, target)).st_mtime_ns
+    result = import_pack(pack, target, only=diff.logos)
+    assert result.logos == [logo_path(3, target)]
+    assert os.stat(logo_path(1, target)).st_mtime_ns == before
+    assert not diff_pack(pack, ROSTER, target).logos
@@ -0,0 +1,189 @@
+# test_thread.py - This tests the worker the GUI moves to a QThread, running
+# it directly so no event loop is needed.
+# Standard Python libraries
+import os
+import json
+import threading
+from zipfile import ZipFile
+# Testing libraries
+from PIL import Image
+# Programme libraries
+from cache import ThumbnailCache
+from render import IncrementalCompositor, logo_path
+from thread import (GenerateImageThread, PackThread, RenderScheduler,
+    ThumbnailLoader)
+from teampack import import_pack
+
+
+def make_worker(renderer, tmp_path, temp_img):
+    compositor = IncrementalCompositor(renderer)
+
+    return GenerateImageThread(renderer.mat, renderer.border, 1, 2, 3, 4,
+        save_to=str(tmp_path), temp_img=temp_img, compositor=compositor)
+
+def test_preview_stays_in_memory(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, True)
+    previews = []
+    worker.preview_ready.connect(previews.append)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert len(previews) == 1
+    assert (previews[0].width(), previews[0].height()) == (512, 512)
+    assert not os.path.exists(str(tmp_path / "Table_Dif.jpg"))
+
+def test_final_render_is_saved(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, False)
+    progress = []
+    worker.update_progress.connect(progress.append)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert progress[-1] == 100
+    assert Image.open(str(tmp_path / "Table_Dif.jpg")).size == (2048, 2048)
+
+def test_draft_preview_comes_first(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, True)
+    worker.draft = True
+    previews = []
+    timings = {}
+    worker.preview_ready.connect(previews.append)
+    worker.timing.connect(timings.__setitem__)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert len(previews) == 2
+    assert all((preview.width(), preview.height()) == (512, 512)
+               for preview in previews)
+    assert 0 < timings["first_frame"] <= timings["full_render"]
+
+def test_draft_without_refine(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, True)
+    worker.draft = True
+    worker.refine = False
+    previews = []
+    worker.preview_ready.connect(previews.append)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert len(previews) == 1
+
+def test_progress_comes_from_spans(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, False)
+    spans = []
+    progress = []
+    worker.span_finished.connect(spans.append)
+    worker.update_progress.connect(progress.append)
+    worker.trace_file = str(tmp_path / "trace.jsonl")
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert "encode" in [finished.name for finished in spans]
+    assert progress == sorted(progress) and progress[-1] == 100
+    with open(worker.trace_file, "r", encoding="utf-8") as fp_trace:
+        assert len(fp_trace.readlines()) == len(spans)
+
+def test_trace_that_cannot_be_written(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, True)
+    worker.trace_file = str(tmp_path / "missing" / "trace.jsonl")
+    errors = []
+    worker.trace_failed.connect(errors.append)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert len(errors) == 1 and "trace.jsonl" in errors[0]
+
+def test_thumbnails_load_in_the_background(qtbot, layers):
+
+    loader = ThumbnailLoader(ThumbnailCache())
+    logo = logo_path(2, layers[3])
+    with qtbot.waitSignal(loader.loaded, timeout=10000) as blocker:
+        loader.request(logo)
+
+    assert blocker.args[0] == logo
+    assert (blocker.args[1].width(), blocker.args[1].height()) == (100, 100)
+
+def test_pack_imports_in_the_background(qtbot, layers, tmp_path):
+
+    pack = str(tmp_path / "pack.zip")
+    with ZipFile(pack, "w") as archive:
+        archive.writestr("teams.json",
+            json.dumps({"teams": ["Alpha"], "players": {"Alpha": ["Ann"]}}))
+        archive.write(logo_path(1, layers[3]), arcname="logos/team1.png")
+    worker = PackThread(lambda progress, cancel: import_pack(pack,
+        str(tmp_path / "imported"), progress=progress, cancel=cancel))
+    progress = []
+    results = []
+    worker.progress.connect(lambda done, total: progress.append(done))
+    worker.done.connect(results.append)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.run()
+
+    assert progress == [0, 1]
+    assert results[0].roster["teams"] == ["Alpha"]
+
+def test_cancelled_render_stops(qtbot, renderer, tmp_path):
+
+    worker = make_worker(renderer, tmp_path, True)
+    previews = []
+    finished = []
+    worker.preview_ready.connect(previews.append)
+    worker.finished.connect(lambda: finished.append(True))
+    worker.cancel()
+    with qtbot.waitSignal(worker.cancelled, timeout=10000):
+        worker.run()
+
+    assert previews == [] and finished == []
+
+def blocked_scheduler(qtbot):
+    # Nothing queued starts until the gate opens, the pool has one thread
+    scheduler = RenderScheduler()
+    gate = threading.Event()
+    scheduler.pool.start(lambda: gate.wait(10))
+    return scheduler, gate
+
+def track(worker, name, events):
+    worker.finished.connect(lambda: events.append((name, "finished")))
+    worker.cancelled.connect(lambda: events.append((name, "cancelled")))
+    return worker
+
+def test_latest_preview_wins(qtbot, renderer, tmp_path):
+
+    scheduler, gate = blocked_scheduler(qtbot)
+    events = []
+    first = track(make_worker(renderer, tmp_path, True), "first", events)
+    second = track(make_worker(renderer, tmp_path, True), "second", events)
+    mat = track(make_worker(renderer, tmp_path, True), "mat", events)
+    scheduler.preview(first)
+    scheduler.preview(mat, "mat")
+    scheduler.preview(second)
+    assert scheduler.running()
+    with qtbot.waitSignal(second.finished, timeout=20000):
+        gate.set()
+    scheduler.stop()
+    qtbot.waitUntil(lambda: not scheduler.jobs)
+
+    assert sorted(events) == [("first", "cancelled"), ("mat", "finished"),
+                              ("second", "finished")]
+
+def test_final_render_goes_first(qtbot, renderer, tmp_path):
+
+    scheduler, gate = blocked_scheduler(qtbot)
+    events = []
+    preview = track(make_worker(renderer, tmp_path, True), "preview", events)
+    final = track(make_worker(renderer, tmp_path, False), "final", events)
+    scheduler.preview(preview)
+    scheduler.final(final)
+    with qtbot.waitSignal(final.finished, timeout=20000):
+        gate.set()
+    scheduler.stop()
+    qtbot.waitUntil(lambda: not scheduler.jobs)
+
+    assert events == [("final", "finished"), ("preview", "cancelled")]
+    assert os.path.exists(str(tmp_path / "Table_Dif.jpg"))
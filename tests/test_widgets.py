@@ -0,0 +1,79 @@
+# test_widgets.py - This tests the roster model shared by the seat comboboxes,
+# checking it against Qt's model tester and counting the rows it touches.
+# Testing libraries
+import pytest
+from PySide6.QtCore import Qt
+from PySide6.QtTest import QAbstractItemModelTester
+from PySide6.QtWidgets import QComboBox
+# Programme libraries
+from registry import TeamRegistry
+from widgets import RosterModel
+
+
+@pytest.fixture
+def model(qtbot):
+    registry = TeamRegistry(["Red", "Green", "Blue"],
+        {"Red": ["Ann", "Bob"], "Green": ["Cid"], "Blue": ["Dee", "Eve"]})
+    model = RosterModel(registry)
+    model.tester = QAbstractItemModelTester(model,
+        QAbstractItemModelTester.FailureReportingMode.Fatal)
+    model.changes = []
+    model.rowsInserted.connect(
+        lambda parent, first, last: model.changes.append(("+", first, last)))
+    model.rowsRemoved.connect(
+        lambda parent, first, last: model.changes.append(("-", first, last)))
+
+    return model
+
+def rows(model):
+    return [(model.index(row).data(), model.index(row).data(Qt.UserRole))
+            for row in range(model.rowCount())]
+
+def test_rows_follow_the_registry(model):
+
+    assert rows(model) == model.registry.player_items()
+    assert model.row_of("Dee", "Blue") == 3
+    assert model.row_of("Dee", "Red") == -1
+
+def test_add_team_appends(model):
+
+    assert model.add_team("Gold", ["Fay", "Gus"]) == 4
+
+    assert model.changes == [("+", 5, 6)]
+    assert rows(model) == model.registry.player_items()
+
+def test_remove_team_removes_its_rows(model):
+
+    assert model.remove_team("Green") == 2
+
+    assert model.changes == [("-", 2, 2)]
+    assert rows(model) == model.registry.player_items()
+    assert model.row_of("Eve", "Blue") == 3
+
+def test_set_members_only_touches_changes(model):
+
+    model.set_members("Red", ["Ann", "Zed", "Bob"])
+    assert model.changes == [("+", 1, 1)]
+    model.changes.clear()
+    model.set_members("Red", ["Zed"])
+
+    assert model.changes == [("-", 2, 2), ("-", 0, 0)]
+    assert rows(model) == model.registry.player_items()
+
+def test_seat_keeps_its_player(model, qtbot):
+
+    seat = QComboBox()
+    qtbot.addWidget(seat)
+    seat.setModel(model)
+    seat.setCurrentIndex(model.row_of("Dee", "Blue"))
+    model.set_members("Red", ["Ann", "Bob", "Bea", "Bud"])
+    model.remove_team("Green")
+
+    assert seat.currentText() == "Dee"
+    assert seat.itemData(seat.currentIndex()) == "Blue"
+
+def test_set_registry_resets(model):
+
+    model.set_registry(TeamRegistry(["Solo"], {"Solo": ["Uno"]}))
+
+    assert rows(model) == [("Uno", "Solo")]
@@ -3,15 +3,21 @@
 # Standard python library
 import os
 import sys
-import tempfile
+import threading
 from pathlib import Path
+from time import perf_counter
 # The __debug__ lines are ignored in the compilation
 if __debug__:
     from timeit import default_timer as timer
-# Image manipulation libraries
-from PIL import Image
 # GUI libraries
-from PySide6.QtCore import QObject, Signal
+from PySide6.QtCore import SIGNAL, QObject, QThreadPool, Signal
+from PySide6.QtGui import QImage
+# Custom libraries
+from instrument import PROGRESS, ProgressModel, Tracer, memory_span, span
+from cache import THUMBNAILS
+from render import (DRAFT_SCALE, IncrementalCompositor, TableclothRenderer,
+    preview_image, render_table)
+from teampack import Cancelled, PackError
 
 
 # Absolute path to the current folder as constant for easy access
@@ -19,14 +25,35 @@ THISDIR = str(Path(__file__).resolve().parent)
 sys.path.insert(0, os.path.dirname(THISDIR))
 
 
+def to_qimage(image):
+    # QImage doesn't own the bytes it's built from, hence the copy
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return QImage(image.tobytes(), image.width, image.height,
+        image.width * 3, QImage.Format_RGB888).copy()
+
+
 class GenerateImageThread(QObject):
     finished = Signal()
     update_progress = Signal(int)
+    # Previews are sent back already scaled, they never touch the disk. With
+    # draft on, the first one is a quick draft and the second the real thing.
+    preview_ready = Signal(QImage)
+    # Name of what was timed and how many seconds it took since run started
+    timing = Signal(str, float)
+    # Every stage as it finishes, a Span from instrument.py
+    span_finished = Signal(object)
+    # Sent instead of finished when cancel() stopped it between stages
+    cancelled = Signal()
+    # Why the trace couldn't be written to trace_file
+    trace_failed = Signal(str)
 
     def __init__(self, tablecloth, border, east_id, south_id, west_id, north_id,
         technical_lines=False, save_to=None, bg_image=None, temp_img=False,
-        parent=None):
+        compositor=None, draft=False, refine=True, profile=None,
+        trace_file=None, trace_format="jsonl", parent=None):
         super().__init__()
+        self._cancel = threading.Event()
         self.tablecloth = tablecloth
         self.border = border
         self.east_id = east_id
@@ -37,74 +64,256 @@ class GenerateImageThread(QObject):
         self.save_to_route = save_to
         self.bg_image = bg_image
         self.temp_img = temp_img
+        # Reusing the compositor keeps the base layers, the logos and the
+        # last tablecloth warm
+        self.compositor = compositor
+        self.draft = draft
+        self.refine = refine
+        # Output profile of the saved file, see encoder.py
+        self.profile = profile
+        # The spans of every run are appended here if it's set
+        self.trace_file = trace_file
+        self.trace_format = trace_format
+        self.tracer = None
+
+    def cancel(self):
+        # From any thread, it stops at the next stage
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def _emit(self, signal, signature, *args):
+        # Some PySide6 versions leak a reference on every emit nobody is
+        # listening to, and the GUI only listens to some of them
+        if self.receivers(SIGNAL(signature)):
+            signal.emit(*args)
+
+    def _check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
 
     def run(self):
         if __debug__:
             start = timer()
+        run_start = perf_counter()
 
-        self.update_progress.emit(10)
-
-        image_east = Image.open(THISDIR + "\\images\\logos\\team%d.png"\
-            % self.east_id)
-        team_east = image_east.convert("RGBA")
-
-        image_south = Image.open(THISDIR + "\\images\\logos\\team%d.png"\
-            % self.south_id)
-        team_south = image_south.rotate(90, expand=True).convert("RGBA")
-        
-        image_west = Image.open(THISDIR + "\\images\\logos\\team%d.png"
-            % self.west_id)
-        team_west = image_west.rotate(180, expand=True).convert("RGBA")
-        
-        image_north = Image.open(THISDIR + "\\images\\logos\\team%d.png"
-            % self.north_id)
-        team_north = image_north.rotate(-90, expand=True).convert("RGBA")
-
-        self.update_progress.emit(40)
-        # Let's check the file does not exist first
-        if os.path.exists(self.save_to_route+"/Table_Dif.jpg"):
-            os.remove(self.save_to_route+"/Table_Dif.jpg")
-        if os.path.exists(tempfile.gettempdir()+"/Table_Dif.jpg"):
-            os.remove(tempfile.gettempdir()+"/Table_Dif.jpg")
-
-        final_tablecloth = Image.new("RGBA", self.tablecloth.size)
-        final_tablecloth.paste(self.tablecloth, (0, 0), self.tablecloth)
-        final_tablecloth.paste(self.border, (0, 0), self.border)
-        if self.technical_lines:
-            tech_lines = Image.open(THISDIR + "\\images\\technical_lines.png")\
-                              .convert("RGBA")
-            final_tablecloth.paste(tech_lines, (0, 0), tech_lines)
-        self.update_progress.emit(50)
-        # Check that each image is full or just logo, then submit
-        if image_east.size == (1568, 786):
-            final_tablecloth.paste(team_east, (240, 1020), team_east)
-        else:
-            final_tablecloth.paste(team_east.resize((250, 250)), (900, 1325), team_east.resize((250, 250)))
-        if image_south.size == (1568, 786):
-            final_tablecloth.paste(team_south, (1020, 235), team_south)
-        else:
-            final_tablecloth.paste(team_south.resize((250, 250)), (1420, 900), team_south.resize((250, 250)))
-        if image_west.size == (1568, 786):
-            final_tablecloth.paste(team_west, (235, 240), team_west)
-        else:
-            final_tablecloth.paste(team_west.resize((250, 250)), (890, 370), team_west.resize((250, 250)))
-        if image_north.size == (1568, 786):
-            final_tablecloth.paste(team_north, (240, 240), team_north)
-        else:
-            final_tablecloth.paste(team_north.resize((250, 250)), (400, 910), team_north.resize((250, 250)))
-        self.update_progress.emit(75)
+        state = PROGRESS.start(ProgressModel.PREVIEW_STAGES if self.temp_img
+                               else ProgressModel.FINAL_STAGES)
+        progress = [0]
+
+        def on_span(finished):
+            # There's a span for every stage
+            self._emit(self.span_finished, "span_finished(PyObject)",
+                finished)
+            # The bar belongs to whatever replaced a cancelled render
+            if self._cancel.is_set():
+                return
+            # The bar never goes back, even if a stage was slower than usual
+            value = PROGRESS.advance(state, finished)
+            if value > progress[0]:
+                progress[0] = value
+                self._emit(self.update_progress, "update_progress(int)",
+                    value)
+
+        self.tracer = Tracer(on_span)
+        try:
+            with self.tracer.active():
+                if self.temp_img:
+                    # render_table already measures the final ones
+                    with memory_span("render", preview=True):
+                        saved = self._render(run_start)
+                else:
+                    saved = self._render(run_start)
+        except Cancelled:
+            saved = None
+        if self.trace_file:
+            try:
+                self.tracer.write(self.trace_file, self.trace_format)
+            except (OSError, ValueError) as error:
+                self._emit(self.trace_failed, "trace_failed(QString)",
+                    str(error))
+        if saved is None:
+            self._emit(self.cancelled, "cancelled()")
+            return
+        if not saved:
+            return
+        if __debug__:
+            end = timer()
+            print("This took %d seconds." % (end - start))
+            for finished in self.tracer.spans:
+                if finished.name == "render" \
+                and finished.args.get("peak_rss") is not None:
+                    print("Peak memory: %d MiB."
+                          % (finished.args["peak_rss"] // (1024 * 1024)))
+        self._emit(self.update_progress, "update_progress(int)", 100)
+        self.finished.emit()
+
+    def _render(self, run_start):
+        # Returns False if the final tablecloth couldn't be saved and raises
+        # Cancelled between stages once cancel() is called
+        self._check()
+        compositor = self.compositor
+        if compositor is None:
+            compositor = IncrementalCompositor(TableclothRenderer(
+                self.tablecloth, self.border, image_route=self.bg_image))
+        team_ids = (self.east_id, self.south_id, self.west_id, self.north_id)
+        if self.temp_img and self.draft:
+            draft = compositor.renderer.render(*team_ids,
+                technical_lines=self.technical_lines, scale=DRAFT_SCALE)
+            with span("preview_scale", scale=DRAFT_SCALE):
+                preview = to_qimage(preview_image(draft))
+            self._check()
+            self._emit(self.preview_ready, "preview_ready(QImage)", preview)
+            self._emit(self.timing, "timing(QString,double)", "first_frame",
+                perf_counter() - run_start)
+            if not self.refine:
+                return True
+            self._check()
         if self.temp_img is False:
-            final_tablecloth.convert("RGB").save(self.save_to_route\
-                                         +"\\Table_Dif.jpg")
+            # A tablecloth that was rendered before is just copied
+            output = render_table(compositor.renderer, team_ids,
+                self.save_to_route, self.technical_lines, compositor,
+                self.profile)
+            # If it exists, it means that the process was successful
+            if not os.path.exists(output):
+                return False
+        else:
+            final_tablecloth = compositor.render(*team_ids,
+                self.technical_lines)
+            self._check()
+            with span("preview_scale", scale=1):
+                preview = to_qimage(preview_image(final_tablecloth))
+            self._check()
+            self._emit(self.preview_ready, "preview_ready(QImage)", preview)
+        self._emit(self.timing, "timing(QString,double)", "full_render",
+            perf_counter() - run_start)
+        return True
+
+
+class RenderScheduler(QObject):
+    # Every tablecloth the GUI renders goes through one pool that lives as
+    # long as the window, instead of a new QThread per click. A preview
+    # cancels the one before it in its group, so only the latest is
+    # finished, and a final render goes ahead of any preview still waiting
+    # and cancels the tablecloth previews.
+    PREVIEW_PRIORITY = 0
+    FINAL_PRIORITY = 10
+    # The worker of a job whose run returned, finished or cancelled
+    ended = Signal(object)
+
+    def __init__(self, threads=1, parent=None):
+        super().__init__(parent)
+        # One thread by default, the compositor is shared by every render
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(threads)
+        # (worker, group) of every job until its run returns
+        self.jobs = []
+        self.ended.connect(self._release)
+
+    def preview(self, worker, group="preview"):
+        for previous, previous_group in self.jobs:
+            if previous_group == group:
+                previous.cancel()
+        self._start(worker, group, self.PREVIEW_PRIORITY)
+        return worker
+
+    def final(self, worker, cancels=("preview",)):
+        for previous, previous_group in self.jobs:
+            if previous_group in cancels:
+                previous.cancel()
+        self._start(worker, None, self.FINAL_PRIORITY)
+        return worker
+
+    def _start(self, worker, group, priority):
+        self.jobs.append((worker, group))
+        self.pool.start(lambda: self._run(worker), priority)
+
+    def _run(self, worker):
+        try:
+            worker.run()
+        finally:
+            self.ended.emit(worker)
+
+    def _release(self, worker):
+        self.jobs = [job for job in self.jobs if job[0] is not worker]
+        worker.deleteLater()
+
+    def running(self, group="preview"):
+        return any(group == job_group and not worker.is_cancelled()
+                   for worker, job_group in self.jobs)
+
+    def stop(self, msecs=-1):
+        # When the app quits: previews are dropped, final renders are
+        # allowed to finish writing
+        for worker, group in self.jobs:
+            if group is not None:
+                worker.cancel()
+        return self.pool.waitForDone(msecs)
+
+
+class ThumbnailLoader(QObject):
+    # Makes or reads the logo thumbnails in Qt's thread pool. QPixmaps can
+    # only be made in the GUI thread, so they're sent back as QImages.
+    loaded = Signal(str, QImage)
+
+    def __init__(self, thumbnails=THUMBNAILS, parent=None):
+        super().__init__(parent)
+        self.thumbnails = thumbnails
+        self._pending = set()
+        self.loaded.connect(self._done)
+
+    def request(self, logo):
+        # A logo that's already being loaded isn't loaded twice
+        if logo in self._pending:
+            return
+        self._pending.add(logo)
+        QThreadPool.globalInstance().start(lambda: self._load(logo))
+
+    def _load(self, logo):
+        try:
+            image = QImage(self.thumbnails.get(logo))
+        except OSError:
+            image = QImage()
+        self.loaded.emit(logo, image)
+
+    def _done(self, logo, image):
+        self._pending.discard(logo)
+
+
+class PackThread(QObject):
+    # Imports or exports a team pack (see teampack.py) so the GUI keeps
+    # responding, however many teams it has. work is called with the
+    # progress callback and the cancel event, like the teampack functions
+    # take them.
+    finished = Signal()
+    # Logos done and how many there are
+    progress = Signal(int, int)
+    # What teampack returned, once it's all written
+    done = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, work, parent=None):
+        super().__init__(parent)
+        self.work = work
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        # From the GUI thread, it stops before the next logo
+        self._cancel.set()
+
+    def _progress(self, done, total):
+        if self.receivers(SIGNAL("progress(int,int)")):
+            self.progress.emit(done, total)
+
+    def run(self):
+        try:
+            result = self.work(self._progress, self._cancel)
+        except Cancelled:
+            self.cancelled.emit()
+        except (PackError, OSError) as error:
+            self.failed.emit(str(error))
         else:
-            final_tablecloth.convert("RGB").save(tempfile.gettempdir()\
-                                         +"\\Table_Dif.jpg")
-        self.update_progress.emit(90)
-        # If it exists, it means that the process was successful
-        if os.path.exists(self.save_to_route+"/Table_Dif.jpg")\
-        or os.path.exists(tempfile.gettempdir()+"\\Table_Dif.jpg"):
-            if __debug__:
-                end = timer()
-                print("This took %d seconds." % (end - start))
-            self.update_progress.emit(100)
-            self.finished.emit()
\ No newline at end of file
+            self.done.emit(result)
+        self.finished.emit()
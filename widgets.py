@@ -1,5 +1,10 @@
 # widgets.py - Soon to hold separate widget classes
-from PySide6.QtWidgets import QWidget, QMessageBox
+# Standard python library
+from difflib import SequenceMatcher
+# GUI libraries
+from PySide6.QtCore import (Qt, QAbstractListModel, QModelIndex, QStringListModel,
+    QTimer)
+from PySide6.QtWidgets import QWidget, QMessageBox, QCompleter
 
 class EditionWidget(QWidget):
 
@@ -18,4 +23,136 @@ class EditionWidget(QWidget):
         if response == QMessageBox.Yes:
             event.accept()
         else:
-            event.ignore()
\ No newline at end of file
+            event.ignore()
+
+
+class PlayerCompleter(QCompleter):
+    # Suggests the players search() ranks best for what's typed, instead of
+    # filtering every player name itself
+
+    def __init__(self, search, parent=None):
+        super().__init__(parent)
+        self.search = search
+        self.setModel(QStringListModel(self))
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(Qt.CaseInsensitive)
+
+    def update(self, text):
+        players = []
+        for player, team in self.search(text):
+            if player not in players:
+                players.append(player)
+        self.model().setStringList(players)
+
+
+class RosterModel(QAbstractListModel):
+    # Every player of the registry, team after team, shared by the seat
+    # comboboxes. The team is the item data. Edits go through the model so
+    # only the rows that changed are inserted or removed.
+
+    def __init__(self, registry, parent=None):
+        super().__init__(parent)
+        self.registry = registry
+        self._rows = registry.player_items()
+        self._offsets = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        member, team = self._rows[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return member
+        if role == Qt.UserRole:
+            return team
+        return None
+
+    def _offset(self, team):
+        # Row of the first member of the team
+        if self._offsets is None:
+            self._offsets = {}
+            row = 0
+            for name in self.registry.teams:
+                self._offsets.setdefault(name, row)
+                row += len(self.registry.players[name])
+        return self._offsets[team]
+
+    def row_of(self, member, team):
+        # -1 if the player isn't in the team
+        if team not in self.registry or member not in \
+           self.registry.players[team]:
+            return -1
+        return self._offset(team) + self.registry.players[team].index(member)
+
+    def set_registry(self, registry):
+        # A whole new roster, like after an import
+        self.beginResetModel()
+        self.registry = registry
+        self._rows = registry.player_items()
+        self._offsets = None
+        self.endResetModel()
+
+    def add_team(self, team, members=()):
+        first = len(self._rows)
+        team_id = self.registry.add_team(team, members)
+        self._offsets = None
+        if self.registry.players[team]:
+            self.beginInsertRows(QModelIndex(), first,
+                first + len(self.registry.players[team]) - 1)
+            self._rows.extend((member, team)
+                              for member in self.registry.players[team])
+            self.endInsertRows()
+        return team_id
+
+    def remove_team(self, team):
+        first = self._offset(team)
+        count = len(self.registry.players[team])
+        if count:
+            self.beginRemoveRows(QModelIndex(), first, first + count - 1)
+        del self._rows[first:first + count]
+        team_id = self.registry.remove_team(team)
+        self._offsets = None
+        if count:
+            self.endRemoveRows()
+        return team_id
+
+    def set_members(self, team, members):
+        # Only the members that changed are removed or inserted, from the
+        # last change backwards so the rows before it don't move
+        first = self._offset(team)
+        old = list(self.registry.players[team])
+        new = list(members)
+        opcodes = SequenceMatcher(None, old, new, autojunk=False)\
+                  .get_opcodes()
+        self.registry.set_members(team, new)
+        for tag, old_start, old_end, new_start, new_end in reversed(opcodes):
+            if tag in ("delete", "replace"):
+                self.beginRemoveRows(QModelIndex(), first + old_start,
+                    first + old_end - 1)
+                del self._rows[first + old_start:first + old_end]
+                self.endRemoveRows()
+            if tag in ("insert", "replace"):
+                self.beginInsertRows(QModelIndex(), first + old_start,
+                    first + old_start + new_end - new_start - 1)
+                self._rows[first + old_start:first + old_start] = \
+                    [(member, team) for member in new[new_start:new_end]]
+                self.endInsertRows()
+        self._offsets = None
+
+
+class SaveTimer(QTimer):
+    # threading.Timer for the JsonStore of the GUI: the write runs in the GUI
+    # thread, between edits instead of in the middle of one
+
+    def __init__(self, interval, function, parent=None):
+        super().__init__(parent)
+        self.setSingleShot(True)
+        self.setInterval(int(interval * 1000))
+        self.timeout.connect(function)
+
+    def cancel(self):
+        self.stop()